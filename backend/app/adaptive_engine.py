@@ -0,0 +1,220 @@
+import random
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+LEVELS = ['base', 'medio', 'avanzato']
+
+# Item difficulty (b) anchor for each level, on the logit scale
+LEVEL_DIFFICULTY = {'base': -1.0, 'medio': 0.0, 'avanzato': 1.0}
+
+# Upper bounds of the ability ranges mapped to each level
+LEVEL_THRESHOLDS = [(-0.5, 'base'), (0.5, 'medio')]
+
+DEFAULT_DISCRIMINATION = 1.0
+PRIOR_MEAN = -1.0
+PRIOR_SD = 1.0
+
+THETA_MIN = -4.0
+THETA_MAX = 4.0
+THETA_SCORE_SCALE = 12.5
+
+
+def theta_to_score(theta: float) -> int:
+    """Map a logit ability estimate onto the 0-100 scale stored in ParticipantProgress.theta"""
+    return int(round(min(100.0, max(0.0, 50.0 + theta * THETA_SCORE_SCALE))))
+
+
+def score_to_theta(score: int) -> float:
+    """Inverse of theta_to_score"""
+    return (score - 50.0) / THETA_SCORE_SCALE
+
+
+def level_for_theta(theta: float) -> str:
+    """Level label whose difficulty range contains the given ability"""
+    for upper, level in LEVEL_THRESHOLDS:
+        if theta < upper:
+            return level
+    return 'avanzato'
+
+
+INITIAL_THETA_SCORE = theta_to_score(PRIOR_MEAN)
+
+
+def item_parameters(question_data: Dict) -> Tuple[float, float, float]:
+    """
+    3PL parameters (a, b, c) for a question.
+    Explicit irt_a/irt_b/irt_c keys win; otherwise b is derived from level and
+    difficulty and the guessing floor from the number of options.
+    """
+    level = question_data.get('level', 'base')
+    difficulty = question_data.get('difficulty') or 2
+    b = question_data.get('irt_b')
+    if b is None:
+        b = LEVEL_DIFFICULTY.get(level, 0.0) + 0.25 * (float(difficulty) - 2.0)
+    a = question_data.get('irt_a', DEFAULT_DISCRIMINATION)
+    c = question_data.get('irt_c')
+    if c is None:
+        n_options = len(question_data.get('options') or [])
+        c = 1.0 / n_options if n_options > 1 else 0.0
+    return float(a), float(b), float(c)
+
+
+class ItemBank:
+    """Question bank with item parameters precomputed into contiguous arrays"""
+
+    def __init__(self, questions: Sequence[Dict], hashes: Sequence[str]):
+        self.questions = list(questions)
+        self.hashes = list(hashes)
+        self.index: Dict[str, int] = {h: i for i, h in enumerate(self.hashes)}
+
+        params = np.array([item_parameters(q) for q in self.questions], dtype=np.float64).reshape(-1, 3)
+        self.a = params[:, 0].copy()
+        self.b = params[:, 1].copy()
+        self.c = params[:, 2].copy()
+        # Terms of the 3PL information function that do not depend on theta
+        self._info_scale = self.a ** 2 / (1.0 - self.c) ** 2
+        # Ability at which each item is most informative, kept sorted so that
+        # selection only scores a window of items around the current theta
+        peak = self.b + np.log((1.0 + np.sqrt(1.0 + 8.0 * self.c)) / 2.0) / self.a
+        self.peak_order = np.argsort(peak, kind='stable')
+        self.sorted_peak = peak[self.peak_order]
+
+        self.topics: List[str] = []
+        topic_codes: Dict[str, int] = {}
+        codes = []
+        for q in self.questions:
+            topic = q.get('topic', 'Generale')
+            if topic not in topic_codes:
+                topic_codes[topic] = len(self.topics)
+                self.topics.append(topic)
+            codes.append(topic_codes[topic])
+        self.topic_codes = topic_codes
+        self.topic_index = np.array(codes, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def probability(self, theta: float, indices=None) -> np.ndarray:
+        """Probability of a correct answer at theta for all (or the given) items"""
+        a, b, c = (self.a, self.b, self.c) if indices is None else (self.a[indices], self.b[indices], self.c[indices])
+        return c + (1.0 - c) / (1.0 + np.exp(-a * (theta - b)))
+
+    def information(self, theta: float, indices=None) -> np.ndarray:
+        """Fisher information of each item at theta"""
+        p = self.probability(theta, indices)
+        c = self.c if indices is None else self.c[indices]
+        scale = self._info_scale if indices is None else self._info_scale[indices]
+        return scale * (p - c) ** 2 * (1.0 - p) / p
+
+    def available_mask(self, served_hashes_set: set, topic: Optional[str] = None) -> np.ndarray:
+        """Boolean mask of items not yet served, restricted to topic when it has any left"""
+        mask = np.ones(len(self), dtype=bool)
+        served = [self.index[h] for h in served_hashes_set if h in self.index]
+        if served:
+            mask[served] = False
+        if topic is not None and topic in self.topic_codes:
+            topic_mask = mask & (self.topic_index == self.topic_codes[topic])
+            if topic_mask.any():
+                return topic_mask
+        return mask
+
+
+class AbilityEstimator:
+    """Expected a posteriori ability estimate over a fixed quadrature grid"""
+
+    def __init__(self, prior_mean: float = PRIOR_MEAN, prior_sd: float = PRIOR_SD, points: int = 81):
+        self.grid = np.linspace(THETA_MIN, THETA_MAX, points)
+        self.log_prior = -0.5 * ((self.grid - prior_mean) / prior_sd) ** 2
+
+    def estimate(self, params: Sequence[Tuple[float, float, float]], responses: Sequence[bool]) -> float:
+        """Posterior mean of theta given item parameters and correctness of each response"""
+        log_post = self.log_prior.copy()
+        if len(responses):
+            p_arr = np.asarray(params, dtype=np.float64).reshape(-1, 3)
+            a, b, c = p_arr[:, 0:1], p_arr[:, 1:2], p_arr[:, 2:3]
+            p = c + (1.0 - c) / (1.0 + np.exp(-a * (self.grid - b)))
+            p = np.clip(p, 1e-9, 1.0 - 1e-9)
+            u = np.asarray(responses, dtype=bool)[:, None]
+            log_post += np.where(u, np.log(p), np.log1p(-p)).sum(axis=0)
+        weights = np.exp(log_post - log_post.max())
+        weights /= weights.sum()
+        return float(np.dot(weights, self.grid))
+
+
+class SelectionEngine(ABC):
+    """Base class for item selection strategies"""
+
+    name = 'base'
+
+    @abstractmethod
+    def select(self, bank: ItemBank, theta: float, served_hashes_set: set, topic: Optional[str] = None) -> Optional[int]:
+        """Index in bank of the item to serve next, None when every item was served"""
+
+
+class MaxInformationEngine(SelectionEngine):
+    """
+    Picks the item with maximum Fisher information at the current ability.
+    Only the window items whose information peaks closest to theta are scored,
+    widening to the full bank when the window has too few unserved items.
+    To limit item exposure the final choice is random among the top_k candidates.
+    """
+
+    name = 'irt'
+
+    def __init__(self, top_k: int = 3, window: int = 256):
+        self.top_k = top_k
+        self.window = window
+
+    def select(self, bank: ItemBank, theta: float, served_hashes_set: set, topic: Optional[str] = None) -> Optional[int]:
+        mask = bank.available_mask(served_hashes_set, topic)
+        candidates = None
+        if len(bank) > 2 * self.window:
+            pos = int(np.searchsorted(bank.sorted_peak, theta))
+            window = bank.peak_order[max(0, pos - self.window):pos + self.window]
+            candidates = window[mask[window]]
+            if candidates.size < self.top_k:
+                candidates = None
+        if candidates is None:
+            candidates = np.flatnonzero(mask)
+        if candidates.size == 0:
+            return None
+        info = bank.information(theta, candidates)
+        if candidates.size > self.top_k:
+            best = np.argpartition(info, -self.top_k)[-self.top_k:]
+        else:
+            best = np.arange(candidates.size)
+        return int(candidates[random.choice(best.tolist())])
+
+
+class RandomEngine(SelectionEngine):
+    """Uniform random choice among unserved items of the level matching theta"""
+
+    name = 'random'
+
+    def select(self, bank: ItemBank, theta: float, served_hashes_set: set, topic: Optional[str] = None) -> Optional[int]:
+        mask = bank.available_mask(served_hashes_set, topic)
+        target = LEVEL_DIFFICULTY[level_for_theta(theta)]
+        level_mask = mask & (np.abs(bank.b - target) < 0.5)
+        candidates = np.flatnonzero(level_mask if level_mask.any() else mask)
+        if candidates.size == 0:
+            return None
+        return int(random.choice(candidates.tolist()))
+
+
+SELECTION_ENGINES = {
+    MaxInformationEngine.name: MaxInformationEngine,
+    RandomEngine.name: RandomEngine,
+}
+
+
+def get_selection_engine(name: str) -> SelectionEngine:
+    """Instantiate a registered selection engine by name"""
+    try:
+        return SELECTION_ENGINES[name]()
+    except KeyError:
+        raise ValueError(f"Unknown selection engine '{name}'. Available: {', '.join(SELECTION_ENGINES)}")
+
+
+ability_estimator = AbilityEstimator()
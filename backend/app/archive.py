@@ -0,0 +1,323 @@
+"""
+Retention for finished sessions.
+
+The answer data of an ended session (live_answers, served_questions and
+session_questions, plus its final report) is streamed into one gzip-compressed
+JSONL file per session and the rows are then deleted, so the live tables only
+hold running sessions. Each line is {"table": ..., "row": {...}}.
+
+Archives are written under ARCHIVE_DIR, which must be an absolute path on
+durable storage that every worker can read; nothing is archived (or deleted)
+while it is unset. The file's location is recorded on the session row before
+the answer rows are deleted in batches, so an interrupted run can be resumed.
+
+    python -m app.archive                    # archive ended sessions created over ARCHIVE_AFTER_HOURS ago
+    python -m app.archive --live-id <id>     # archive one ended session now
+    python -m app.archive --partition-ddl    # print the optional Postgres partition layout
+"""
+import argparse
+import datetime
+import gzip
+import json
+import os
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import delete, exists, or_, select, tuple_
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal, engine
+from app.models import LiveAnswer, LiveParticipant, LiveSession, ServedQuestion, SessionQuestion
+from app.reports import build_report
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR")
+ARCHIVE_AFTER_HOURS = float(os.getenv("ARCHIVE_AFTER_HOURS", "24"))
+ARCHIVE_FETCH_SIZE = 1000
+ARCHIVE_DELETE_BATCH = 1000
+
+
+class ArchiveError(Exception):
+    pass
+
+
+class ArchiveNotConfigured(ArchiveError):
+    pass
+
+
+def archive_dir() -> str:
+    if not ARCHIVE_DIR or not os.path.isabs(ARCHIVE_DIR):
+        raise ArchiveNotConfigured("ARCHIVE_DIR must be set to an absolute path on durable storage shared by every worker")
+    return ARCHIVE_DIR
+
+
+def archive_location(live_id: str) -> Optional[str]:
+    """Where a session's archive was written, None while it is not archived"""
+    db = SessionLocal()
+    try:
+        return db.query(LiveSession.archive_location).filter(LiveSession.live_id == live_id).scalar()
+    finally:
+        db.close()
+
+
+def is_archived(live_id: str) -> bool:
+    return archive_location(live_id) is not None
+
+
+def _session_participants(live_id: str):
+    return select(LiveParticipant.participant_id).where(LiveParticipant.live_id == live_id)
+
+
+def _archived_tables(live_id: str):
+    """(table name, table, filter) of every row archived and deleted for a session"""
+    return [
+        ("live_answers", LiveAnswer.__table__, LiveAnswer.live_id == live_id),
+        ("served_questions", ServedQuestion.__table__, ServedQuestion.participant_id.in_(_session_participants(live_id))),
+        ("session_questions", SessionQuestion.__table__, SessionQuestion.live_id == live_id),
+    ]
+
+
+class _CopyLineWriter:
+    """File-like target for COPY TO STDOUT that wraps each row_to_json line as an archive record"""
+
+    def __init__(self, out, table: str):
+        self.out = out
+        self.prefix = f'{{"table":"{table}","row":'.encode()
+        self.pending = b""
+        self.rows = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        lines = (self.pending + data).split(b"\n")
+        self.pending = lines.pop()
+        for line in lines:
+            self.out.write(self.prefix + line + b"}\n")
+            self.rows += 1
+
+
+def _copy_postgres(db: Session, out, name: str, table, condition) -> int:
+    """Stream a table's rows with COPY: row_to_json is done by the server, nothing is parsed here"""
+    query = select(table).where(condition)
+    compiled = query.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True})
+    # CSV with control characters as quote and delimiter leaves the JSON text untouched
+    copy_sql = f"COPY (SELECT row_to_json(t) FROM ({compiled}) t) TO STDOUT WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')"
+    writer = _CopyLineWriter(out, name)
+    raw = db.connection().connection
+    with raw.cursor() as cursor:
+        cursor.copy_expert(copy_sql, writer)
+    return writer.rows
+
+
+def _copy_streaming(db: Session, out, name: str, table, condition) -> int:
+    rows = 0
+    result = db.execute(select(table).where(condition).execution_options(yield_per=ARCHIVE_FETCH_SIZE))
+    for row in result.mappings():
+        out.write((json.dumps({"table": name, "row": dict(row)}, default=str) + "\n").encode())
+        rows += 1
+    return rows
+
+
+def _purge(live_id: str) -> Dict:
+    """
+    Delete a session's archived rows ARCHIVE_DELETE_BATCH at a time, one transaction
+    per batch, so the database writer is never held for a whole session
+    """
+    deleted = {}
+    for name, table, condition in _archived_tables(live_id):
+        key_columns = list(table.primary_key.columns)
+        key = tuple_(*key_columns) if len(key_columns) > 1 else key_columns[0]
+        batch = select(*key_columns).where(condition).limit(ARCHIVE_DELETE_BATCH)
+        deleted[name] = 0
+        while True:
+            db = SessionLocal()
+            try:
+                rowcount = db.execute(delete(table).where(key.in_(batch))).rowcount
+                db.commit()
+            finally:
+                db.close()
+            deleted[name] += rowcount
+            if rowcount < ARCHIVE_DELETE_BATCH:
+                break
+    return deleted
+
+
+def _write_archive(db: Session, live_session: LiveSession, directory: str) -> Tuple[str, Dict]:
+    """Stream the session into a new archive file, synced and renamed into place"""
+    live_id = live_session.live_id
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{live_id}.jsonl.gz")
+    if os.path.exists(path):
+        raise ArchiveError(f"{path} already exists and is not recorded for this session")
+    partial = path + ".partial"
+    counts = {}
+    copy = _copy_postgres if engine.dialect.name == "postgresql" else _copy_streaming
+    with open(partial, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as out:
+        out.write((json.dumps({"table": "live_sessions", "row": {
+            "live_id": live_session.live_id,
+            "code": live_session.code,
+            "title": live_session.title,
+            "status": live_session.status,
+            "created_at": live_session.created_at
+        }}, default=str) + "\n").encode())
+        report = build_report(db, live_id)
+        for row in report:
+            out.write((json.dumps({"table": "report", "row": row}) + "\n").encode())
+        counts["report"] = len(report)
+        for name, table, condition in _archived_tables(live_id):
+            counts[name] = copy(db, out, name, table, condition)
+    with open(partial, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(partial, path)
+    return path, counts
+
+
+def archive_session(live_id: str) -> Dict:
+    """
+    Write an ended session's answer data to its archive file, then delete the rows.
+    The file is complete, renamed into place and recorded on the session before
+    anything is deleted; a session already recorded only has its rows deleted.
+    """
+    directory = archive_dir()
+    db = SessionLocal()
+    try:
+        live_session = db.query(LiveSession).filter(LiveSession.live_id == live_id).first()
+        if not live_session:
+            raise ArchiveError("Session not found")
+        if live_session.status != 'ended':
+            raise ArchiveError("Only ended sessions can be archived")
+        path = live_session.archive_location
+        if path is not None:
+            counts = {}
+        else:
+            path, counts = _write_archive(db, live_session, directory)
+            live_session.archive_location = path
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    return {"live_id": live_id, "archive": path, "rows": counts, "deleted": _purge(live_id)}
+
+
+def sessions_to_archive(db: Session, older_than_hours: float = ARCHIVE_AFTER_HOURS) -> List[str]:
+    """Ended sessions old enough to archive, and archived ones whose rows were not all deleted"""
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=older_than_hours)
+    leftover = or_(
+        exists().where(LiveAnswer.live_id == LiveSession.live_id),
+        exists().where(SessionQuestion.live_id == LiveSession.live_id)
+    )
+    rows = db.query(LiveSession.live_id).filter(
+        LiveSession.status == 'ended',
+        or_(
+            (LiveSession.archive_location.is_(None)) & (LiveSession.created_at < cutoff),
+            LiveSession.archive_location.isnot(None) & leftover
+        )
+    ).all()
+    return [row.live_id for row in rows]
+
+
+def archive_ended_sessions(older_than_hours: float = ARCHIVE_AFTER_HOURS) -> List[Dict]:
+    archive_dir()
+    db = SessionLocal()
+    try:
+        live_ids = sessions_to_archive(db, older_than_hours)
+    finally:
+        db.close()
+    return [archive_session(live_id) for live_id in live_ids]
+
+
+def iter_archive(live_id: str, table: Optional[str] = None) -> Iterator[Dict]:
+    """Rows of an archive file, optionally only those of one table"""
+    location = archive_location(live_id)
+    if location is None:
+        raise ArchiveError("Session not archived")
+    with gzip.open(location, "rt", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if table is None or record["table"] == table:
+                yield record["row"]
+
+
+def partition_ddl(months: int = 12, start: Optional[datetime.date] = None, hash_partitions: int = 16) -> str:
+    """
+    Optional Postgres layout keeping live tables small: live_answers is range
+    partitioned by month (an archived month is detached and dropped as a whole),
+    session_questions and served_questions are hash partitioned by session and
+    participant. Meant to be applied to a new database before the app creates its
+    tables; create_all leaves existing tables alone.
+    """
+    start = (start or datetime.date.today()).replace(day=1)
+    statements = [
+        """CREATE TABLE live_answers (
+    id SERIAL,
+    live_id VARCHAR NOT NULL REFERENCES live_sessions (live_id),
+    participant_id VARCHAR NOT NULL REFERENCES participants (participant_id),
+    question_json JSON NOT NULL,
+    answer_index INTEGER,
+    correct BOOLEAN,
+    elapsed_ms INTEGER,
+    question_hash VARCHAR,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);""",
+        "CREATE INDEX ix_live_answers_live_id ON live_answers (live_id);",
+        "CREATE INDEX ix_live_answers_question_hash ON live_answers (question_hash);",
+    ]
+    month = start
+    for _ in range(months):
+        following = (month.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+        statements.append(
+            f"CREATE TABLE live_answers_{month:%Y_%m} PARTITION OF live_answers "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{following.isoformat()}');"
+        )
+        month = following
+    statements.append("CREATE TABLE live_answers_default PARTITION OF live_answers DEFAULT;")
+
+    statements.append("""CREATE TABLE session_questions (
+    id SERIAL,
+    live_id VARCHAR NOT NULL REFERENCES live_sessions (live_id),
+    question_data JSON NOT NULL,
+    question_hash VARCHAR NOT NULL,
+    level VARCHAR NOT NULL,
+    topic VARCHAR NOT NULL,
+    PRIMARY KEY (id, live_id)
+) PARTITION BY HASH (live_id);""")
+    statements.append("CREATE INDEX ix_session_questions_live_id ON session_questions (live_id);")
+    statements.append("""CREATE TABLE served_questions (
+    participant_id VARCHAR NOT NULL REFERENCES participants (participant_id),
+    question_hash VARCHAR NOT NULL,
+    question_data JSON,
+    answered BOOLEAN DEFAULT false,
+    PRIMARY KEY (participant_id, question_hash)
+) PARTITION BY HASH (participant_id);""")
+    for table in ("session_questions", "served_questions"):
+        for remainder in range(hash_partitions):
+            statements.append(
+                f"CREATE TABLE {table}_p{remainder} PARTITION OF {table} "
+                f"FOR VALUES WITH (MODULUS {hash_partitions}, REMAINDER {remainder});"
+            )
+    return "\n".join(statements) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--live-id", help="archive this ended session regardless of age")
+    parser.add_argument("--older-than-hours", type=float, default=ARCHIVE_AFTER_HOURS)
+    parser.add_argument("--partition-ddl", action="store_true", help="print the Postgres partition layout and exit")
+    parser.add_argument("--months", type=int, default=12, help="monthly live_answers partitions to create")
+    args = parser.parse_args()
+
+    if args.partition_ddl:
+        print(partition_ddl(args.months), end="")
+        return
+
+    try:
+        results = [archive_session(args.live_id)] if args.live_id else archive_ended_sessions(args.older_than_hours)
+    except ArchiveError as e:
+        parser.error(str(e))
+    for result in results:
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,85 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql.dml import UpdateBase
 from app.models import Base
+from app.metrics import TimedQueuePool
 import os
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./quiz_app.db")
 
-if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# "tuned": WAL, pragmas on connect, one serialized writer and a pool of readers.
+# "basic": a single engine with SQLite defaults (rollback journal, full fsync).
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "tuned")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_CACHE_KIB = int(os.getenv("SQLITE_CACHE_KIB", "65536"))
+SQLITE_MMAP_BYTES = int(os.getenv("SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_READERS = int(os.getenv("SQLITE_READERS", "8"))
+
+
+def _apply_pragmas(query_only: bool):
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KIB}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_BYTES}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        if query_only:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+    return on_connect
+
+
+def create_sqlite_engines(url: str):
+    """
+    Writer and reader engines for the tuned profile. The writer pool holds a single
+    connection, so commits queue at checkout instead of failing with "database is
+    locked"; WAL lets the readers run alongside it. A transaction must not await
+    while it holds the writer, or every other writer blocks behind it.
+    """
+    connect_args = {"check_same_thread": False}
+    writer = create_engine(url, connect_args=connect_args, poolclass=TimedQueuePool, pool_size=1, max_overflow=0)
+    reader = create_engine(url, connect_args=connect_args, poolclass=TimedQueuePool, pool_size=SQLITE_READERS, max_overflow=4 * SQLITE_READERS)
+    event.listen(writer, "connect", _apply_pragmas(query_only=False))
+    event.listen(reader, "connect", _apply_pragmas(query_only=True))
+    return writer, reader
+
+
+class RoutingSession(Session):
+    """
+    Sends reads to the reader pool and writes to the single writer. Once a transaction
+    has written, everything up to its commit or rollback stays on the writer so it
+    reads its own changes.
+    """
+    writer = None
+    reader = None
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.info.get("writing") or self._flushing or isinstance(clause, UpdateBase):
+            self.info["writing"] = True
+            return self.writer
+        return self.reader
+
+
+@event.listens_for(RoutingSession, "after_transaction_end")
+def _release_writer(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("writing", None)
+
+
+if DATABASE_URL.startswith("sqlite") and SQLITE_PROFILE == "tuned":
+    engine, read_engine = create_sqlite_engines(DATABASE_URL)
+    RoutingSession.writer, RoutingSession.reader = engine, read_engine
+    SessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False)
 else:
-    engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    if DATABASE_URL.startswith("sqlite"):
+        engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False}, poolclass=TimedQueuePool)
+    else:
+        engine = create_engine(DATABASE_URL, poolclass=TimedQueuePool)
+    read_engine = engine
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def create_tables():
     Base.metadata.create_all(bind=engine)
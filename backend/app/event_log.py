@@ -0,0 +1,108 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import traceback
+from typing import Dict, Optional
+
+# Per-message events are DEBUG by default so a broadcast to a full class logs one line, not hundreds
+DEFAULT_EVENT_LEVELS = {
+    "ws.sent": "DEBUG",
+    "ws.teacher_sent": "DEBUG",
+    "session.question_sent": "DEBUG",
+}
+
+
+def _parse_mapping(raw: str) -> Dict[str, str]:
+    """Parse "event=value,event=value" settings"""
+    mapping = {}
+    for item in raw.split(","):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            mapping[key.strip()] = value.strip()
+    return mapping
+
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# e.g. LOG_EVENT_LEVELS="ws.sent=INFO,ws.connected=DEBUG"
+EVENT_LEVELS = {
+    event: logging.getLevelName(level.upper())
+    for event, level in {**DEFAULT_EVENT_LEVELS, **_parse_mapping(os.getenv("LOG_EVENT_LEVELS", ""))}.items()
+}
+# e.g. LOG_SAMPLE_RATES="ws.sent=0.01" keeps about one in a hundred of those events
+SAMPLE_RATES = {event: float(rate) for event, rate in _parse_mapping(os.getenv("LOG_SAMPLE_RATES", "")).items()}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, event and the event's fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": getattr(record, "event", None) or record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, default=str)
+
+
+class EventLogger:
+    """
+    Structured logger: each call names an event and its fields. The level and sample
+    rate of an event are resolved before anything is formatted, and records are only
+    queued here; a background thread does the writing.
+    """
+
+    def __init__(self, logger: logging.Logger):
+        self.logger = logger
+
+    def event(self, name: str, level: int = logging.INFO, exc_info: bool = False, **fields):
+        level = EVENT_LEVELS.get(name, level)
+        if not self.logger.isEnabledFor(level):
+            return
+        rate = SAMPLE_RATES.get(name)
+        if rate is not None:
+            if random.random() >= rate:
+                return
+            fields["sample_rate"] = rate
+        if exc_info:
+            # Formatted here: the queue handler drops exc_info before the writer thread sees it
+            fields["exc"] = traceback.format_exc()
+        self.logger.log(level, name, extra={"event": name, "fields": fields})
+
+    def warning(self, name: str, **fields):
+        self.event(name, logging.WARNING, **fields)
+
+    def error(self, name: str, **fields):
+        self.event(name, logging.ERROR, **fields)
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging():
+    """Route the "app" loggers through a queue drained by a background writer thread"""
+    global _listener
+    if _listener is not None:
+        return
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    writer = logging.StreamHandler(sys.stdout)
+    writer.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(records, writer, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger("app")
+    root.handlers = [logging.handlers.QueueHandler(records)]
+    root.setLevel(LOG_LEVEL)
+    root.propagate = False
+
+
+def get_logger(name: str) -> EventLogger:
+    configure_logging()
+    return EventLogger(logging.getLogger(name))
@@ -0,0 +1,185 @@
+import asyncio
+import math
+import os
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.event_log import get_logger
+from app.models import LiveAnswer
+from app.question_service import question_service
+from app.sharding import shards
+from app.websocket_manager import manager
+
+ANALYTICS_PUSH_SECONDS = float(os.getenv("ANALYTICS_PUSH_SECONDS", "5"))
+ANALYTICS_FETCH_SIZE = 1000
+
+log = get_logger("app.item_analytics")
+
+
+def answer_question_hash(question_hash: Optional[str], question_json: Optional[Dict]) -> Optional[str]:
+    """Hash of the answered question; rows written before LiveAnswer.question_hash derive it from question_json"""
+    if question_hash:
+        return question_hash
+    if question_json and 'question' in question_json and 'options' in question_json:
+        return question_service.generate_question_hash(question_json)
+    return None
+
+
+class ItemStats:
+    """Running aggregates of one question: counts, Welford mean/variance of elapsed_ms, option histogram"""
+    __slots__ = ('topic', 'level', 'attempts', 'correct', 'timeouts', 'timed', 'mean_ms', 'm2_ms', 'options')
+
+    def __init__(self, topic: Optional[str], level: Optional[str], n_options: int):
+        self.topic = topic
+        self.level = level
+        self.attempts = 0
+        self.correct = 0
+        self.timeouts = 0
+        self.timed = 0
+        self.mean_ms = 0.0
+        self.m2_ms = 0.0
+        self.options = [0] * n_options
+
+    def observe(self, answer_index: Optional[int], correct: bool, elapsed_ms: Optional[int]):
+        self.attempts += 1
+        if correct:
+            self.correct += 1
+        if answer_index is None:
+            # Timeouts carry the round length, not a response time
+            self.timeouts += 1
+            return
+        if 0 <= answer_index < len(self.options):
+            self.options[answer_index] += 1
+        if elapsed_ms is not None:
+            self.timed += 1
+            delta = elapsed_ms - self.mean_ms
+            self.mean_ms += delta / self.timed
+            self.m2_ms += delta * (elapsed_ms - self.mean_ms)
+
+    def summary(self, question_hash: str) -> Dict:
+        timed = self.timed
+        return {
+            "question_hash": question_hash,
+            "topic": self.topic,
+            "level": self.level,
+            "attempts": self.attempts,
+            "correct": self.correct,
+            "p_correct": round(self.correct / self.attempts, 4) if self.attempts else None,
+            "timeouts": self.timeouts,
+            "mean_elapsed_ms": round(self.mean_ms, 1) if timed else None,
+            "sd_elapsed_ms": round(math.sqrt(self.m2_ms / (timed - 1)), 1) if timed > 1 else None,
+            "options": list(self.options)
+        }
+
+
+class ItemAnalytics:
+    """
+    Per-question statistics of each session, updated as answers arrive so no query
+    ever scans live_answers for them. Memory is one ItemStats per question served.
+    A session's aggregates are rebuilt from its answers the first time it is
+    touched in this process (after a restart or a move to another worker), and
+    changed questions are pushed to the teacher every ANALYTICS_PUSH_SECONDS.
+    Aggregates are only kept while this worker holds the session's shard lease;
+    without one they are rebuilt from the database whenever they are needed.
+    """
+
+    def __init__(self):
+        self.sessions: Dict[str, Dict[str, ItemStats]] = {}
+        self.dirty: Dict[str, Set[str]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _stats(self, items: Dict[str, ItemStats], question_hash: str, question_data: Optional[Dict]) -> ItemStats:
+        stats = items.get(question_hash)
+        if stats is None:
+            question_data = question_data or {}
+            stats = items[question_hash] = ItemStats(
+                question_data.get('topic'), question_data.get('level'), len(question_data.get('options') or [])
+            )
+        return stats
+
+    def rebuild(self, answers: Iterable[Dict]) -> Dict[str, ItemStats]:
+        """Aggregates from answer rows in insertion order, e.g. of an ended or archived session"""
+        items: Dict[str, ItemStats] = {}
+        for row in answers:
+            question_hash = answer_question_hash(row.get('question_hash'), row.get('question_json'))
+            if question_hash is None:
+                continue
+            self._stats(items, question_hash, row.get('question_json')).observe(
+                row.get('answer_index'), bool(row.get('correct')), row.get('elapsed_ms')
+            )
+        return items
+
+    def query(self, db: Session, live_id: str) -> Dict[str, ItemStats]:
+        result = db.query(
+            LiveAnswer.question_hash, LiveAnswer.question_json, LiveAnswer.answer_index,
+            LiveAnswer.correct, LiveAnswer.elapsed_ms
+        ).filter(LiveAnswer.live_id == live_id).order_by(LiveAnswer.id).execution_options(yield_per=ANALYTICS_FETCH_SIZE)
+        return self.rebuild(row._asdict() for row in result)
+
+    def load(self, db: Session, live_id: str) -> Dict[str, ItemStats]:
+        """Aggregates of a running session, kept in memory from now on while this worker holds its lease"""
+        if not shards.holds(live_id):
+            # Other workers record answers for it too
+            self.sessions.pop(live_id, None)
+            return self.query(db, live_id)
+        items = self.sessions.get(live_id)
+        if items is None:
+            items = self.sessions[live_id] = self.query(db, live_id)
+        return items
+
+    def reread(self, live_id: str) -> Dict[str, ItemStats]:
+        db = SessionLocal()
+        try:
+            return self.query(db, live_id)
+        finally:
+            db.close()
+
+    def record(self, db: Session, live_id: str, question_hash: str, question_data: Dict, answer_index: Optional[int], correct: bool, elapsed_ms: Optional[int]):
+        """
+        Add a committed answer (answer_index None for a timeout) to its question's
+        stats and mark the question for the next push to the teacher.
+        """
+        items = self.sessions.get(live_id)
+        if items is not None and shards.holds(live_id):
+            self._stats(items, question_hash, question_data).observe(answer_index, correct, elapsed_ms)
+        elif shards.holds(live_id):
+            # Rebuilt from the database, which already includes this answer
+            self.load(db, live_id)
+        else:
+            self.sessions.pop(live_id, None)
+        self.dirty.setdefault(live_id, set()).add(question_hash)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._push())
+
+    def report(self, items: Dict[str, ItemStats]) -> List[Dict]:
+        return [stats.summary(question_hash) for question_hash, stats in items.items()]
+
+    def drop(self, live_id: str):
+        self.sessions.pop(live_id, None)
+        self.dirty.pop(live_id, None)
+
+    async def _push(self):
+        """Send the questions that changed since the last push to each session's teacher"""
+        while self.dirty:
+            await asyncio.sleep(ANALYTICS_PUSH_SECONDS)
+            dirty, self.dirty = self.dirty, {}
+            for live_id, hashes in dirty.items():
+                try:
+                    if shards.holds(live_id):
+                        items = self.sessions.get(live_id)
+                    else:
+                        self.sessions.pop(live_id, None)
+                        items = await asyncio.to_thread(self.reread, live_id)
+                    if not items:
+                        continue
+                    await manager.send_to_teacher(live_id, {
+                        "type": "analytics.update",
+                        "items": [items[h].summary(h) for h in hashes if h in items]
+                    })
+                except Exception:
+                    log.warning("analytics.push_failed", live_id=live_id)
+
+
+item_analytics = ItemAnalytics()
@@ -0,0 +1,234 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+from app.database import SessionLocal
+from app.models import LiveParticipant, Participant, ParticipantProgress
+from app.adaptive_engine import INITIAL_THETA_SCORE
+from app.websocket_manager import manager
+from app.event_log import get_logger
+
+log = get_logger("app.join_queue")
+
+JOIN_RATE_PER_SESSION = float(os.getenv("JOIN_RATE_PER_SESSION", "50"))
+JOIN_BURST_PER_SESSION = float(os.getenv("JOIN_BURST_PER_SESSION", "300"))
+JOIN_RATE_GLOBAL = float(os.getenv("JOIN_RATE_GLOBAL", "200"))
+JOIN_BURST_GLOBAL = float(os.getenv("JOIN_BURST_GLOBAL", "1000"))
+JOIN_QUEUE_MAX = int(os.getenv("JOIN_QUEUE_MAX", "5000"))
+JOIN_BATCH_SIZE = int(os.getenv("JOIN_BATCH_SIZE", "200"))
+JOIN_BATCH_INTERVAL = float(os.getenv("JOIN_BATCH_INTERVAL", "0.05"))
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def retry_after(self) -> float:
+        """Seconds until the next token is available"""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class PendingJoin:
+    __slots__ = ('participant_id', 'ticket', 'live_id', 'session_code', 'nome', 'cognome', 'email', 'corso')
+
+    def __init__(self, ticket: int, live_id: str, session_code: str, nome: str, cognome: str, email: Optional[str], corso: Optional[str]):
+        self.participant_id = str(uuid.uuid4())
+        self.ticket = ticket  # running count of admitted joins, gives the place in the queue
+        self.live_id = live_id
+        self.session_code = session_code
+        self.nome = nome
+        self.cognome = cognome
+        self.email = email
+        self.corso = corso
+
+
+class JoinQueue:
+    """
+    Admission control for burst joins.
+    Joins pass a per-session and a global token bucket, then wait in a queue that a
+    single background task drains in batches: the Participant, LiveParticipant and
+    ParticipantProgress rows of a whole batch are inserted in one transaction and
+    each session gets one roster broadcast per batch. A participant_id is handed
+    out on admission, before its rows exist: clients poll `status` (or wait for
+    the roster broadcast) until it is no longer waiting.
+    """
+
+    def __init__(self):
+        self.global_bucket = TokenBucket(JOIN_RATE_GLOBAL, JOIN_BURST_GLOBAL)
+        self.session_buckets: Dict[str, TokenBucket] = {}
+        self.pending: Deque[PendingJoin] = deque()
+        self.session_depth: Dict[str, int] = {}
+        self.waiting: Dict[str, PendingJoin] = {}  # queued or being inserted, by participant_id
+        self.taken = 0  # joins taken off the queue so far
+        self.admitted = 0
+        self.rejected = 0
+        self.batches = 0
+        # Called with (db, live_id, joins) after each committed batch
+        self.on_batch: Optional[Callable[..., Awaitable[None]]] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def enqueue(self, live_id: str, session_code: str, nome: str, cognome: str, email: Optional[str] = None, corso: Optional[str] = None) -> PendingJoin:
+        """Admit a join into the queue or raise AdmissionRejected"""
+        if len(self.pending) >= JOIN_QUEUE_MAX:
+            self.rejected += 1
+            raise AdmissionRejected("Join queue is full", 1.0)
+
+        bucket = self.session_buckets.get(live_id)
+        if bucket is None:
+            bucket = self.session_buckets[live_id] = TokenBucket(JOIN_RATE_PER_SESSION, JOIN_BURST_PER_SESSION)
+        if not bucket.try_acquire():
+            self.rejected += 1
+            raise AdmissionRejected("Too many joins for this session", bucket.retry_after())
+        if not self.global_bucket.try_acquire():
+            bucket.tokens += 1
+            self.rejected += 1
+            raise AdmissionRejected("Too many joins", self.global_bucket.retry_after())
+
+        join = PendingJoin(self.taken + len(self.pending) + 1, live_id, session_code, nome, cognome, email, corso)
+        self.pending.append(join)
+        self.waiting[join.participant_id] = join
+        self.session_depth[live_id] = self.session_depth.get(live_id, 0) + 1
+        self.admitted += 1
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return join
+
+    def depth(self, live_id: Optional[str] = None) -> int:
+        if live_id is None:
+            return len(self.pending)
+        return self.session_depth.get(live_id, 0)
+
+    def position(self, join: PendingJoin) -> int:
+        """1-based place of a join in the queue, 0 once its batch is being inserted"""
+        return max(0, join.ticket - self.taken)
+
+    def status(self, participant_id: str) -> Optional[Dict]:
+        """Queue status of a join still waiting here, None once it has been processed"""
+        join = self.waiting.get(participant_id)
+        if join is None:
+            return None
+        return {"status": "queued", "position": self.position(join), "queue_depth": len(self.pending)}
+
+    def stats(self) -> Dict:
+        return {
+            "queue_depth": len(self.pending),
+            "sessions": dict(self.session_depth),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "batches": self.batches
+        }
+
+    def drop_session(self, live_id: str):
+        self.session_buckets.pop(live_id, None)
+
+    async def _run(self):
+        while self.pending:
+            await asyncio.sleep(JOIN_BATCH_INTERVAL)
+            batch = [self.pending.popleft() for _ in range(min(JOIN_BATCH_SIZE, len(self.pending)))]
+            self.taken += len(batch)
+            db = SessionLocal()
+            try:
+                try:
+                    self._insert(db, batch)
+                    admitted = batch
+                except Exception as e:
+                    db.rollback()
+                    log.warning("join.batch_failed", size=len(batch), error=str(e))
+                    admitted = await self._insert_individually(db, batch)
+                self.batches += 1
+
+                if self.on_batch is not None:
+                    by_session: Dict[str, List[PendingJoin]] = {}
+                    for join in admitted:
+                        by_session.setdefault(join.live_id, []).append(join)
+                    for live_id, joins in by_session.items():
+                        try:
+                            await self.on_batch(db, live_id, joins)
+                        except Exception:
+                            db.rollback()
+                            log.error("join.post_batch_failed", exc_info=True, live_id=live_id)
+            finally:
+                db.close()
+                for join in batch:
+                    self.waiting.pop(join.participant_id, None)
+                    remaining = self.session_depth.get(join.live_id, 0) - 1
+                    if remaining > 0:
+                        self.session_depth[join.live_id] = remaining
+                    else:
+                        self.session_depth.pop(join.live_id, None)
+
+    async def _insert_individually(self, db, batch: List[PendingJoin]) -> List[PendingJoin]:
+        """Isolate the joins that broke a batch so the others still get in"""
+        admitted = []
+        for join in batch:
+            try:
+                self._insert(db, [join])
+                admitted.append(join)
+            except Exception as e:
+                db.rollback()
+                log.warning("join.failed", participant_id=join.participant_id, error=str(e))
+                await manager.send_to_participant(join.participant_id, {
+                    "type": "join.failed"
+                }, session_code=join.session_code)
+        return admitted
+
+    def _insert(self, db, batch: List[PendingJoin]):
+        """Insert the rows of a batch of joins in a single transaction"""
+        db.add_all([
+            Participant(
+                participant_id=join.participant_id,
+                nome=join.nome,
+                cognome=join.cognome,
+                email=join.email,
+                corso=join.corso
+            ) for join in batch
+        ])
+        db.flush()
+        db.add_all([
+            LiveParticipant(live_id=join.live_id, participant_id=join.participant_id)
+            for join in batch
+        ])
+        db.add_all([
+            ParticipantProgress(
+                participant_id=join.participant_id,
+                live_id=join.live_id,
+                current_level='base',
+                theta=INITIAL_THETA_SCORE,
+                topic=None,
+                correct_streak=0,
+                total_served=0
+            ) for join in batch
+        ])
+        db.commit()
+
+
+join_queue = JoinQueue()
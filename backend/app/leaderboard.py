@@ -0,0 +1,330 @@
+import asyncio
+import os
+import random
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+
+from app.adaptive_engine import INITIAL_THETA_SCORE
+from app.archive import iter_archive
+from app.database import SessionLocal
+from app.event_log import get_logger
+from app.models import LiveAnswer, LiveSession, ParticipantProgress
+from app.sharding import shards
+from app.websocket_manager import manager
+
+LEADERBOARD_PUSH_SECONDS = float(os.getenv("LEADERBOARD_PUSH_SECONDS", "2"))
+LEADERBOARD_TOP = int(os.getenv("LEADERBOARD_TOP", "10"))
+SKIPLIST_LEVELS = 16
+
+log = get_logger("app.leaderboard")
+
+# Sort key of a participant: best score first, then most correct answers, then fastest
+Standing = Tuple[float, int, int, str]
+
+
+class _Last:
+    """Key of the tail sentinel, greater than every standing"""
+
+    def __lt__(self, other):
+        return False
+
+    def __le__(self, other):
+        return False
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels: int):
+        self.key = key
+        self.next: List[Optional[_Node]] = [None] * levels
+        self.width = [1] * levels  # positions skipped by next[level]
+
+
+class IndexableSkipList:
+    """
+    Sorted keys with O(log n) expected insert, remove, rank and lookup by position.
+    Every link stores how many positions it skips, so a search that counts the
+    widths it crosses knows the position it reached.
+    """
+
+    def __init__(self, levels: int = SKIPLIST_LEVELS):
+        self.levels = levels
+        self.size = 0
+        self.tail = _Node(_Last(), 0)
+        self.head = _Node(None, levels)
+        self.head.next = [self.tail] * levels
+
+    def __len__(self) -> int:
+        return self.size
+
+    def insert(self, key):
+        chain: List[_Node] = [self.head] * self.levels
+        steps_at_level = [0] * self.levels
+        node = self.head
+        for level in reversed(range(self.levels)):
+            while node.next[level].key <= key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        height = 1
+        while height < self.levels and random.random() < 0.5:
+            height += 1
+        new = _Node(key, height)
+        steps = 0
+        for level in range(height):
+            prev = chain[level]
+            new.next[level] = prev.next[level]
+            prev.next[level] = new
+            new.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(height, self.levels):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain: List[_Node] = [self.head] * self.levels
+        node = self.head
+        for level in reversed(range(self.levels)):
+            while node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+        found = chain[0].next[0]
+        if found is self.tail or found.key != key:
+            raise KeyError(key)
+
+        for level in range(len(found.next)):
+            prev = chain[level]
+            prev.width[level] += found.width[level] - 1
+            prev.next[level] = found.next[level]
+        for level in range(len(found.next), self.levels):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def rank(self, key) -> int:
+        """Number of keys smaller than key, i.e. its 0-based position when present"""
+        position = 0
+        node = self.head
+        for level in reversed(range(self.levels)):
+            while node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        return position
+
+    def iter_from(self, start: int) -> Iterator:
+        """Keys from position start onwards"""
+        if start >= self.size:
+            return
+        remaining = start + 1
+        node = self.head
+        for level in reversed(range(self.levels)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        while node is not self.tail:
+            yield node.key
+            node = node.next[0]
+
+
+class Leaderboard:
+    """
+    Ranking of one session. Each answer moves one participant in O(log n); the
+    positions it shifts are remembered so the next push only compares that range
+    against the ranks last sent and carries the ones that changed.
+    """
+
+    def __init__(self, session_code: Optional[str] = None):
+        self.session_code = session_code
+        self.ranking = IndexableSkipList()
+        self.standings: Dict[str, Standing] = {}
+        self.published: Dict[str, int] = {}
+        self.changed: Optional[Tuple[int, int]] = None  # positions shifted since the last push
+
+    def set(self, participant_id: str, score: float, correct: int, elapsed_ms: int):
+        standing = (-score, -correct, elapsed_ms, participant_id)
+        old = self.standings.get(participant_id)
+        if old == standing:
+            return
+        if old is not None:
+            start = self.ranking.rank(old)
+            self.ranking.remove(old)
+        self.ranking.insert(standing)
+        self.standings[participant_id] = standing
+        position = self.ranking.rank(standing)
+        # A newcomer shifts everyone below it
+        low, high = (min(start, position), max(start, position)) if old is not None else (position, len(self.ranking) - 1)
+        if self.changed is not None:
+            low, high = min(low, self.changed[0]), max(high, self.changed[1])
+        self.changed = (low, high)
+
+    def record(self, participant_id: str, score: float, correct: bool, elapsed_ms: Optional[int]):
+        old = self.standings.get(participant_id)
+        total_correct, total_ms = (-old[1], old[2]) if old is not None else (0, 0)
+        self.set(participant_id, score, total_correct + int(correct), total_ms + (elapsed_ms or 0))
+
+    def entry(self, standing: Standing, rank: int) -> Dict:
+        return {
+            "participant_id": standing[3],
+            "rank": rank,
+            "score": -standing[0],
+            "correct": -standing[1],
+            "elapsed_ms": standing[2]
+        }
+
+    def top(self, k: int) -> List[Dict]:
+        entries = []
+        for position, standing in enumerate(self.ranking.iter_from(0)):
+            if position >= k:
+                break
+            entries.append(self.entry(standing, position + 1))
+        return entries
+
+    def rank_of(self, participant_id: str) -> Optional[Dict]:
+        standing = self.standings.get(participant_id)
+        if standing is None:
+            return None
+        return self.entry(standing, self.ranking.rank(standing) + 1)
+
+    def changes(self) -> List[Dict]:
+        """Entries whose rank differs from the last push, within the shifted range"""
+        if self.changed is None:
+            return []
+        low, high = self.changed
+        self.changed = None
+        changes = []
+        for position, standing in enumerate(self.ranking.iter_from(low), low):
+            if position > high:
+                break
+            rank = position + 1
+            if self.published.get(standing[3]) != rank:
+                self.published[standing[3]] = rank
+                changes.append(self.entry(standing, rank))
+        return changes
+
+    @classmethod
+    def build(cls, rows: Iterable[Tuple[str, float, int, int]], session_code: Optional[str] = None) -> 'Leaderboard':
+        """Leaderboard of (participant_id, score, correct, elapsed_ms) rows, all of them still to be published"""
+        board = cls(session_code)
+        for participant_id, score, correct, elapsed_ms in rows:
+            board.set(participant_id, score, correct, elapsed_ms)
+        return board
+
+
+def standings_statement(db: Session, live_id: str):
+    """Score, correct answers and total answer time of every participant who answered"""
+    return db.query(
+        LiveAnswer.participant_id,
+        ParticipantProgress.theta,
+        func.sum(case((LiveAnswer.correct == True, 1), else_=0)),
+        func.coalesce(func.sum(LiveAnswer.elapsed_ms), 0)
+    ).join(
+        ParticipantProgress, (ParticipantProgress.participant_id == LiveAnswer.participant_id) & (ParticipantProgress.live_id == LiveAnswer.live_id)
+    ).filter(LiveAnswer.live_id == live_id).group_by(LiveAnswer.participant_id, ParticipantProgress.theta)
+
+
+def archived_standings(live_id: str) -> Iterator[Tuple[str, float, int, int]]:
+    """The same rows from an archive: totals from its answers, scores from its final report"""
+    scores = {row["participant_id"]: row["final_theta"] for row in iter_archive(live_id, "report")}
+    totals: Dict[str, List[int]] = {}
+    for row in iter_archive(live_id, "live_answers"):
+        total = totals.setdefault(row["participant_id"], [0, 0])
+        total[0] += 1 if row.get("correct") else 0
+        total[1] += row.get("elapsed_ms") or 0
+    for participant_id, (correct, elapsed_ms) in totals.items():
+        yield participant_id, scores.get(participant_id, INITIAL_THETA_SCORE), correct, elapsed_ms
+
+
+class Leaderboards:
+    """
+    Leaderboards of the sessions this process owns, rebuilt with one grouped query
+    the first time a session is touched and then updated by every answer and
+    timeout. Rank changes are broadcast to the session at most every
+    LEADERBOARD_PUSH_SECONDS.
+
+    As in SessionStates, a board is only kept while this worker holds the
+    session's shard lease. Without one, other workers record answers too, so the
+    standings are read again from the database for every request and push; only
+    the ranks this worker last sent are kept, to send the changes.
+    """
+
+    def __init__(self):
+        self.sessions: Dict[str, Leaderboard] = {}
+        self.published: Dict[str, Dict[str, int]] = {}  # ranks sent for sessions without a lease
+        self.dirty: set = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def query(self, db: Session, live_id: str) -> Leaderboard:
+        code = db.query(LiveSession.code).filter(LiveSession.live_id == live_id).scalar()
+        rows = ((str(pid), score, int(correct or 0), int(elapsed_ms or 0)) for pid, score, correct, elapsed_ms in standings_statement(db, live_id))
+        return Leaderboard.build(rows, code)
+
+    def load(self, db: Session, live_id: str) -> Leaderboard:
+        if not shards.holds(live_id):
+            # Anything kept from an earlier lease may have been changed by another worker since
+            self.sessions.pop(live_id, None)
+            return self.query(db, live_id)
+        board = self.sessions.get(live_id)
+        if board is None:
+            board = self.sessions[live_id] = self.query(db, live_id)
+            board.published = self.published.pop(live_id, {})
+        return board
+
+    def record(self, db: Session, live_id: str, participant_id: str, score: float, correct: bool, elapsed_ms: Optional[int]):
+        """Move a participant after a committed answer and schedule a push of the ranks that changed"""
+        board = self.sessions.get(live_id)
+        if board is not None and shards.holds(live_id):
+            board.record(participant_id, score, correct, elapsed_ms)
+        elif shards.holds(live_id):
+            # Rebuilt from the database, so this answer is already in it
+            self.load(db, live_id)
+        else:
+            self.sessions.pop(live_id, None)
+        self.dirty.add(live_id)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._push())
+
+    def reread(self, live_id: str) -> Leaderboard:
+        """Standings of a session without a lease, compared against the ranks this worker sent last"""
+        db = SessionLocal()
+        try:
+            board = self.query(db, live_id)
+        finally:
+            db.close()
+        board.published = self.published.setdefault(live_id, {})
+        return board
+
+    def drop(self, live_id: str):
+        self.sessions.pop(live_id, None)
+        self.published.pop(live_id, None)
+        self.dirty.discard(live_id)
+
+    async def _push(self):
+        while self.dirty:
+            await asyncio.sleep(LEADERBOARD_PUSH_SECONDS)
+            dirty, self.dirty = self.dirty, set()
+            for live_id in dirty:
+                try:
+                    if shards.holds(live_id):
+                        board = self.sessions.get(live_id)
+                    else:
+                        self.sessions.pop(live_id, None)
+                        board = await asyncio.to_thread(self.reread, live_id)
+                    if board is None:
+                        continue
+                    changes = board.changes()
+                    if not changes:
+                        continue
+                    await manager.broadcast_to_session(live_id, {
+                        "type": "leaderboard.update",
+                        "size": len(board.ranking),
+                        "changes": changes
+                    }, session_code=board.session_code)
+                except Exception:
+                    log.warning("leaderboard.push_failed", live_id=live_id)
+
+
+leaderboards = Leaderboards()
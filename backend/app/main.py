@@ -1,34 +1,67 @@
-from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect, UploadFile, File, Form
+from fastapi import FastAPI, Depends, HTTPException, Request, WebSocket, WebSocketDisconnect, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from sqlalchemy import func, update
 from sqlalchemy.orm import Session
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from typing import List, Optional
-import random
-import string
-import uuid
+import math
 import asyncio
 import os
-import PyPDF2
-from openai import OpenAI
 import json
 
-from app.database import get_db, create_tables
-from app.models import LiveSession, Participant, LiveParticipant, ParticipantProgress, ServedQuestion, LiveAnswer, SessionQuestion
-from app.schemas import LiveSessionCreate, LiveSessionResponse, ParticipantCreate, ParticipantResponse, JoinSessionRequest, QuestionResponse, AnswerRequest, AnswerResponse, ParticipantStatus, PDFUploadResponse
+from app.database import get_db, DATABASE_URL
+from app.models import LiveSession, Participant, LiveParticipant, ParticipantProgress, ServedQuestion, LiveAnswer, SessionQuestion, SharedQuestion, RosterToken
+from app.schemas import LiveSessionCreate, LiveSessionResponse, JoinSessionRequest, JoinQueuedResponse, JoinStatusResponse, QuestionResponse, AnswerRequest, AnswerResponse, ParticipantStatus, ItemStatsResponse, LeaderboardEntry, LeaderboardResponse, PDFUploadResponse, QuestionImportResponse, RosterImportResponse, RosterTokenResponse, TokenJoinResponse
 from app.question_service import question_service
+from app.adaptive_engine import score_to_theta, INITIAL_THETA_SCORE
 from app.websocket_manager import manager
+from app.ws_codecs import json_codec
+from app.metrics import metrics, MetricsMiddleware
+from app.event_log import get_logger
+from app.round_timers import round_timers
+from app.join_queue import join_queue, AdmissionRejected
+from app.reports import build_report, encode_report, iter_report
+from app.archive import archive_session, is_archived, iter_archive, ArchiveError, ArchiveNotConfigured
+from app.roster import parse_roster, insert_roster_chunk, RosterFormatError, ROSTER_CHUNK_SIZE
+from app.session_state import session_states
+from app.item_analytics import item_analytics
+from app.leaderboard import Leaderboard, archived_standings, leaderboards, LEADERBOARD_TOP
+from app.migrate import migrate
+from app.sharding import shards
+from app.session_codes import session_codes, SessionCodesExhausted
+from app.question_bank import copy_shared_bank, import_spool, insert_questions, iter_bank, question_row, spool_questions, validate_question, QuestionFormatError
 
-app = FastAPI(title="Quiz Live API", version="1.0.0")
+log = get_logger("app.main")
 
-create_tables()
+# The schema is created by the deploy step (python -m app.migrate), not by every worker
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "1" if DATABASE_URL.startswith("sqlite") else "0") == "1"
 
-openai_api_key = os.getenv("OPENAI_API_KEY")
-if openai_api_key and openai_api_key != "your_openai_api_key_here":
-    openai_client = OpenAI(api_key=openai_api_key)
-else:
-    openai_client = None
-    print("Warning: OpenAI API key not configured. PDF upload functionality will be disabled.")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+if OPENAI_API_KEY == "your_openai_api_key_here":
+    OPENAI_API_KEY = None
 
-os.makedirs("uploads", exist_ok=True)
+@lru_cache(maxsize=1)
+def get_openai_client():
+    """OpenAI client, imported and built on the first PDF upload"""
+    if not OPENAI_API_KEY:
+        return None
+    from openai import OpenAI
+    return OpenAI(api_key=OPENAI_API_KEY)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if AUTO_MIGRATE:
+        migrate()
+    os.makedirs("uploads", exist_ok=True)
+    if not OPENAI_API_KEY:
+        log.warning("pdf_upload.disabled", reason="OpenAI API key not configured")
+    await shards.start()
+    yield
+    await shards.stop()
+
+app = FastAPI(title="Quiz Live API", version="1.0.0", lifespan=lifespan)
 
 # Disable CORS. Do not remove this for full-stack development.
 app.add_middleware(
@@ -38,10 +71,7 @@ app.add_middleware(
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
 )
-
-def generate_session_code() -> str:
-    """Generate a 6-digit session code"""
-    return ''.join(random.choices(string.digits, k=6))
+app.add_middleware(MetricsMiddleware)
 
 @app.get("/healthz")
 async def healthz():
@@ -59,26 +89,24 @@ async def get_session_details(live_id: str, db: Session = Depends(get_db)):
 @app.post("/api/live/create", response_model=LiveSessionResponse)
 async def create_live_session(session_data: LiveSessionCreate, db: Session = Depends(get_db)):
     """Create a new live session"""
-    code = generate_session_code()
-    
-    while db.query(LiveSession).filter(LiveSession.code == code).first():
-        code = generate_session_code()
-    
-    live_session = LiveSession(
-        code=code,
-        title=session_data.title,
-        status='lobby'
-    )
-    
-    db.add(live_session)
-    db.commit()
+    try:
+        live_session = session_codes.create(db, title=session_data.title, status='lobby')
+    except SessionCodesExhausted as e:
+        raise HTTPException(status_code=503, detail=str(e))
     db.refresh(live_session)
+    # A reused code may still be cached for the session that held it before
+    shards.forget_code(live_session.code)
+    manager.register_session(live_session.code, live_session.live_id)
     
     return live_session
 
-@app.post("/api/live/{code}/join", response_model=ParticipantResponse)
-async def join_live_session(code: str, join_data: JoinSessionRequest, db: Session = Depends(get_db)):
-    """Join a live session with participant data"""
+@app.post("/api/live/{code}/join", status_code=202, response_model=JoinQueuedResponse)
+async def join_live_session(code: str, join_data: JoinSessionRequest, request: Request, db: Session = Depends(get_db)):
+    """Join a live session with participant data; the join is queued and inserted in batches"""
+    forwarded = await shards.route(request, session_code=code)
+    if forwarded:
+        return forwarded
+    
     live_session = db.query(LiveSession).filter(LiveSession.code == code).first()
     if not live_session:
         raise HTTPException(status_code=404, detail="Session not found")
@@ -89,40 +117,50 @@ async def join_live_session(code: str, join_data: JoinSessionRequest, db: Sessio
     if live_session.status not in ['lobby', 'running']:
         raise HTTPException(status_code=400, detail="Session is not accepting participants")
     
-    websocket_participant_id = str(uuid.uuid4())
-    
-    participant = Participant(
-        participant_id=websocket_participant_id,
-        nome=join_data.nome,
-        cognome=join_data.cognome,
-        email=join_data.email,
-        corso=join_data.corso
-    )
-    
-    db.add(participant)
-    db.commit()
-    db.refresh(participant)
-    
-    live_participant = LiveParticipant(
-        live_id=live_session.live_id,
-        participant_id=participant.participant_id
-    )
-    
-    db.add(live_participant)
-    
-    progress = ParticipantProgress(
-        participant_id=participant.participant_id,
-        live_id=live_session.live_id,
-        current_level='base',
-        theta=20,
-        topic=None,
-        correct_streak=0,
-        total_served=0
+    try:
+        join = join_queue.enqueue(
+            live_session.live_id,
+            live_session.code,
+            nome=join_data.nome,
+            cognome=join_data.cognome,
+            email=join_data.email,
+            corso=join_data.corso
+        )
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))})
+    
+    return JoinQueuedResponse(
+        participant_id=join.participant_id,
+        nome=join.nome,
+        cognome=join.cognome,
+        status="queued",
+        position=join_queue.position(join),
+        queue_depth=join_queue.depth()
     )
-    
-    db.add(progress)
-    db.commit()
-    
+
+@app.get("/api/live/{code}/join/{participant_id}", response_model=JoinStatusResponse)
+async def get_join_status(code: str, participant_id: str, request: Request, db: Session = Depends(get_db)):
+    """Where a queued join stands; poll until "admitted" before using the participant_id"""
+    forwarded = await shards.route(request, session_code=code)
+    if forwarded:
+        return forwarded
+    
+    queued = join_queue.status(participant_id)
+    if queued is not None:
+        return JoinStatusResponse(participant_id=participant_id, **queued)
+    
+    live_id = shards.live_id_for_code(code)
+    admitted = live_id is not None and db.query(LiveParticipant.participant_id).filter(
+        LiveParticipant.live_id == live_id,
+        LiveParticipant.participant_id == participant_id
+    ).first() is not None
+    if not admitted:
+        # Never queued here, or its insert failed (the client was also sent join.failed)
+        raise HTTPException(status_code=404, detail="Join not found")
+    return JoinStatusResponse(participant_id=participant_id, status="admitted", position=0, queue_depth=join_queue.depth())
+
+async def broadcast_roster(db: Session, live_session: LiveSession):
+    """Send the current participant list of a session to everyone connected"""
     participants = db.query(Participant).join(LiveParticipant).filter(
         LiveParticipant.live_id == live_session.live_id
     ).all()
@@ -137,44 +175,180 @@ async def join_live_session(code: str, join_data: JoinSessionRequest, db: Sessio
             } for p in participants
         ]
     }, session_code=live_session.code)
-    
-    # If session is running, send current state to the new participant
-    if live_session.status == 'running':
-        print(f"Late joiner {participant.participant_id} joining running session {live_session.code}")
+
+async def serve_late_joiners(db: Session, live_id: str, session_code: str, participant_ids: List[str]):
+    """Send a first question to participants entering a running session"""
+    if not question_service.questions_db:
+        return
+    
+    await question_service.load_session_bank(live_id)
+    served = []
+    for participant_id in participant_ids:
+        state = session_states.participant(db, live_id, participant_id)
+        if state is None or state.total_served > 0:
+            continue
+        log.event("session.late_joiner", participant_id=participant_id, session_code=session_code)
+        question = question_service.get_next_question(
+            level=state.current_level,
+            topic=state.topic,
+            served_hashes=[],
+            live_id=live_id,
+            db_session=db,
+            theta=score_to_theta(state.theta)
+        )
         
-        served_questions = db.query(ServedQuestion).filter(
-            ServedQuestion.participant_id == participant.participant_id
-        ).all()
+        if question:
+            question_hash = question_service.get_question_hash(question)
+            question_data = question.dict()
+            db.add(ServedQuestion(
+                participant_id=participant_id,
+                question_hash=question_hash,
+                question_data=question_data
+            ))
+            state.serve(question_hash, question.topic)
+            served.append((state, question, question_hash, question_data))
+    
+    session_states.commit(db, live_id, [state for state, _, _, _ in served])
+    
+    for state, question, question_hash, question_data in served:
+        round_timers.start_round(live_id, state.participant_id, question_hash, question_data)
         
-        if not served_questions and question_service.questions_db:
-            question = question_service.get_next_question(
-                level=progress.current_level,
-                topic=progress.topic,
-                served_hashes=[]
-            )
-            
-            if question:
-                print(f"Sending initial question to late joiner {participant.participant_id}")
-                question_hash = question_service.get_question_hash(question)
-                served_question = ServedQuestion(
-                    participant_id=participant.participant_id,
-                    question_hash=question_hash,
-                    question_data=question.dict()
-                )
-                db.add(served_question)
-                progress.total_served += 1
-                if not progress.topic:
-                    progress.topic = question.topic
-                db.commit()
-                
-                await manager.send_to_participant(str(participant.participant_id), {
-                    "type": "round.start",
-                    "question": question.dict(),
-                    "timer": 30,
-                    "question_number": progress.total_served
-                })
+        await manager.send_to_participant(str(state.participant_id), {
+            "type": "round.start",
+            "question": question_service.get_payload(question_hash, question_data, live_id),
+            "timer": round_timers.round_seconds,
+            "question_number": state.total_served
+        }, session_code=session_code)
+        log.event("session.question_sent", participant_id=state.participant_id, question_hash=question_hash, question_number=state.total_served)
+
+async def admit_joins(db: Session, live_id: str, joins):
+    """Roster broadcast and late-joiner questions for a committed batch of joins"""
+    live_session = db.query(LiveSession).filter(LiveSession.live_id == live_id).first()
+    if not live_session:
+        return
     
-    return participant
+    await broadcast_roster(db, live_session)
+    
+    # If session is running, send current state to the new participants
+    if live_session.status == 'running':
+        await serve_late_joiners(db, live_id, live_session.code, [join.participant_id for join in joins])
+
+join_queue.on_batch = admit_joins
+
+@app.get("/api/join-queue")
+async def get_join_queue_stats():
+    """Join admission queue depth and counters"""
+    return join_queue.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Latency, SQL, pool, fan-out and selection histograms in the Prometheus text format"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/connections")
+async def get_connection_stats():
+    """Open sockets and memory held per session by the WebSocket registry"""
+    return manager.stats()
+
+@app.get("/api/shards")
+async def get_shard_stats():
+    """Workers on the ring, sessions owned by this worker and forwarding counters"""
+    return {**shards.stats(), "hot_state": session_states.stats()}
+
+async def release_session(live_id: str):
+    """Drop the in-memory state of a session that another worker now owns"""
+    round_timers.end_session(live_id)
+    join_queue.drop_session(live_id)
+    session_states.drop(live_id)
+    item_analytics.drop(live_id)
+    leaderboards.drop(live_id)
+    question_service.drop_session(live_id)
+    code = shards.code_for(live_id)
+    if code is not None:
+        await manager.handoff_session(code, live_id)
+
+shards.on_release = release_session
+
+@app.post("/api/live/{live_id}/roster", response_model=RosterImportResponse)
+async def import_roster(live_id: str, request: Request, format: Optional[str] = None, db: Session = Depends(get_db)):
+    """Preload a class roster (CSV with header, or JSONL) and hand out per-student join tokens"""
+    forwarded = await shards.route(request, live_id=live_id)
+    if forwarded:
+        return forwarded
+    
+    live_session = db.query(LiveSession).filter(LiveSession.live_id == live_id).first()
+    if not live_session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    if live_session.status == 'ended':
+        raise HTTPException(status_code=400, detail="Session has ended")
+    
+    fmt = format or ('jsonl' if 'json' in request.headers.get('content-type', '') else 'csv')
+    if fmt not in ('csv', 'jsonl'):
+        raise HTTPException(status_code=400, detail="Roster format must be csv or jsonl")
+    
+    # The whole body is parsed before writing: a transaction that awaits while
+    # holding the database writer would stall every other writer
+    chunks = [[]]
+    try:
+        async for entry in parse_roster(request.stream(), fmt):
+            if len(chunks[-1]) >= ROSTER_CHUNK_SIZE:
+                chunks.append([])
+            chunks[-1].append(entry)
+    except RosterFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    imported = []
+    for chunk in chunks:
+        if chunk:
+            imported.extend(insert_roster_chunk(db, live_id, chunk))
+    
+    if not imported:
+        raise HTTPException(status_code=400, detail="Roster is empty")
+    
+    db.commit()
+    
+    await broadcast_roster(db, live_session)
+    
+    return RosterImportResponse(
+        live_id=live_id,
+        imported=len(imported),
+        tokens=[RosterTokenResponse(**row) for row in imported]
+    )
+
+@app.post("/api/live/join/{token}", response_model=TokenJoinResponse)
+async def join_with_token(token: str, request: Request, db: Session = Depends(get_db)):
+    """Join a live session with a preloaded roster token"""
+    row = db.query(
+        RosterToken.participant_id, Participant.nome, Participant.cognome,
+        LiveSession.live_id, LiveSession.code, LiveSession.status, LiveSession.locked
+    ).join(Participant, Participant.participant_id == RosterToken.participant_id).join(
+        LiveSession, LiveSession.live_id == RosterToken.live_id
+    ).filter(RosterToken.token == token).first()
+    
+    if not row:
+        raise HTTPException(status_code=404, detail="Invalid join token")
+    
+    forwarded = await shards.route(request, live_id=row.live_id)
+    if forwarded:
+        return forwarded
+    
+    if row.locked:
+        raise HTTPException(status_code=403, detail="Session is locked")
+    
+    if row.status not in ['lobby', 'running']:
+        raise HTTPException(status_code=400, detail="Session is not accepting participants")
+    
+    if row.status == 'running':
+        await serve_late_joiners(db, row.live_id, row.code, [row.participant_id])
+    
+    return TokenJoinResponse(
+        participant_id=row.participant_id,
+        nome=row.nome,
+        cognome=row.cognome,
+        session_code=row.code,
+        status="joined"
+    )
 
 @app.post("/api/live/{live_id}/lock")
 async def lock_session(live_id: str, db: Session = Depends(get_db)):
@@ -189,14 +363,18 @@ async def lock_session(live_id: str, db: Session = Depends(get_db)):
     return {"status": "locked"}
 
 @app.post("/api/live/{live_id}/start")
-async def start_session(live_id: str, db: Session = Depends(get_db)):
+async def start_session(live_id: str, request: Request, db: Session = Depends(get_db)):
     """Start a live session with countdown"""
+    forwarded = await shards.route(request, live_id=live_id)
+    if forwarded:
+        return forwarded
+    
     live_session = db.query(LiveSession).filter(LiveSession.live_id == live_id).first()
     if not live_session:
         raise HTTPException(status_code=404, detail="Session not found")
     
     if not question_service.questions_db:
-        print(f"No questions available in database: {question_service.questions_db}")
+        log.warning("session.no_questions", live_id=live_id)
         raise HTTPException(
             status_code=400, 
             detail="No questions available. Please upload a PDF file first to generate questions."
@@ -214,68 +392,61 @@ async def start_session(live_id: str, db: Session = Depends(get_db)):
     await asyncio.sleep(5)
     
     participants = db.query(LiveParticipant).filter(LiveParticipant.live_id == live_id).all()
-    print(f"Found {len(participants)} participants to send questions to")
+    log.event("session.serving_first_questions", live_id=live_id, participants=len(participants))
     
     for lp in participants:
-        print(f"Processing participant {lp.participant_id}")
-        progress = db.query(ParticipantProgress).filter(
-            ParticipantProgress.participant_id == lp.participant_id,
-            ParticipantProgress.live_id == live_id
-        ).first()
+        progress = session_states.participant(db, live_id, lp.participant_id)
         
         if progress and progress.total_served < 50:
-            served_hashes = [row[0] for row in db.query(ServedQuestion.question_hash).filter(
-                ServedQuestion.participant_id == lp.participant_id
-            ).all()]
-            
+            await question_service.load_session_bank(live_session.live_id)
             question = question_service.get_next_question(
                 level=progress.current_level,
                 topic=progress.topic,
-                served_hashes=served_hashes,
+                served_hashes=progress.served,
                 live_id=live_session.live_id,
-                db_session=db
+                db_session=db,
+                theta=score_to_theta(progress.theta)
             )
             
             if question:
-                print(f"Found question for participant {lp.participant_id}: {question.question[:50]}...")
                 question_hash = question_service.get_question_hash(question)
+                question_data = question.dict()
                 served_question = ServedQuestion(
                     participant_id=lp.participant_id,
                     question_hash=question_hash,
-                    question_data=question.dict()  # Store full question data
+                    question_data=question_data  # Store full question data
                 )
                 db.add(served_question)
-                
-                progress.total_served += 1
-                if not progress.topic:
-                    progress.topic = question.topic
-                
-                db.commit()
-                
-                question_data = question.dict()
-                question_data.pop('answer_index', None)  # Remove correct answer
+                progress.serve(question_hash, question.topic)
+                session_states.commit(db, live_id, [progress])
+                round_timers.start_round(live_session.live_id, lp.participant_id, question_hash, question_data)
                 
                 await manager.send_to_participant(str(lp.participant_id), {
                     "type": "round.start",
-                    "question": question_data,
-                    "timer": 30,
+                    "question": question_service.get_payload(question_hash, question_data, live_id),
+                    "timer": round_timers.round_seconds,
                     "question_number": progress.total_served
-                })
-                print(f"Sent question to participant {lp.participant_id}")
+                }, session_code=live_session.code)
+                log.event("session.question_sent", participant_id=lp.participant_id, question_hash=question_hash, question_number=progress.total_served)
             else:
-                print(f"No question found for participant {lp.participant_id} (level: {progress.current_level}, topic: {progress.topic})")
+                log.warning("session.no_question", participant_id=lp.participant_id, level=progress.current_level, topic=progress.topic)
     
     return {"status": "started"}
 
 @app.post("/api/live/{live_id}/pause")
-async def pause_session(live_id: str, db: Session = Depends(get_db)):
+async def pause_session(live_id: str, request: Request, db: Session = Depends(get_db)):
     """Pause a live session"""
+    forwarded = await shards.route(request, live_id=live_id)
+    if forwarded:
+        return forwarded
+    
     live_session = db.query(LiveSession).filter(LiveSession.live_id == live_id).first()
     if not live_session:
         raise HTTPException(status_code=404, detail="Session not found")
     
     live_session.status = 'paused'
     db.commit()
+    round_timers.pause_session(live_id)
     
     await manager.broadcast_to_session(live_id, {
         "type": "live.pause"
@@ -284,14 +455,19 @@ async def pause_session(live_id: str, db: Session = Depends(get_db)):
     return {"status": "paused"}
 
 @app.post("/api/live/{live_id}/resume")
-async def resume_session(live_id: str, db: Session = Depends(get_db)):
+async def resume_session(live_id: str, request: Request, db: Session = Depends(get_db)):
     """Resume a paused session"""
+    forwarded = await shards.route(request, live_id=live_id)
+    if forwarded:
+        return forwarded
+    
     live_session = db.query(LiveSession).filter(LiveSession.live_id == live_id).first()
     if not live_session:
         raise HTTPException(status_code=404, detail="Session not found")
     
     live_session.status = 'running'
     db.commit()
+    round_timers.resume_session(live_id)
     
     await manager.broadcast_to_session(live_id, {
         "type": "live.resume"
@@ -300,179 +476,264 @@ async def resume_session(live_id: str, db: Session = Depends(get_db)):
     return {"status": "resumed"}
 
 @app.post("/api/live/{live_id}/end")
-async def end_session(live_id: str, db: Session = Depends(get_db)):
+async def end_session(live_id: str, request: Request, db: Session = Depends(get_db)):
     """End a live session"""
+    forwarded = await shards.route(request, live_id=live_id)
+    if forwarded:
+        return forwarded
+    
     live_session = db.query(LiveSession).filter(LiveSession.live_id == live_id).first()
     if not live_session:
         raise HTTPException(status_code=404, detail="Session not found")
     
     live_session.status = 'ended'
     db.commit()
+    round_timers.end_session(live_id)
+    join_queue.drop_session(live_id)
+    session_states.drop(live_id)
+    question_service.drop_session(live_id)
+    shards.forget_code(live_session.code)
+    
+    report_data = build_report(db, live_id)
+    items = item_analytics.report(item_analytics.load(db, live_id))
+    item_analytics.drop(live_id)
+    leaderboards.drop(live_id)
+    
+    # The teacher gets the class report and item statistics, each participant only their own summary
+    await manager.send_to_teacher(live_id, {
+        "type": "live.end",
+        "report": report_data,
+        "items": items
+    })
+    for summary in report_data:
+        await manager.send_to_participant(summary["participant_id"], {
+            "type": "live.end",
+            "summary": summary
+        }, session_code=live_session.code)
+    await manager.end_session(live_session.code)
     
-    participants = db.query(Participant).join(LiveParticipant).filter(
-        LiveParticipant.live_id == live_id
-    ).all()
+    return {"status": "ended", "report": report_data}
+
+@app.get("/api/live/{live_id}/report")
+async def export_report(live_id: str, format: str = "csv", db: Session = Depends(get_db)):
+    """Stream the session report as CSV or JSONL, one row at a time"""
+    live_session = db.query(LiveSession).filter(LiveSession.live_id == live_id).first()
+    if not live_session:
+        raise HTTPException(status_code=404, detail="Session not found")
     
-    report_data = []
-    for participant in participants:
-        answers = db.query(LiveAnswer).filter(
-            LiveAnswer.live_id == live_id,
-            LiveAnswer.participant_id == participant.participant_id
-        ).all()
-        
-        total_answers = len(answers)
-        correct_answers = len([a for a in answers if a.correct])
-        percentage = (correct_answers / total_answers * 100) if total_answers > 0 else 0
-        
-        progress = db.query(ParticipantProgress).filter(
-            ParticipantProgress.participant_id == participant.participant_id,
-            ParticipantProgress.live_id == live_id
-        ).first()
-        
-        report_data.append({
-            "participant_id": str(participant.participant_id),
-            "nome": participant.nome,
-            "cognome": participant.cognome,
-            "total_questions": total_answers,
-            "correct_answers": correct_answers,
-            "percentage": round(percentage, 1),
-            "final_level": progress.current_level if progress else "base",
-            "final_theta": progress.theta if progress else 20
-        })
+    if format not in ('csv', 'jsonl'):
+        raise HTTPException(status_code=400, detail="Report format must be csv or jsonl")
     
-    await manager.broadcast_to_session(live_id, {
-        "type": "live.end",
-        "report": report_data
-    }, session_code=live_session.code)
+    # Archived sessions no longer have answer rows: their final report is read back from the archive
+    rows = encode_report(iter_archive(live_id, "report"), format) if is_archived(live_id) else iter_report(live_id, format)
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        rows,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="report-{live_session.code}.{format}"'}
+    )
+
+@app.get("/api/live/{live_id}/items", response_model=List[ItemStatsResponse])
+async def get_item_stats(live_id: str, request: Request, db: Session = Depends(get_db)):
+    """Per-question statistics: success rate, timeouts, response time and option counts"""
+    forwarded = await shards.route(request, live_id=live_id)
+    if forwarded:
+        return forwarded
     
-    return {"status": "ended", "report": report_data}
+    live_session = db.query(LiveSession).filter(LiveSession.live_id == live_id).first()
+    if not live_session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    # Running sessions are kept up to date in memory; ended ones are aggregated on request
+    if is_archived(live_id):
+        items = await asyncio.to_thread(item_analytics.rebuild, iter_archive(live_id, "live_answers"))
+    elif live_session.status == 'ended':
+        items = item_analytics.query(db, live_id)
+    else:
+        items = item_analytics.load(db, live_id)
+    return item_analytics.report(items)
 
-@app.post("/api/session/next", response_model=QuestionResponse)
-async def get_next_question(participant_id: str, session_code: str, db: Session = Depends(get_db)):
-    """Get next adaptive question for a participant"""
-    live_session = db.query(LiveSession).filter(LiveSession.code == session_code).first()
+async def session_leaderboard(live_session: LiveSession, db: Session) -> Leaderboard:
+    """Kept up to date in memory while the session runs; rebuilt on request once it has ended"""
+    live_id = live_session.live_id
+    if is_archived(live_id):
+        return await asyncio.to_thread(lambda: Leaderboard.build(archived_standings(live_id)))
+    if live_session.status == 'ended':
+        return leaderboards.query(db, live_id)
+    return leaderboards.load(db, live_id)
+
+@app.get("/api/live/{live_id}/leaderboard", response_model=LeaderboardResponse)
+async def get_leaderboard(live_id: str, request: Request, limit: int = LEADERBOARD_TOP, db: Session = Depends(get_db)):
+    """Top participants by score, then correct answers, then total answer time"""
+    forwarded = await shards.route(request, live_id=live_id)
+    if forwarded:
+        return forwarded
+    
+    live_session = db.query(LiveSession).filter(LiveSession.live_id == live_id).first()
     if not live_session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    progress = db.query(ParticipantProgress).filter(
-        ParticipantProgress.participant_id == participant_id,
-        ParticipantProgress.live_id == live_session.live_id
-    ).first()
+    board = await session_leaderboard(live_session, db)
+    return LeaderboardResponse(size=len(board.ranking), top=board.top(max(limit, 0)))
+
+@app.get("/api/live/{live_id}/leaderboard/{participant_id}", response_model=LeaderboardEntry)
+async def get_leaderboard_rank(live_id: str, participant_id: str, request: Request, db: Session = Depends(get_db)):
+    """Rank of one participant"""
+    forwarded = await shards.route(request, live_id=live_id)
+    if forwarded:
+        return forwarded
     
+    live_session = db.query(LiveSession).filter(LiveSession.live_id == live_id).first()
+    if not live_session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    entry = (await session_leaderboard(live_session, db)).rank_of(participant_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Participant has not answered yet")
+    return entry
+
+@app.post("/api/live/{live_id}/archive")
+async def archive_live_session(live_id: str, db: Session = Depends(get_db)):
+    """Move an ended session's answer data to its compressed archive and delete the rows"""
+    live_session = db.query(LiveSession).filter(LiveSession.live_id == live_id).first()
+    if not live_session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if is_archived(live_id):
+        raise HTTPException(status_code=409, detail="Session already archived")
+    db.close()
+    try:
+        result = await asyncio.to_thread(archive_session, live_id)
+    except ArchiveNotConfigured as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ArchiveError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    log.event("session.archived", live_id=live_id, archive=result["archive"], rows=result["rows"])
+    return result
+
+@app.post("/api/session/next", response_model=QuestionResponse)
+async def get_next_question(participant_id: str, session_code: str, request: Request, db: Session = Depends(get_db)):
+    """Get next adaptive question for a participant"""
+    forwarded = await shards.route(request, session_code=session_code)
+    if forwarded:
+        return forwarded
+    
+    live_id = shards.live_id_for_code(session_code)
+    if not live_id:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    progress = session_states.participant(db, live_id, participant_id)
     if not progress:
         raise HTTPException(status_code=404, detail="Participant progress not found")
     
+    # A client resyncing after a reconnect gets the question it still has to answer
+    current_round = round_timers.get_round(participant_id)
+    if current_round is not None and not current_round.expired:
+        payload = question_service.get_payload(current_round.question_hash, current_round.question_data, live_id)
+        return Response(content=json_codec.encode(payload), media_type="application/json")
+    
     if progress.total_served >= 50:
         raise HTTPException(status_code=400, detail="Maximum questions reached")
     
-    served_hashes = [row[0] for row in db.query(ServedQuestion.question_hash).filter(
-        ServedQuestion.participant_id == participant_id
-    ).all()]
-    
+    await question_service.load_session_bank(live_id)
     question = question_service.get_next_question(
         level=progress.current_level,
         topic=progress.topic,
-        served_hashes=served_hashes,
-        live_id=live_session.live_id,
-        db_session=db
+        served_hashes=progress.served,
+        live_id=live_id,
+        db_session=db,
+        theta=score_to_theta(progress.theta)
     )
     
     if not question:
         raise HTTPException(status_code=404, detail="No more questions available")
     
     question_hash = question_service.get_question_hash(question)
+    question_data = question.dict()
     served_question = ServedQuestion(
         participant_id=participant_id,
         question_hash=question_hash,
-        question_data=question.dict()  # Store full question data
+        question_data=question_data  # Store full question data
     )
     db.add(served_question)
+    progress.serve(question_hash, question.topic)
+    session_states.commit(db, live_id, [progress])
+    round_timers.start_round(live_id, participant_id, question_hash, question_data)
     
-    progress.total_served += 1
-    if not progress.topic:
-        progress.topic = question.topic
-    
-    db.commit()
-    
-    return question
+    return Response(content=json_codec.encode(question_service.get_payload(question_hash, question_data, live_id)), media_type="application/json")
 
 @app.post("/api/session/answer", response_model=AnswerResponse)
-async def submit_answer(answer_data: AnswerRequest, db: Session = Depends(get_db)):
+async def submit_answer(answer_data: AnswerRequest, request: Request, db: Session = Depends(get_db)):
     """Submit answer and get adaptive response"""
-    live_session = db.query(LiveSession).filter(LiveSession.code == answer_data.session_code).first()
-    if not live_session:
-        raise HTTPException(status_code=404, detail="Session not found")
+    forwarded = await shards.route(request, session_code=answer_data.session_code)
+    if forwarded:
+        return forwarded
     
-    progress = db.query(ParticipantProgress).filter(
-        ParticipantProgress.participant_id == answer_data.participant_id,
-        ParticipantProgress.live_id == live_session.live_id
-    ).first()
+    live_id = shards.live_id_for_code(answer_data.session_code)
+    if not live_id:
+        raise HTTPException(status_code=404, detail="Session not found")
     
+    progress = session_states.participant(db, live_id, answer_data.participant_id)
     if not progress:
         raise HTTPException(status_code=404, detail="Participant progress not found")
     
-    served = db.query(ServedQuestion).filter(
-        ServedQuestion.participant_id == answer_data.participant_id
-    ).order_by(ServedQuestion.question_hash.desc()).first()
-    
-    if not served:
-        raise HTTPException(status_code=400, detail="No question to answer")
+    # Only the question of the open round can be answered, and only once
+    current_round = round_timers.get_round(answer_data.participant_id)
+    if current_round is None:
+        raise HTTPException(status_code=409, detail="No open question to answer")
+    if current_round.expired:
+        raise HTTPException(status_code=409, detail="Time expired for this question")
+    
+    question_data = current_round.question_data
+    question_hash = current_round.question_hash
+    marked = db.execute(update(ServedQuestion).where(
+        ServedQuestion.participant_id == answer_data.participant_id,
+        ServedQuestion.question_hash == question_hash,
+        ServedQuestion.answered.isnot(True)
+    ).values(answered=True))
+    if marked.rowcount == 0:
+        db.rollback()
+        round_timers.finish_round(answer_data.participant_id)
+        raise HTTPException(status_code=409, detail="Question already answered")
+    
+    round_timers.finish_round(answer_data.participant_id)
     
     # Validate the answer against the stored question data
-    question_data = served.question_data
     correct_answer_index = question_data.get('answer_index', 0)
     is_correct = answer_data.answer_index == correct_answer_index
     
-    live_answer = LiveAnswer(
-        live_id=live_session.live_id,
+    db.add(LiveAnswer(
+        live_id=live_id,
         participant_id=answer_data.participant_id,
-        question_json={"simplified": "demo"},  # Would store full question
+        question_json=question_data,
         answer_index=answer_data.answer_index,
         correct=is_correct,
-        elapsed_ms=answer_data.elapsed_ms
-    )
+        elapsed_ms=answer_data.elapsed_ms,
+        question_hash=question_hash
+    ))
     
-    db.add(live_answer)
-    
-    if is_correct:
-        progress.correct_streak += 1
-        progress.theta = min(100, progress.theta + 5)
-        
-        if progress.correct_streak >= 2:
-            if progress.current_level == 'base':
-                progress.current_level = 'medio'
-            elif progress.current_level == 'medio':
-                progress.current_level = 'avanzato'
-            progress.correct_streak = 0
-    else:
-        progress.correct_streak = 0
-        progress.theta = max(0, progress.theta - 3)
-    
-    db.commit()
+    # Re-estimate ability from the whole response history, kept in memory by the session owner
+    progress.record_answer(question_data, is_correct)
+    session_states.commit(db, live_id, [progress])
+    item_analytics.record(db, live_id, question_hash, question_data, answer_data.answer_index, is_correct, answer_data.elapsed_ms)
+    leaderboards.record(db, live_id, answer_data.participant_id, progress.theta, is_correct, answer_data.elapsed_ms)
     
     next_action = "continue"
     explanation = None
+    explain_detailed = None
     
     if not is_correct:
         next_action = "explanation_required"
         explanation = "Risposta errata. Leggi la spiegazione dettagliata prima di continuare."
+        explain_detailed = question_data.get('explain_detailed')
     
     if progress.total_served >= 50:
         next_action = "finished"
     
-    answers = db.query(LiveAnswer).filter(
-        LiveAnswer.participant_id == answer_data.participant_id,
-        LiveAnswer.live_id == live_session.live_id
-    ).all()
-    
-    total_answers = len(answers)
-    correct_answers = len([a for a in answers if a.correct])
-    correct_percentage = (correct_answers / total_answers * 100) if total_answers > 0 else 0
-    
     return AnswerResponse(
         correct=is_correct,
         next_action=next_action,
         explanation=explanation,
+        explain_detailed=explain_detailed,
         total_served=progress.total_served,
         current_level=progress.current_level,
         theta=progress.theta
@@ -506,7 +767,7 @@ async def get_participants_status(live_id: str, db: Session = Depends(get_db)):
             nome=participant.nome,
             cognome=participant.cognome,
             current_level=progress.current_level if progress else "base",
-            theta=progress.theta if progress else 20,
+            theta=progress.theta if progress else INITIAL_THETA_SCORE,
             total_served=progress.total_served if progress else 0,
             correct_percentage=round(correct_percentage, 1),
             topic=progress.topic if progress else None
@@ -515,27 +776,29 @@ async def get_participants_status(live_id: str, db: Session = Depends(get_db)):
     return status_list
 
 @app.websocket("/ws/participant/{session_code}/{participant_id}")
-async def websocket_participant(websocket: WebSocket, session_code: str, participant_id: str):
-    await manager.connect_participant(websocket, session_code, participant_id)
+async def websocket_participant(websocket: WebSocket, session_code: str, participant_id: str, last_seq: Optional[int] = None, epoch: Optional[str] = None):
+    if await shards.relay(websocket, session_code=session_code):
+        return
+    await manager.connect_participant(websocket, session_code, participant_id, last_seq=last_seq, epoch=epoch)
     try:
         while True:
-            data = await websocket.receive_text()
-            pass
+            await manager.receive(websocket)
     except WebSocketDisconnect:
-        manager.disconnect_participant(session_code, participant_id)
+        manager.disconnect_participant(session_code, participant_id, websocket)
 
 @app.websocket("/ws/teacher/{live_id}")
 async def websocket_teacher(websocket: WebSocket, live_id: str):
+    if await shards.relay(websocket, live_id=live_id):
+        return
     await manager.connect_teacher(websocket, live_id)
     try:
         while True:
-            data = await websocket.receive_text()
-            pass
+            await manager.receive(websocket)
     except WebSocketDisconnect:
-        manager.disconnect_teacher(live_id)
+        manager.disconnect_teacher(live_id, websocket)
 
 @app.post("/api/upload-pdf", response_model=PDFUploadResponse)
-async def upload_pdf(file: UploadFile = File(...), live_id: str = Form(...), db: Session = Depends(get_db)):
+async def upload_pdf(request: Request, file: UploadFile = File(...), live_id: str = Form(...), db: Session = Depends(get_db)):
     """Upload PDF and generate questions using OpenAI"""
     if not file.filename.endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
@@ -543,6 +806,14 @@ async def upload_pdf(file: UploadFile = File(...), live_id: str = Form(...), db:
     if file.size > 25 * 1024 * 1024:  # 25MB limit
         raise HTTPException(status_code=400, detail="File size too large (max 25MB)")
     
+    # The owner holds the session's question index, so the questions are added there
+    if shards.enabled:
+        content = await file.read()
+        await file.seek(0)
+        forwarded = await shards.route(request, live_id=live_id, files={"file": (file.filename, content, file.content_type)}, data={"live_id": live_id})
+        if forwarded:
+            return forwarded
+    
     live_session = db.query(LiveSession).filter(LiveSession.live_id == live_id).first()
     if not live_session:
         raise HTTPException(status_code=404, detail="Session not found")
@@ -553,6 +824,8 @@ async def upload_pdf(file: UploadFile = File(...), live_id: str = Form(...), db:
             content = await file.read()
             buffer.write(content)
         
+        import PyPDF2
+        
         pdf_text = ""
         with open(file_path, "rb") as pdf_file:
             pdf_reader = PyPDF2.PdfReader(pdf_file)
@@ -585,6 +858,7 @@ Testo da analizzare:
 {pdf_text[:16000]}
 """
         
+        openai_client = get_openai_client()
         if openai_client is None:
             raise HTTPException(status_code=503, detail="OpenAI API not configured. PDF upload functionality is disabled.")
         
@@ -627,46 +901,25 @@ Testo da analizzare:
         if not questions or not isinstance(questions, list):
             raise HTTPException(status_code=500, detail="OpenAI response did not contain valid question array")
         
-        # Validate each question has required fields
+        # Questions that would not pass an import are skipped, the rest are added
         valid_questions = []
-        required_fields = ['topic', 'level', 'question', 'options', 'answer_index']
-        for i, question in enumerate(questions):
-            if not isinstance(question, dict):
-                continue
-            if all(field in question for field in required_fields):
-                if isinstance(question.get('answer_index'), int) and 0 <= question['answer_index'] < len(question.get('options', [])):
-                    valid_questions.append(question)
-                else:
-                    logging.warning(f"Question {i} has invalid answer_index: {question.get('answer_index')}")
-            else:
-                missing_fields = [field for field in required_fields if field not in question]
-                logging.warning(f"Question {i} missing required fields: {missing_fields}")
+        for i, question in enumerate(questions, 1):
+            try:
+                valid_questions.append(validate_question(i, question))
+            except QuestionFormatError as e:
+                log.warning("pdf_upload.question_skipped", live_id=live_session.live_id, error=str(e))
         
         if not valid_questions:
             raise HTTPException(status_code=500, detail="No valid questions could be extracted from OpenAI response")
         
         questions = valid_questions
         
-        topics_added = set()
-        questions_added = 0
+        result = insert_questions(db, SessionQuestion, {"live_id": live_session.live_id}, (question_row(q) for q in questions))
+        db.commit()
+        questions_added = result["imported"]
+        topics_added = result["topics"]
         
-        for question in questions:
-            level = question.get('level', 'base')
-            topic = question.get('topic', 'Generale')
-            
-            question_hash = question_service.generate_question_hash(question)
-            
-            session_question = SessionQuestion(
-                live_id=live_session.live_id,
-                question_data=question,
-                question_hash=question_hash,
-                level=level,
-                topic=topic
-            )
-            
-            db.add(session_question)
-            topics_added.add(topic)
-            questions_added += 1
+        question_service.invalidate_session_bank(live_session.live_id)
         
         os.remove(file_path)
         
@@ -683,3 +936,86 @@ Testo da analizzare:
         if os.path.exists(file_path):
             os.remove(file_path)
         raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+
+async def import_questions(request: Request, model, scope: dict) -> QuestionImportResponse:
+    # Validated while the body arrives, written afterwards off the event loop one committed chunk at a time
+    try:
+        spool = await spool_questions(request.stream())
+    except QuestionFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    result = await asyncio.to_thread(import_spool, spool, model, scope)
+    if not result["imported"] and not result["skipped"]:
+        raise HTTPException(status_code=400, detail="Question bank is empty")
+    return QuestionImportResponse(**result)
+
+@app.post("/api/live/{live_id}/questions", response_model=QuestionImportResponse)
+async def import_session_questions(live_id: str, request: Request, db: Session = Depends(get_db)):
+    """Add questions to the session bank from a JSONL body, one question per line"""
+    forwarded = await shards.route(request, live_id=live_id)
+    if forwarded:
+        return forwarded
+    
+    live_session = db.query(LiveSession).filter(LiveSession.live_id == live_id).first()
+    if not live_session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if live_session.status == 'ended':
+        raise HTTPException(status_code=400, detail="Session has ended")
+    db.close()
+    
+    result = await import_questions(request, SessionQuestion, {"live_id": live_id})
+    question_service.invalidate_session_bank(live_id)
+    return result
+
+@app.get("/api/live/{live_id}/questions")
+async def export_session_questions(live_id: str, db: Session = Depends(get_db)):
+    """Stream the session bank as JSONL"""
+    live_session = db.query(LiveSession).filter(LiveSession.live_id == live_id).first()
+    if not live_session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return StreamingResponse(
+        iter_bank(SessionQuestion, {"live_id": live_id}),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="questions-{live_session.code}.jsonl"'}
+    )
+
+@app.post("/api/live/{live_id}/questions/from-bank/{bank}")
+async def copy_bank_to_session(live_id: str, bank: str, request: Request, db: Session = Depends(get_db)):
+    """Copy a shared bank into the session bank, skipping questions it already has"""
+    forwarded = await shards.route(request, live_id=live_id)
+    if forwarded:
+        return forwarded
+    
+    live_session = db.query(LiveSession).filter(LiveSession.live_id == live_id).first()
+    if not live_session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    if live_session.status == 'ended':
+        raise HTTPException(status_code=400, detail="Session has ended")
+    if not db.query(SharedQuestion.id).filter(SharedQuestion.bank == bank).first():
+        raise HTTPException(status_code=404, detail="Question bank not found")
+    
+    imported = copy_shared_bank(db, bank, live_id)
+    db.commit()
+    question_service.invalidate_session_bank(live_id)
+    return {"live_id": live_id, "bank": bank, "imported": imported}
+
+@app.get("/api/banks")
+async def list_question_banks(db: Session = Depends(get_db)):
+    """Shared banks with their number of questions"""
+    rows = db.query(SharedQuestion.bank, func.count(SharedQuestion.id)).group_by(SharedQuestion.bank).order_by(SharedQuestion.bank)
+    return [{"bank": bank, "questions": count} for bank, count in rows]
+
+@app.post("/api/banks/{bank}/questions", response_model=QuestionImportResponse)
+async def import_shared_questions(bank: str, request: Request):
+    """Add questions to a shared bank from a JSONL body; the bank is created by its first import"""
+    return await import_questions(request, SharedQuestion, {"bank": bank})
+
+@app.get("/api/banks/{bank}/questions")
+async def export_shared_questions(bank: str, db: Session = Depends(get_db)):
+    """Stream a shared bank as JSONL"""
+    if not db.query(SharedQuestion.id).filter(SharedQuestion.bank == bank).first():
+        raise HTTPException(status_code=404, detail="Question bank not found")
+    return StreamingResponse(
+        iter_bank(SharedQuestion, {"bank": bank}),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="questions-{bank}.jsonl"'}
+    )
@@ -0,0 +1,147 @@
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+# SQL statement counter of the request being handled, if any
+_request_statements: ContextVar[Optional[List[int]]] = ContextVar("request_statements", default=None)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    In-process histograms and gauges rendered in the Prometheus text format.
+    Observing is a bisect and three increments, cheap enough for every request.
+    """
+
+    def __init__(self):
+        self.histograms: Dict[str, Dict[Tuple[Tuple[str, str], ...], Histogram]] = {}
+        self.descriptions: Dict[str, str] = {}
+        self.buckets: Dict[str, Tuple[float, ...]] = {}
+        self.gauges: Dict[str, Callable[[], Iterable[Tuple[Dict[str, str], float]]]] = {}
+
+    def histogram(self, name: str, description: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.histograms.setdefault(name, {})
+        self.descriptions[name] = description
+        self.buckets[name] = buckets
+
+    def gauge(self, name: str, description: str, collect: Callable[[], Iterable[Tuple[Dict[str, str], float]]]):
+        """Register a gauge whose (labels, value) samples are collected at scrape time"""
+        self.descriptions[name] = description
+        self.gauges[name] = collect
+
+    def observe(self, name: str, value: float, **labels: str):
+        series = self.histograms[name]
+        key = tuple(sorted(labels.items()))
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram(self.buckets[name])
+        histogram.observe(value)
+
+    def render(self) -> str:
+        lines = []
+        for name, series in self.histograms.items():
+            lines.append(f"# HELP {name} {self.descriptions[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f"{name}_bucket{_labels(key + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_labels(key)} {histogram.sum}")
+                lines.append(f"{name}_count{_labels(key)} {histogram.count}")
+        for name, collect in self.gauges.items():
+            lines.append(f"# HELP {name} {self.descriptions[name]}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in collect():
+                lines.append(f"{name}{_labels(tuple(sorted(labels.items())))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(pairs: Tuple[Tuple[str, str], ...]) -> str:
+    if not pairs:
+        return ""
+    escaped = (
+        key + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for key, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+metrics = Metrics()
+metrics.histogram("http_request_duration_seconds", "HTTP request latency by route")
+metrics.histogram("http_request_sql_statements", "SQL statements executed per HTTP request by route", COUNT_BUCKETS)
+metrics.histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled DB connection")
+metrics.histogram("ws_fanout_duration_seconds", "Time to send one broadcast to every socket of a session")
+metrics.histogram("question_selection_seconds", "Time spent in QuestionService.get_next_question")
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency and SQL statement count per route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        statements = [0]
+        token = _request_statements.set(statements)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_statements.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            metrics.observe("http_request_duration_seconds", elapsed, route=path, method=scope["method"], status=str(status[0]))
+            metrics.observe("http_request_sql_statements", statements[0], route=path, method=scope["method"])
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    statements = _request_statements.get()
+    if statements is not None:
+        statements[0] += 1
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.observe("db_pool_checkout_wait_seconds", time.perf_counter() - start)
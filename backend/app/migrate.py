@@ -0,0 +1,53 @@
+"""
+One-off schema step, run before starting the app workers:
+
+    cd backend && python -m app.migrate
+
+The app itself only creates the schema on startup when AUTO_MIGRATE is on (the
+default for a local SQLite database).
+"""
+import time
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+
+from app.database import DATABASE_URL, create_tables, engine
+from app.event_log import get_logger
+from app.models import Base
+
+log = get_logger("app.migrate")
+
+
+def add_missing_columns():
+    """
+    create_all only creates missing tables: add the nullable columns and the
+    indexes that were introduced after a table was first created.
+    """
+    added = []
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                added.append(f"{table.name}.{column.name}")
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    conn.execute(CreateIndex(index))
+                    added.append(index.name)
+    return added
+
+
+def migrate():
+    start = time.perf_counter()
+    create_tables()
+    added = add_missing_columns()
+    log.event("schema.migrated", backend=DATABASE_URL.split(":", 1)[0], added=added, seconds=round(time.perf_counter() - start, 3))
+
+
+if __name__ == "__main__":
+    migrate()
@@ -1,9 +1,11 @@
-from sqlalchemy import Column, String, Integer, Boolean, DateTime, Text, ForeignKey, CheckConstraint, JSON
+from sqlalchemy import Column, String, Integer, BigInteger, Boolean, DateTime, Float, Text, ForeignKey, CheckConstraint, JSON
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import uuid
 
+from app.adaptive_engine import INITIAL_THETA_SCORE
+
 Base = declarative_base()
 
 class Participant(Base):
@@ -25,6 +27,7 @@ class LiveSession(Base):
     status = Column(String, nullable=False, default='lobby')
     locked = Column(Boolean, default=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    archive_location = Column(String, nullable=True)  # set once the answer data is in its archive
     
     __table_args__ = (
         CheckConstraint("status IN ('lobby','running','paused','ended')", name='check_status'),
@@ -47,7 +50,7 @@ class ParticipantProgress(Base):
     participant_id = Column(String, ForeignKey('participants.participant_id'), primary_key=True)
     live_id = Column(String, ForeignKey('live_sessions.live_id'), primary_key=True)
     current_level = Column(String, nullable=False, default='base')
-    theta = Column(Integer, default=20)
+    theta = Column(Integer, default=INITIAL_THETA_SCORE)
     topic = Column(String, nullable=True)
     correct_streak = Column(Integer, default=0)
     total_served = Column(Integer, default=0)
@@ -65,6 +68,7 @@ class ServedQuestion(Base):
     participant_id = Column(String, ForeignKey('participants.participant_id'), primary_key=True)
     question_hash = Column(String, primary_key=True)
     question_data = Column(JSON)
+    answered = Column(Boolean, nullable=True, default=False)  # answered or timed out
     
     participant = relationship("Participant")
 
@@ -78,6 +82,7 @@ class LiveAnswer(Base):
     answer_index = Column(Integer, nullable=True)
     correct = Column(Boolean, nullable=True)
     elapsed_ms = Column(Integer, nullable=True)
+    question_hash = Column(String, nullable=True, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     live_session = relationship("LiveSession")
@@ -87,10 +92,53 @@ class SessionQuestion(Base):
     __tablename__ = "session_questions"
     
     id = Column(Integer, primary_key=True, autoincrement=True)
-    live_id = Column(String, ForeignKey('live_sessions.live_id'), nullable=False)
+    live_id = Column(String, ForeignKey('live_sessions.live_id'), nullable=False, index=True)
+    question_data = Column(JSON, nullable=False)
+    question_hash = Column(String, nullable=False)
+    level = Column(String, nullable=False)
+    topic = Column(String, nullable=False)
+    
+    live_session = relationship("LiveSession")
+
+class SharedQuestion(Base):
+    __tablename__ = "shared_questions"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    bank = Column(String, nullable=False, index=True)
     question_data = Column(JSON, nullable=False)
     question_hash = Column(String, nullable=False)
     level = Column(String, nullable=False)
     topic = Column(String, nullable=False)
+
+class RosterToken(Base):
+    __tablename__ = "roster_tokens"
+    
+    token = Column(String, primary_key=True)
+    live_id = Column(String, ForeignKey('live_sessions.live_id'), nullable=False, index=True)
+    participant_id = Column(String, ForeignKey('participants.participant_id'), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     live_session = relationship("LiveSession")
+    participant = relationship("Participant")
+
+class ShardMember(Base):
+    __tablename__ = "shard_members"
+    
+    worker_id = Column(String, primary_key=True)
+    url = Column(String, nullable=False)
+    heartbeat_at = Column(Float, nullable=False)  # epoch seconds
+
+class SessionLease(Base):
+    __tablename__ = "session_leases"
+    
+    live_id = Column(String, primary_key=True)
+    worker_id = Column(String, nullable=False, index=True)
+    url = Column(String, nullable=False)
+    expires_at = Column(Float, nullable=False)  # epoch seconds
+
+class SessionCodeCounter(Base):
+    __tablename__ = "session_code_counter"
+    
+    id = Column(Integer, primary_key=True)
+    next_value = Column(BigInteger, nullable=False)  # next position in the code permutation
+    key = Column(String, nullable=False)  # hex key of the permutation, shared by all workers
@@ -0,0 +1,211 @@
+"""
+Bulk import and export of question banks as JSONL, one question object per line
+in the format produced by the PDF upload.
+
+A bank is either the SessionQuestion rows of one live session or a named shared
+bank (SharedQuestion rows) that can be copied into any session. Imports are
+validated line by line while the body is received and spooled to a temporary
+file, then written in multi-row INSERTs of QUESTION_BANK_CHUNK_SIZE, each
+committed on its own. Questions whose hash is already in the bank are skipped,
+so an interrupted import can simply be sent again. Exports stream the rows with
+a server-side cursor.
+"""
+import json
+import os
+import tempfile
+import time
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Set
+
+from pydantic import ValidationError
+from sqlalchemy import and_, insert, literal, select
+from sqlalchemy.orm import Session
+
+from app.adaptive_engine import LEVELS
+from app.archive import is_archived, iter_archive
+from app.database import SessionLocal
+from app.models import SessionQuestion, SharedQuestion
+from app.question_service import question_service
+from app.roster import iter_lines
+from app.schemas import QuestionData
+
+QUESTION_BANK_CHUNK_SIZE = int(os.getenv("QUESTION_BANK_CHUNK_SIZE", "1000"))
+QUESTION_EXPORT_FETCH_SIZE = 1000
+# Parsed questions are kept in memory up to this size, then on disk
+QUESTION_SPOOL_BYTES = 8 * 1024 * 1024
+
+
+class QuestionFormatError(ValueError):
+    def __init__(self, line: int, message: str):
+        super().__init__(f"Line {line}: {message}")
+        self.line = line
+
+
+def validate_question(line_number: int, record) -> Dict:
+    """The question as given (extra keys such as irt_b are kept) once it passes QuestionData"""
+    if not isinstance(record, dict):
+        raise QuestionFormatError(line_number, "expected a JSON object")
+    try:
+        question = QuestionData(**record)
+    except ValidationError as e:
+        error = e.errors()[0]
+        raise QuestionFormatError(line_number, f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}")
+    if question.level not in LEVELS:
+        raise QuestionFormatError(line_number, f"level must be one of {', '.join(LEVELS)}")
+    if not 0 <= question.answer_index < len(question.options):
+        raise QuestionFormatError(line_number, "answer_index out of range")
+    return record
+
+
+def question_row(question: Dict) -> Dict:
+    return {
+        "question_data": question,
+        "question_hash": question_service.generate_question_hash(question),
+        "level": question["level"],
+        "topic": question["topic"]
+    }
+
+
+async def spool_questions(chunks: AsyncIterator[bytes]):
+    """
+    Validate a JSONL stream into a temporary file of question rows. The file is
+    returned rewound; the caller closes it.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=QUESTION_SPOOL_BYTES, mode="w+", encoding="utf-8")
+    try:
+        line_number = 0
+        async for line in iter_lines(chunks):
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise QuestionFormatError(line_number, f"invalid JSON ({e.msg})")
+            spool.write(json.dumps(question_row(validate_question(line_number, record))) + "\n")
+        spool.seek(0)
+        return spool
+    except Exception:
+        spool.close()
+        raise
+
+
+def _bank(model, scope: Dict):
+    """Filter for the rows of a bank: scope is {"live_id": ...} or {"bank": ...}"""
+    (column, value), = scope.items()
+    return getattr(model, column) == value
+
+
+def existing_hashes(db: Session, model, scope: Dict) -> Set[str]:
+    return {row[0] for row in db.query(model.question_hash).filter(_bank(model, scope))}
+
+
+def new_question_chunks(rows: Iterable[Dict], scope: Dict, seen: Set[str], result: Dict) -> Iterator[List[Dict]]:
+    """Rows not in `seen`, in chunks of QUESTION_BANK_CHUNK_SIZE; counts go into result"""
+    topics = set()
+    chunk: List[Dict] = []
+    for row in rows:
+        if row["question_hash"] in seen:
+            result["skipped"] += 1
+            continue
+        seen.add(row["question_hash"])
+        topics.add(row["topic"])
+        chunk.append({**scope, **row})
+        if len(chunk) >= QUESTION_BANK_CHUNK_SIZE:
+            yield chunk
+            result["imported"] += len(chunk)
+            chunk = []
+    if chunk:
+        yield chunk
+        result["imported"] += len(chunk)
+    result["topics"] = sorted(topics)
+
+
+def _add_payloads(model, scope: Dict, chunk: List[Dict]):
+    """Questions added to a session bank are encoded for participants now, not on first selection"""
+    if model is SessionQuestion:
+        question_service.add_payloads(scope["live_id"], chunk)
+
+
+def insert_questions(db: Session, model, scope: Dict, rows: Iterable[Dict]) -> Dict:
+    """
+    Insert question rows into a bank in multi-row INSERTs, skipping hashes the bank
+    already holds. The caller owns the transaction.
+    """
+    result = {"imported": 0, "skipped": 0, "topics": []}
+    for chunk in new_question_chunks(rows, scope, existing_hashes(db, model, scope), result):
+        db.execute(insert(model), chunk)
+        _add_payloads(model, scope, chunk)
+    return result
+
+
+def import_spool(spool, model, scope: Dict) -> Dict:
+    """
+    Write a spooled import (run in a thread). Every chunk is a short transaction of
+    its own, so the database writer is released between chunks and requests on the
+    event loop wait for one chunk at most, never for the whole import.
+    """
+    result = {"imported": 0, "skipped": 0, "topics": []}
+    try:
+        db = SessionLocal()
+        try:
+            seen = existing_hashes(db, model, scope)
+        finally:
+            db.close()
+        for chunk in new_question_chunks((json.loads(line) for line in spool), scope, seen, result):
+            db = SessionLocal()
+            try:
+                db.execute(insert(model), chunk)
+                db.commit()
+            finally:
+                db.close()
+            _add_payloads(model, scope, chunk)
+            # Let a writer waiting on the event loop take the connection before the next chunk
+            time.sleep(0)
+        return result
+    finally:
+        spool.close()
+
+
+def copy_shared_bank(db: Session, bank: str, live_id: str) -> int:
+    """Copy a shared bank into a session bank with one INSERT ... SELECT, skipping questions already there"""
+    already = select(SessionQuestion.id).where(
+        SessionQuestion.live_id == live_id,
+        SessionQuestion.question_hash == SharedQuestion.question_hash
+    ).exists()
+    source = select(
+        literal(live_id), SharedQuestion.question_data, SharedQuestion.question_hash,
+        SharedQuestion.level, SharedQuestion.topic
+    ).where(and_(SharedQuestion.bank == bank, ~already)).order_by(SharedQuestion.id)
+    result = db.execute(insert(SessionQuestion).from_select(
+        ["live_id", "question_data", "question_hash", "level", "topic"], source
+    ))
+    return result.rowcount
+
+
+def iter_bank(model, scope: Dict) -> Iterator[str]:
+    """
+    Encode a bank as JSONL for a streaming response, one fetch of rows per chunk
+    (each chunk is a thread hop in Starlette). Uses its own DB session so it
+    outlives the request's dependency scope; the bank of an archived session is
+    read back from its archive.
+    """
+    if model is SessionQuestion and is_archived(scope["live_id"]):
+        lines = []
+        for row in iter_archive(scope["live_id"], "session_questions"):
+            lines.append(json.dumps(row["question_data"]) + "\n")
+            if len(lines) >= QUESTION_EXPORT_FETCH_SIZE:
+                yield "".join(lines)
+                lines = []
+        if lines:
+            yield "".join(lines)
+        return
+    db = SessionLocal()
+    try:
+        result = db.execute(
+            select(model.question_data).where(_bank(model, scope)).order_by(model.id)
+            .execution_options(yield_per=QUESTION_EXPORT_FETCH_SIZE)
+        )
+        for rows in result.partitions():
+            yield "".join(json.dumps(question_data) + "\n" for (question_data,) in rows)
+    finally:
+        db.close()
@@ -1,12 +1,28 @@
+import asyncio
 import random
 import hashlib
-import json
-from typing import List, Dict, Optional
-from app.schemas import QuestionResponse
+import os
+import time
+from typing import Iterable, List, Dict, Optional
+from app.schemas import QuestionResponse, QuestionData
+from app.adaptive_engine import ItemBank, get_selection_engine
+from app.ws_codecs import Preencoded, preencode
+from app.metrics import metrics
+
+# Never sent with the question: the key, and the long explanation which is only
+# returned after a wrong answer
+PRIVATE_QUESTION_FIELDS = {'answer_index', 'explain_detailed'}
 
 class QuestionService:
     def __init__(self):
         self.questions_db = {}
+        self.selection_engine = get_selection_engine(os.getenv("QUESTION_SELECTION_ENGINE", "irt"))
+        self._default_bank: Optional[ItemBank] = None
+        self._session_banks: Dict[str, ItemBank] = {}
+        self._bank_locks: Dict[str, asyncio.Lock] = {}
+        self._bank_versions: Dict[str, int] = {}  # bumped when a session's questions change
+        # live_id (None for the default bank) -> question hash -> encoded payload
+        self._payloads: Dict[Optional[str], Dict[str, Preencoded]] = {}
         self._load_sample_questions()
     
     def generate_question_hash(self, question_data: Dict) -> str:
@@ -18,17 +34,107 @@ class QuestionService:
         """Get available topics for a given level"""
         return list(self.questions_db.get(level, {}).keys())
     
-    def get_next_question(self, level: str, topic: Optional[str] = None, served_hashes: Optional[List[str]] = None, live_id: Optional[str] = None, db_session=None) -> Optional[QuestionResponse]:
+    def get_default_bank(self) -> ItemBank:
+        """Item bank over the in-memory questions_db, rebuilt only when questions are added"""
+        if self._default_bank is None:
+            questions = [q for topics in self.questions_db.values() for qs in topics.values() for q in qs]
+            self._default_bank = ItemBank(questions, [self.generate_question_hash(q) for q in questions])
+        return self._default_bank
+    
+    def _query_session_bank(self, live_id: str, db_session) -> ItemBank:
+        from app.models import SessionQuestion
+        rows = db_session.query(SessionQuestion.question_data, SessionQuestion.question_hash).filter(
+            SessionQuestion.live_id == live_id
+        ).all()
+        return ItemBank([row[0] for row in rows], [row[1] for row in rows])
+    
+    def get_session_bank(self, live_id: str, db_session) -> ItemBank:
+        """Item bank over the SessionQuestion rows of a live session, cached per live_id"""
+        bank = self._session_banks.get(live_id)
+        if bank is None:
+            bank = self._session_banks[live_id] = self._query_session_bank(live_id, db_session)
+        return bank
+    
+    def _build_session_bank(self, live_id: str) -> ItemBank:
+        from app.database import SessionLocal
+        db_session = SessionLocal()
+        try:
+            return self._query_session_bank(live_id, db_session)
+        finally:
+            db_session.close()
+    
+    async def load_session_bank(self, live_id: str) -> ItemBank:
+        """
+        Build the bank of a session in a thread before selecting from it: a large
+        bank takes over a second, which would stall every request on the event
+        loop. Concurrent callers wait for the same build.
+        """
+        if live_id not in self._session_banks:
+            async with self._bank_locks.setdefault(live_id, asyncio.Lock()):
+                while live_id not in self._session_banks:
+                    version = self._bank_versions.get(live_id, 0)
+                    bank = await asyncio.to_thread(self._build_session_bank, live_id)
+                    # Questions added while it was built make it stale: build it again
+                    if self._bank_versions.get(live_id, 0) == version:
+                        self._session_banks[live_id] = bank
+        return self._session_banks[live_id]
+    
+    def _encode_payload(self, question_data: Dict) -> Preencoded:
+        return preencode(QuestionResponse(**question_data).dict(exclude=PRIVATE_QUESTION_FIELDS))
+    
+    def add_payloads(self, live_id: str, rows: Iterable[Dict]):
+        """Encode the payloads of question rows added to a session bank, ahead of their first selection"""
+        payloads = self._payloads.setdefault(live_id, {})
+        for row in rows:
+            payloads[row["question_hash"]] = self._encode_payload(row["question_data"])
+    
+    def get_payload(self, question_hash: str, question_data: Dict, live_id: Optional[str] = None) -> Preencoded:
+        """
+        Encoded question as sent to participants, without answer and detailed
+        explanation. Questions not encoded on import (e.g. copied from a shared bank,
+        or imported before a restart) are encoded on their first serve.
+        """
+        payloads = self._payloads.setdefault(live_id, {})
+        payload = payloads.get(question_hash)
+        if payload is None:
+            payload = payloads[question_hash] = self._encode_payload(question_data)
+        return payload
+    
+    def invalidate_session_bank(self, live_id: str):
+        """Drop the cached bank of a session after its questions change; payloads stay valid"""
+        self._session_banks.pop(live_id, None)
+        self._bank_versions[live_id] = self._bank_versions.get(live_id, 0) + 1
+    
+    def drop_session(self, live_id: str):
+        """Drop the bank and payloads of a session that ended or moved to another worker"""
+        self._session_banks.pop(live_id, None)
+        self._bank_locks.pop(live_id, None)
+        self._bank_versions.pop(live_id, None)
+        self._payloads.pop(live_id, None)
+    
+    def get_next_question(self, level: str, topic: Optional[str] = None, served_hashes: Optional[List[str]] = None, live_id: Optional[str] = None, db_session=None, theta: Optional[float] = None) -> Optional[QuestionData]:
+        start = time.perf_counter()
+        try:
+            return self._get_next_question(level, topic, served_hashes, live_id, db_session, theta)
+        finally:
+            metrics.observe("question_selection_seconds", time.perf_counter() - start,
+                            strategy=self.selection_engine.name if theta is not None else "legacy")
+    
+    def _get_next_question(self, level: str, topic: Optional[str], served_hashes: Optional[List[str]], live_id: Optional[str], db_session, theta: Optional[float]) -> Optional[QuestionData]:
         """
         Generate next question based on level and topic, avoiding served questions
         Checks session-specific questions first, then falls back to default database
-        Uses intelligent fallback strategy for topic selection
+        When an ability estimate is given, selection is delegated to the selection engine;
+        otherwise uses intelligent fallback strategy for topic selection
         """
         if served_hashes is None:
             served_hashes = []
         
         served_hashes_set = set(served_hashes)
         
+        if theta is not None:
+            return self._select_adaptive(theta, topic, served_hashes_set, live_id, db_session)
+        
         if live_id and db_session:
             from app.models import SessionQuestion
             session_questions = db_session.query(SessionQuestion).filter(
@@ -49,7 +155,7 @@ class QuestionService:
                 
                 if available_questions:
                     selected_question = random.choice(available_questions)
-                    return QuestionResponse(**selected_question)
+                    return QuestionData(**selected_question)
         
         level_questions = self.questions_db.get(level, {})
         if not level_questions:
@@ -60,7 +166,7 @@ class QuestionService:
                 level_questions[topic], served_hashes_set
             )
             if available_questions:
-                return QuestionResponse(**random.choice(available_questions))
+                return QuestionData(**random.choice(available_questions))
         
         # Intelligent fallback: prioritize topics with more available questions
         topic_scores = []
@@ -89,7 +195,23 @@ class QuestionService:
         )
         
         if available_questions:
-            return QuestionResponse(**random.choice(available_questions))
+            return QuestionData(**random.choice(available_questions))
+        
+        return None
+    
+    def _select_adaptive(self, theta: float, topic: Optional[str], served_hashes_set: set, live_id: Optional[str], db_session) -> Optional[QuestionData]:
+        """Pick the next item with the selection engine, session bank first then default bank"""
+        banks = []
+        if live_id and db_session:
+            banks.append(self.get_session_bank(live_id, db_session))
+        banks.append(self.get_default_bank())
+        
+        for bank in banks:
+            if not len(bank):
+                continue
+            index = self.selection_engine.select(bank, theta, served_hashes_set, topic)
+            if index is not None:
+                return QuestionData(**bank.questions[index])
         
         return None
     
@@ -170,5 +292,7 @@ class QuestionService:
                 self.questions_db[level][topic] = []
             
             self.questions_db[level][topic].append(question)
+        
+        self._default_bank = None
 
 question_service = QuestionService()
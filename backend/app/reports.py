@@ -0,0 +1,100 @@
+import csv
+import io
+import json
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from sqlalchemy import and_, case, func, select
+from sqlalchemy.orm import Session
+
+from app.adaptive_engine import INITIAL_THETA_SCORE
+from app.database import SessionLocal
+from app.models import LiveAnswer, LiveParticipant, Participant, ParticipantProgress
+
+REPORT_FIELDS = [
+    'participant_id', 'nome', 'cognome', 'total_questions', 'correct_answers',
+    'percentage', 'final_level', 'final_theta'
+]
+REPORT_FETCH_SIZE = 500
+
+
+def report_statement(live_id: str, participant_id: Optional[str] = None):
+    """One query for the whole session report: answers are aggregated in a grouped subquery"""
+    answers = select(
+        LiveAnswer.participant_id,
+        func.count(LiveAnswer.id).label('total'),
+        func.sum(case((LiveAnswer.correct == True, 1), else_=0)).label('correct')
+    ).where(LiveAnswer.live_id == live_id).group_by(LiveAnswer.participant_id).subquery()
+
+    stmt = select(
+        Participant.participant_id,
+        Participant.nome,
+        Participant.cognome,
+        func.coalesce(answers.c.total, 0).label('total'),
+        func.coalesce(answers.c.correct, 0).label('correct'),
+        ParticipantProgress.current_level,
+        ParticipantProgress.theta
+    ).select_from(LiveParticipant).join(
+        Participant, Participant.participant_id == LiveParticipant.participant_id
+    ).outerjoin(
+        ParticipantProgress, and_(
+            ParticipantProgress.participant_id == LiveParticipant.participant_id,
+            ParticipantProgress.live_id == LiveParticipant.live_id
+        )
+    ).outerjoin(
+        answers, answers.c.participant_id == LiveParticipant.participant_id
+    ).where(LiveParticipant.live_id == live_id).order_by(LiveParticipant.id)
+
+    if participant_id is not None:
+        stmt = stmt.where(LiveParticipant.participant_id == participant_id)
+    return stmt
+
+
+def report_row(row) -> Dict:
+    total, correct = int(row.total), int(row.correct)
+    percentage = (correct / total * 100) if total > 0 else 0
+    return {
+        "participant_id": str(row.participant_id),
+        "nome": row.nome,
+        "cognome": row.cognome,
+        "total_questions": total,
+        "correct_answers": correct,
+        "percentage": round(percentage, 1),
+        "final_level": row.current_level or "base",
+        "final_theta": row.theta if row.theta is not None else INITIAL_THETA_SCORE
+    }
+
+
+def build_report(db: Session, live_id: str) -> List[Dict]:
+    return [report_row(row) for row in db.execute(report_statement(live_id))]
+
+
+def encode_report(rows: Iterable[Dict], fmt: str) -> Iterator[str]:
+    """Encode report rows one at a time as CSV or JSONL"""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        for row in rows:
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    else:
+        for row in rows:
+            yield json.dumps(row) + "\n"
+
+
+def iter_report(live_id: str, fmt: str) -> Iterator[str]:
+    """
+    Encode the report row by row for a streaming response.
+    Uses its own DB session so it outlives the request's dependency scope.
+    """
+    db = SessionLocal()
+    try:
+        result = db.execute(report_statement(live_id).execution_options(yield_per=REPORT_FETCH_SIZE))
+        yield from encode_report((report_row(row) for row in result), fmt)
+    finally:
+        db.close()
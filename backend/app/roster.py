@@ -0,0 +1,101 @@
+import codecs
+import csv
+import json
+import os
+import secrets
+import uuid
+from typing import AsyncIterator, Dict, List
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from app.adaptive_engine import INITIAL_THETA_SCORE
+from app.models import LiveParticipant, Participant, ParticipantProgress, RosterToken
+
+ROSTER_FIELDS = ('nome', 'cognome', 'email', 'corso')
+ROSTER_CHUNK_SIZE = int(os.getenv("ROSTER_CHUNK_SIZE", "1000"))
+
+
+class RosterFormatError(ValueError):
+    def __init__(self, line: int, message: str):
+        super().__init__(f"Line {line}: {message}")
+        self.line = line
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Decode a byte stream into lines without buffering the whole body"""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    tail = ''
+    async for chunk in chunks:
+        tail += decoder.decode(chunk)
+        *lines, tail = tail.split('\n')
+        for line in lines:
+            yield line.rstrip('\r')
+    tail += decoder.decode(b'', final=True)
+    if tail:
+        yield tail.rstrip('\r')
+
+
+def _entry(line_number: int, record: Dict) -> Dict:
+    entry = {field: (record.get(field) or '').strip() or None for field in ROSTER_FIELDS}
+    if not entry['nome'] or not entry['cognome']:
+        raise RosterFormatError(line_number, "nome and cognome are required")
+    return entry
+
+
+async def parse_roster(chunks: AsyncIterator[bytes], fmt: str) -> AsyncIterator[Dict]:
+    """Yield validated roster entries from a CSV (with header) or JSONL stream"""
+    header = None
+    line_number = 0
+    async for line in iter_lines(chunks):
+        line_number += 1
+        if not line.strip():
+            continue
+        if fmt == 'jsonl':
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise RosterFormatError(line_number, f"invalid JSON ({e.msg})")
+            if not isinstance(record, dict):
+                raise RosterFormatError(line_number, "expected a JSON object")
+        else:
+            values = next(csv.reader([line]))
+            if header is None:
+                header = [value.strip().lower() for value in values]
+                if 'nome' not in header or 'cognome' not in header:
+                    raise RosterFormatError(line_number, "CSV header must contain nome and cognome")
+                continue
+            record = dict(zip(header, values))
+        yield _entry(line_number, record)
+
+
+def insert_roster_chunk(db: Session, live_id: str, entries: List[Dict]) -> List[Dict]:
+    """
+    Insert participants, live participants, progress rows and join tokens for a chunk
+    of roster entries as four multi-row INSERTs. The caller owns the transaction.
+    """
+    rows = []
+    for entry in entries:
+        rows.append({**entry, 'participant_id': str(uuid.uuid4()), 'token': secrets.token_urlsafe(16)})
+
+    db.execute(insert(Participant), [
+        {field: row[field] for field in ('participant_id',) + ROSTER_FIELDS} for row in rows
+    ])
+    db.execute(insert(LiveParticipant), [
+        {'live_id': live_id, 'participant_id': row['participant_id']} for row in rows
+    ])
+    db.execute(insert(ParticipantProgress), [
+        {
+            'participant_id': row['participant_id'],
+            'live_id': live_id,
+            'current_level': 'base',
+            'theta': INITIAL_THETA_SCORE,
+            'topic': None,
+            'correct_streak': 0,
+            'total_served': 0
+        } for row in rows
+    ])
+    db.execute(insert(RosterToken), [
+        {'token': row['token'], 'live_id': live_id, 'participant_id': row['participant_id']} for row in rows
+    ])
+    return rows
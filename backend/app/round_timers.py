@@ -0,0 +1,160 @@
+import os
+import time
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import and_, or_, update
+
+from app.database import SessionLocal
+from app.models import LiveAnswer, ServedQuestion
+from app.item_analytics import item_analytics
+from app.leaderboard import leaderboards
+from app.session_state import session_states
+from app.timing_wheel import TimingWheel
+from app.websocket_manager import manager
+
+ROUND_SECONDS = int(os.getenv("ROUND_SECONDS", "30"))
+# Extra time granted for network latency before an answer counts as late
+ROUND_GRACE_SECONDS = float(os.getenv("ROUND_GRACE_SECONDS", "2"))
+
+
+class Round:
+    __slots__ = ('live_id', 'participant_id', 'question_hash', 'question_data', 'started_at', 'remaining', 'expired')
+
+    def __init__(self, live_id: str, participant_id: str, question_hash: str, question_data: Dict):
+        self.live_id = live_id
+        self.participant_id = participant_id
+        self.question_hash = question_hash
+        self.question_data = question_data
+        self.started_at = time.monotonic()
+        self.remaining: Optional[float] = None  # set while the session is paused
+        self.expired = False
+
+
+class RoundTimers:
+    """
+    Server-side question deadlines for every participant, all held on one timing wheel.
+    A round starts when a question is served and ends with an answer or a timeout;
+    timeouts are recorded as incorrect LiveAnswer rows in one transaction per tick.
+    """
+
+    def __init__(self, round_seconds: int = ROUND_SECONDS, grace_seconds: float = ROUND_GRACE_SECONDS):
+        self.round_seconds = round_seconds
+        self.grace_seconds = grace_seconds
+        self.wheel = TimingWheel(self._expire)
+        self.rounds: Dict[str, Round] = {}
+        self.session_participants: Dict[str, Set[str]] = {}
+
+    def start_round(self, live_id: str, participant_id: str, question_hash: str, question_data: Dict):
+        """Start the deadline for a newly served question, replacing any previous round"""
+        current = Round(live_id, participant_id, question_hash, question_data)
+        self.rounds[participant_id] = current
+        self.session_participants.setdefault(live_id, set()).add(participant_id)
+        self.wheel.schedule(participant_id, self.round_seconds + self.grace_seconds, current)
+
+    def get_round(self, participant_id: str) -> Optional[Round]:
+        return self.rounds.get(participant_id)
+
+    def finish_round(self, participant_id: str) -> Optional[Round]:
+        """Stop the deadline of an answered question"""
+        self.wheel.cancel(participant_id)
+        current = self.rounds.pop(participant_id, None)
+        if current is not None:
+            self._forget(current)
+        return current
+
+    def pause_session(self, live_id: str):
+        """Freeze the deadlines of a session, keeping the time left"""
+        for participant_id in self.session_participants.get(live_id, ()):
+            current = self.rounds.get(participant_id)
+            if current is None or current.expired:
+                continue
+            current.remaining = self.wheel.remaining(participant_id)
+            self.wheel.cancel(participant_id)
+
+    def resume_session(self, live_id: str):
+        """Restart frozen deadlines with the time they had left"""
+        for participant_id in self.session_participants.get(live_id, ()):
+            current = self.rounds.get(participant_id)
+            if current is None or current.remaining is None:
+                continue
+            self.wheel.schedule(participant_id, current.remaining, current)
+            current.remaining = None
+
+    def end_session(self, live_id: str):
+        """Drop every round of an ended session without recording timeouts"""
+        for participant_id in self.session_participants.pop(live_id, set()):
+            self.wheel.cancel(participant_id)
+            self.rounds.pop(participant_id, None)
+
+    def _forget(self, current: Round):
+        participants = self.session_participants.get(current.live_id)
+        if participants is not None:
+            participants.discard(current.participant_id)
+            if not participants:
+                del self.session_participants[current.live_id]
+
+    async def _expire(self, expired: List[Round]):
+        expired = [r for r in expired if self.rounds.get(r.participant_id) is r]
+        if not expired:
+            return
+
+        db = SessionLocal()
+        try:
+            # Loaded before the timeout rows are added, which the history must not count twice
+            states = []
+            for current in expired:
+                current.expired = True
+                state = session_states.participant(db, current.live_id, current.participant_id)
+                if state is not None:
+                    state.record_answer(current.question_data, False)
+                states.append(state)
+
+            elapsed_ms = self.round_seconds * 1000
+            for current in expired:
+                db.add(LiveAnswer(
+                    live_id=current.live_id,
+                    participant_id=current.participant_id,
+                    question_json=current.question_data,
+                    answer_index=None,
+                    correct=False,
+                    elapsed_ms=elapsed_ms,
+                    question_hash=current.question_hash
+                ))
+
+            db.execute(update(ServedQuestion).where(or_(*(
+                and_(ServedQuestion.participant_id == r.participant_id, ServedQuestion.question_hash == r.question_hash)
+                for r in expired
+            ))).values(answered=True))
+
+            try:
+                for current, state in zip(expired, states):
+                    if state is not None:
+                        session_states.save(db, current.live_id, state)
+                db.commit()
+            except Exception:
+                db.rollback()
+                for current in expired:
+                    session_states.forget(current.live_id, current.participant_id)
+                raise
+
+            for current, state in zip(expired, states):
+                item_analytics.record(db, current.live_id, current.question_hash, current.question_data, None, False, elapsed_ms)
+                if state is not None:
+                    leaderboards.record(db, current.live_id, current.participant_id, state.theta, False, elapsed_ms)
+                await manager.send_to_participant(current.participant_id, {
+                    "type": "round.timeout",
+                    "result": {
+                        "correct": False,
+                        "next_action": "finished" if state and state.total_served >= 50 else "explanation_required",
+                        "explanation": "Tempo scaduto. Leggi la spiegazione dettagliata prima di continuare.",
+                        "explain_detailed": current.question_data.get('explain_detailed'),
+                        "total_served": state.total_served if state else 0,
+                        "current_level": state.current_level if state else "base",
+                        "theta": state.theta if state else 0
+                    }
+                })
+        finally:
+            db.close()
+
+
+round_timers = RoundTimers()
@@ -39,6 +39,20 @@ class JoinSessionRequest(BaseModel):
     email: Optional[str] = None
     corso: Optional[str] = None
 
+class JoinQueuedResponse(BaseModel):
+    participant_id: str
+    nome: str
+    cognome: str
+    status: str  # "queued"
+    position: int
+    queue_depth: int
+
+class JoinStatusResponse(BaseModel):
+    participant_id: str
+    status: str  # "queued" or "admitted"
+    position: int  # place in the join queue, 0 once being inserted or admitted
+    queue_depth: int
+
 class QuestionResponse(BaseModel):
     topic: str
     level: str
@@ -46,9 +60,14 @@ class QuestionResponse(BaseModel):
     question: str
     options: List[str]
     explain_brief: str
-    explain_detailed: str
+    explain_detailed: Optional[str] = None  # sent only after a wrong answer
     source_refs: List[str]
 
+class QuestionData(QuestionResponse):
+    """Question as held server-side, including the correct answer"""
+    answer_index: int
+    explain_detailed: str
+
 class AnswerRequest(BaseModel):
     participant_id: str
     session_code: str
@@ -59,6 +78,7 @@ class AnswerResponse(BaseModel):
     correct: bool
     next_action: str  # "continue", "explanation_required", "finished"
     explanation: Optional[str] = None
+    explain_detailed: Optional[str] = None
     total_served: int
     current_level: str
     theta: int
@@ -73,8 +93,56 @@ class ParticipantStatus(BaseModel):
     correct_percentage: float
     topic: Optional[str]
 
+class ItemStatsResponse(BaseModel):
+    question_hash: str
+    topic: Optional[str]
+    level: Optional[str]
+    attempts: int
+    correct: int
+    p_correct: Optional[float]
+    timeouts: int
+    mean_elapsed_ms: Optional[float]
+    sd_elapsed_ms: Optional[float]
+    options: List[int]  # answers per option index
+
+class LeaderboardEntry(BaseModel):
+    participant_id: str
+    rank: int
+    score: float
+    correct: int
+    elapsed_ms: int
+
+class LeaderboardResponse(BaseModel):
+    size: int
+    top: List[LeaderboardEntry]
+
 class PDFUploadResponse(BaseModel):
     filename: str
     questions_generated: int
     topics: List[str]
     message: str
+
+class QuestionImportResponse(BaseModel):
+    imported: int
+    skipped: int  # already in the bank
+    topics: List[str]
+
+class RosterTokenResponse(BaseModel):
+    participant_id: str
+    nome: str
+    cognome: str
+    email: Optional[str]
+    corso: Optional[str]
+    token: str
+
+class RosterImportResponse(BaseModel):
+    live_id: str
+    imported: int
+    tokens: List[RosterTokenResponse]
+
+class TokenJoinResponse(BaseModel):
+    participant_id: str
+    nome: str
+    cognome: str
+    session_code: str
+    status: str  # "joined"
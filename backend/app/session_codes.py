@@ -0,0 +1,135 @@
+"""
+Six-digit session codes without lookups or retry loops.
+
+Codes are the positions 0, 1, 2, ... of a shared counter pushed through a keyed
+permutation of the 10**6 possible codes: consecutive sessions get unrelated
+looking codes, and no code repeats until the counter has gone through all of
+them. Workers reserve SESSION_CODE_BLOCK positions at a time with a single
+UPDATE ... RETURNING, so creating a session is normally one INSERT.
+
+When the counter comes back round, a code still held by an ended session is
+reclaimed: the old row keeps a retired form of it (`123456~1a2b3c4d`) and the
+code goes to the new session. A code held by a session that has not ended yet
+is skipped.
+"""
+import hashlib
+import os
+import secrets
+from typing import List, Optional
+
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.event_log import get_logger
+from app.models import LiveSession, SessionCodeCounter
+
+SESSION_CODE_BLOCK = int(os.getenv("SESSION_CODE_BLOCK", "16"))
+SESSION_CODE_ATTEMPTS = 8
+CODE_HALF = 1000  # a code is two 3-digit halves
+CODE_SPACE = CODE_HALF * CODE_HALF
+FEISTEL_ROUNDS = 8
+
+log = get_logger("app.session_codes")
+
+
+class SessionCodesExhausted(Exception):
+    pass
+
+
+class CodePermutation:
+    """
+    Keyed bijection of [0, 10**6): a balanced Feistel network over the two 3-digit
+    halves of the number, with addition modulo 1000. The round functions are
+    tabulated once per key, so a code costs a few list lookups.
+    """
+
+    def __init__(self, key: bytes, rounds: int = FEISTEL_ROUNDS):
+        self.tables: List[List[int]] = [
+            [
+                int.from_bytes(hashlib.blake2b(f"{r}:{value}".encode(), key=key, digest_size=8).digest(), "big") % CODE_HALF
+                for value in range(CODE_HALF)
+            ]
+            for r in range(rounds)
+        ]
+
+    def __call__(self, n: int) -> int:
+        left, right = divmod(n, CODE_HALF)
+        for table in self.tables:
+            left, right = right, (left + table[right]) % CODE_HALF
+        return left * CODE_HALF + right
+
+
+class SessionCodes:
+    def __init__(self, block: int = SESSION_CODE_BLOCK):
+        self.block = block
+        self.next = 0
+        self.end = 0
+        self.permutation: Optional[CodePermutation] = None
+
+    def _reserve(self):
+        """Take the next block of counter positions, creating the counter on first use"""
+        db = SessionLocal()
+        try:
+            for _ in range(2):
+                row = db.execute(
+                    update(SessionCodeCounter).where(SessionCodeCounter.id == 1)
+                    .values(next_value=SessionCodeCounter.next_value + self.block)
+                    .returning(SessionCodeCounter.next_value, SessionCodeCounter.key)
+                ).first()
+                db.commit()
+                if row is not None:
+                    break
+                try:
+                    db.add(SessionCodeCounter(id=1, next_value=0, key=secrets.token_hex(16)))
+                    db.commit()
+                except IntegrityError:
+                    # Another worker created it first
+                    db.rollback()
+            else:
+                raise SessionCodesExhausted("Session code counter unavailable")
+        finally:
+            db.close()
+
+        end, key = row
+        self.next, self.end = end - self.block, end
+        if self.permutation is None:
+            self.permutation = CodePermutation(bytes.fromhex(key))
+
+    def allocate(self) -> str:
+        if self.next >= self.end:
+            self._reserve()
+        position = self.next
+        self.next += 1
+        return f"{self.permutation(position % CODE_SPACE):06d}"
+
+    def reclaim(self, db: Session, code: str) -> bool:
+        """Free a code held by an ended session; False when its holder is still active"""
+        result = db.execute(
+            update(LiveSession).where(LiveSession.code == code, LiveSession.status == 'ended')
+            .values(code=LiveSession.code + '~' + func.substr(LiveSession.live_id, 1, 8))
+        )
+        db.commit()
+        return result.rowcount > 0
+
+    def create(self, db: Session, **fields) -> LiveSession:
+        """Insert a LiveSession with a freshly allocated code"""
+        code = self.allocate()
+        for _ in range(SESSION_CODE_ATTEMPTS):
+            live_session = LiveSession(code=code, **fields)
+            db.add(live_session)
+            try:
+                db.commit()
+                return live_session
+            except IntegrityError:
+                # Only after the counter wrapped, or for codes issued before this allocator
+                db.rollback()
+                if self.reclaim(db, code):
+                    log.event("session_code.reclaimed", code=code)
+                else:
+                    code = self.allocate()
+        raise SessionCodesExhausted("No free session code")
+
+
+session_codes = SessionCodes()
@@ -0,0 +1,138 @@
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.orm import Session
+
+from app.adaptive_engine import ability_estimator, item_parameters, level_for_theta, theta_to_score
+from app.models import LiveAnswer, ParticipantProgress, ServedQuestion
+from app.sharding import shards
+
+
+class ParticipantState:
+    """ParticipantProgress of one participant, with its served hashes and response history"""
+    __slots__ = ('participant_id', 'current_level', 'theta', 'topic', 'correct_streak', 'total_served', 'served', 'responses')
+
+    def __init__(self, progress: ParticipantProgress, served: List[str], responses: List[Tuple[Tuple[float, float, float], bool]]):
+        self.participant_id = progress.participant_id
+        self.current_level = progress.current_level
+        self.theta = progress.theta
+        self.topic = progress.topic
+        self.correct_streak = progress.correct_streak
+        self.total_served = progress.total_served
+        self.served = served
+        self.responses = responses
+
+    def serve(self, question_hash: str, topic: str):
+        self.served.append(question_hash)
+        self.total_served += 1
+        if not self.topic:
+            self.topic = topic
+
+    def record_answer(self, question_data: Dict, correct: bool):
+        """Count an answer (a timeout is an incorrect one) and re-estimate ability from the whole history"""
+        self.correct_streak = self.correct_streak + 1 if correct else 0
+        if question_data and 'question' in question_data:
+            self.responses.append((item_parameters(question_data), correct))
+        theta = ability_estimator.estimate(
+            [item for item, _ in self.responses],
+            [answer for _, answer in self.responses]
+        )
+        self.theta = theta_to_score(theta)
+        self.current_level = level_for_theta(theta)
+
+
+class SessionStates:
+    """
+    Hot state of the sessions this process owns: progress, served sets and the
+    response history used for ability estimates, loaded from the database on first
+    use and then kept in memory. Writes still go to the database (write-through),
+    so the state can be dropped at any time - when a session ends or moves to
+    another worker - and reloaded later.
+
+    Only a worker holding the session's shard lease can be sure no other process
+    writes the same rows, so without one (SHARD_URL unset, e.g. several plain
+    uvicorn workers) the state is loaded from the database on every request and
+    never kept.
+    """
+
+    def __init__(self):
+        self.sessions: Dict[str, Dict[str, ParticipantState]] = {}
+
+    def participant(self, db: Session, live_id: str, participant_id: str) -> Optional[ParticipantState]:
+        if not shards.holds(live_id):
+            # Anything kept from an earlier lease may have been changed by another worker since
+            self.sessions.pop(live_id, None)
+            return self.load(db, live_id, participant_id)
+        participants = self.sessions.setdefault(live_id, {})
+        state = participants.get(participant_id)
+        if state is None:
+            state = self.load(db, live_id, participant_id)
+            if state is not None:
+                participants[participant_id] = state
+        return state
+
+    def load(self, db: Session, live_id: str, participant_id: str) -> Optional[ParticipantState]:
+
+        progress = db.query(ParticipantProgress).filter(
+            ParticipantProgress.participant_id == participant_id,
+            ParticipantProgress.live_id == live_id
+        ).first()
+        if progress is None:
+            return None
+        served = [row[0] for row in db.query(ServedQuestion.question_hash).filter(
+            ServedQuestion.participant_id == participant_id
+        )]
+        # Answers recorded without the question (older rows) carry no item parameters and are skipped
+        responses = [
+            (item_parameters(row.question_json), bool(row.correct))
+            for row in db.query(LiveAnswer.question_json, LiveAnswer.correct).filter(
+                LiveAnswer.participant_id == participant_id,
+                LiveAnswer.live_id == live_id
+            ).order_by(LiveAnswer.id)
+            if row.question_json and 'question' in row.question_json
+        ]
+        return ParticipantState(progress, served, responses)
+
+    def save(self, db: Session, live_id: str, state: ParticipantState):
+        """Queue the UPDATE of the progress row; committed by the caller"""
+        db.execute(update(ParticipantProgress).where(
+            ParticipantProgress.participant_id == state.participant_id,
+            ParticipantProgress.live_id == live_id
+        ).values(
+            current_level=state.current_level,
+            theta=state.theta,
+            topic=state.topic,
+            correct_streak=state.correct_streak,
+            total_served=state.total_served
+        ))
+
+    def commit(self, db: Session, live_id: str, states: List[ParticipantState]):
+        """
+        Write the progress of changed participants and commit. If the commit fails
+        their in-memory state is dropped and reloaded from the database next time.
+        """
+        try:
+            for state in states:
+                self.save(db, live_id, state)
+            db.commit()
+        except Exception:
+            db.rollback()
+            for state in states:
+                self.forget(live_id, state.participant_id)
+            raise
+
+    def forget(self, live_id: str, participant_id: str):
+        """Drop a participant whose in-memory state may no longer match the database"""
+        self.sessions.get(live_id, {}).pop(participant_id, None)
+
+    def drop(self, live_id: str):
+        self.sessions.pop(live_id, None)
+
+    def stats(self) -> Dict:
+        return {
+            "sessions": len(self.sessions),
+            "participants": sum(len(participants) for participants in self.sessions.values())
+        }
+
+
+session_states = SessionStates()
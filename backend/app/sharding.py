@@ -0,0 +1,415 @@
+"""
+Session affinity across worker processes.
+
+Each live session is owned by one worker, picked by consistent hashing of its
+live_id over the workers that are heartbeating, and held with a lease row in the
+database. The owner keeps the session's hot state in memory (sockets, round
+timers, join queue, question index, participant progress); any other worker
+forwards the session's HTTP requests and relays its WebSockets to the owner.
+
+A worker takes part when SHARD_URL is set to the base URL the other workers reach
+it at, e.g. one `uvicorn --port 8001` per core behind the load balancer with
+SHARD_URL=http://127.0.0.1:8001. Without it every session is local, as with a
+single process.
+
+When a worker stops heartbeating its leases expire after SHARD_LEASE_SECONDS and
+its sessions are taken over by the next worker on the ring. When workers join,
+sessions whose ring owner changed are released at the next heartbeat: their
+sockets are closed with 1012 and clients reconnect through the new owner.
+"""
+import asyncio
+import hashlib
+import os
+import socket
+import time
+import uuid
+from bisect import bisect
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException, Request, WebSocket
+from fastapi.responses import StreamingResponse
+from sqlalchemy import delete, or_, update
+from sqlalchemy.exc import IntegrityError
+from starlette.background import BackgroundTask
+
+from app.database import SessionLocal
+from app.event_log import get_logger
+from app.models import LiveSession, SessionLease, ShardMember
+
+SHARD_URL = os.getenv("SHARD_URL")
+SHARD_LEASE_SECONDS = float(os.getenv("SHARD_LEASE_SECONDS", "10"))
+SHARD_HEARTBEAT_SECONDS = float(os.getenv("SHARD_HEARTBEAT_SECONDS", "2"))
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", "64"))
+SHARD_FORWARD_TIMEOUT = float(os.getenv("SHARD_FORWARD_TIMEOUT", "30"))
+# Session codes are reused once their session has ended, so a cached code is trusted for this long
+SHARD_CODE_TTL = float(os.getenv("SHARD_CODE_TTL", "300"))
+
+# Set on forwarded requests: the receiving worker must serve them or fail, never forward again
+FORWARDED_HEADER = "x-shard-forwarded"
+HOP_HEADERS = {"host", "content-length", "connection", "keep-alive", "transfer-encoding", "upgrade"}
+
+log = get_logger("app.sharding")
+
+
+def _point(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes: a worker joining or leaving moves ~1/N of the sessions"""
+
+    def __init__(self, workers: List[str], vnodes: int = SHARD_VNODES):
+        ring = sorted((_point(f"{worker}#{i}"), worker) for worker in workers for i in range(vnodes))
+        self.points = [point for point, _ in ring]
+        self.workers = [worker for _, worker in ring]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self.points:
+            return None
+        return self.workers[bisect(self.points, _point(key)) % len(self.points)]
+
+
+class ShardRouter:
+    """Ownership of sessions by this worker and forwarding of everything it does not own"""
+
+    def __init__(self, url: Optional[str] = SHARD_URL):
+        self.enabled = bool(url)
+        self.url = url.rstrip("/") if url else None
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.members: Dict[str, str] = {}
+        self.ring = HashRing([self.worker_id])
+        self.owned: Dict[str, float] = {}  # live_id -> lease expiry
+        self.remote: Dict[str, Tuple[str, float]] = {}  # live_id -> (owner url, cached until)
+        self.codes: Dict[str, Tuple[str, float]] = {}  # session code -> (live_id, cached until)
+        # Called with the live_id of every session this worker stops owning
+        self.on_release: Optional[Callable[[str], object]] = None
+        self.forwarded = 0
+        self.relayed = 0
+        self._task: Optional[asyncio.Task] = None
+        self._client = None
+
+    # Membership
+
+    async def start(self):
+        if not self.enabled:
+            return
+        await self._beat()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        log.event("shard.started", worker_id=self.worker_id, url=self.url, members=len(self.members))
+
+    async def stop(self):
+        """Leave the ring and give up every lease so the sessions fail over at once"""
+        if not self.enabled:
+            return
+        if self._task is not None:
+            self._task.cancel()
+        await asyncio.to_thread(self._leave)
+        if self._client is not None:
+            await self._client.aclose()
+        log.event("shard.stopped", worker_id=self.worker_id, released=len(self.owned))
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(SHARD_HEARTBEAT_SECONDS)
+            try:
+                await self._beat()
+            except Exception:
+                log.error("shard.heartbeat_failed", exc_info=True, worker_id=self.worker_id)
+
+    async def _beat(self):
+        before = set(self.owned)
+        members, held = await asyncio.to_thread(self._heartbeat)
+        # Leases taken over while this worker was stalled: the new owner already serves them
+        for live_id in [live_id for live_id in before if live_id in self.owned and live_id not in held]:
+            self.owned.pop(live_id)
+            if self.on_release is not None:
+                await self.on_release(live_id)
+            log.warning("shard.lease_lost", worker_id=self.worker_id, live_id=live_id)
+        for live_id, expires_at in held.items():
+            if live_id in self.owned:
+                self.owned[live_id] = expires_at
+        if members != self.members:
+            log.event("shard.members_changed", worker_id=self.worker_id, members=sorted(members.values()))
+            self.members = members
+            self.ring = HashRing(list(members))
+            self.remote.clear()
+        moved = [live_id for live_id in self.owned if self.ring.owner(live_id) != self.worker_id]
+        for live_id in moved:
+            await self.release(live_id)
+
+    def _heartbeat(self) -> Tuple[Dict[str, str], Dict[str, float]]:
+        """Refresh this worker's row and leases; return the live workers and the leases held"""
+        db = SessionLocal()
+        try:
+            now = time.time()
+            db.merge(ShardMember(worker_id=self.worker_id, url=self.url, heartbeat_at=now))
+            db.execute(update(SessionLease).where(SessionLease.worker_id == self.worker_id).values(
+                expires_at=now + SHARD_LEASE_SECONDS
+            ))
+            members = db.query(ShardMember.worker_id, ShardMember.url).filter(
+                ShardMember.heartbeat_at > now - SHARD_LEASE_SECONDS
+            ).all()
+            held = db.query(SessionLease.live_id, SessionLease.expires_at).filter(
+                SessionLease.worker_id == self.worker_id
+            ).all()
+            db.execute(delete(ShardMember).where(ShardMember.heartbeat_at < now - 10 * SHARD_LEASE_SECONDS))
+            db.commit()
+            return {row.worker_id: row.url for row in members}, {row.live_id: row.expires_at for row in held}
+        finally:
+            db.close()
+
+    def _leave(self):
+        db = SessionLocal()
+        try:
+            db.execute(delete(SessionLease).where(SessionLease.worker_id == self.worker_id))
+            db.execute(delete(ShardMember).where(ShardMember.worker_id == self.worker_id))
+            db.commit()
+        finally:
+            db.close()
+
+    # Leases
+
+    def _acquire(self, live_id: str) -> Tuple[str, str, float]:
+        """Take the lease if it is free, expired or already ours; return the holder"""
+        db = SessionLocal()
+        try:
+            now = time.time()
+            expires_at = now + SHARD_LEASE_SECONDS
+            result = db.execute(update(SessionLease).where(
+                SessionLease.live_id == live_id,
+                or_(SessionLease.worker_id == self.worker_id, SessionLease.expires_at < now)
+            ).values(worker_id=self.worker_id, url=self.url, expires_at=expires_at))
+            if result.rowcount == 0:
+                try:
+                    db.add(SessionLease(live_id=live_id, worker_id=self.worker_id, url=self.url, expires_at=expires_at))
+                    db.commit()
+                except IntegrityError:
+                    db.rollback()
+                    lease = db.get(SessionLease, live_id)
+                    return lease.worker_id, lease.url, lease.expires_at
+            else:
+                db.commit()
+            return self.worker_id, self.url, expires_at
+        finally:
+            db.close()
+
+    def _holder(self, live_id: str) -> Optional[Tuple[str, str, float]]:
+        db = SessionLocal()
+        try:
+            lease = db.get(SessionLease, live_id)
+            if lease is None or lease.expires_at < time.time():
+                return None
+            return lease.worker_id, lease.url, lease.expires_at
+        finally:
+            db.close()
+
+    async def release(self, live_id: str):
+        """Stop owning a session: drop its hot state, then its lease"""
+        self.owned.pop(live_id, None)
+        if self.on_release is not None:
+            await self.on_release(live_id)
+
+        def drop_lease():
+            db = SessionLocal()
+            try:
+                db.execute(delete(SessionLease).where(
+                    SessionLease.live_id == live_id,
+                    SessionLease.worker_id == self.worker_id
+                ))
+                db.commit()
+            finally:
+                db.close()
+
+        await asyncio.to_thread(drop_lease)
+        log.event("shard.released", worker_id=self.worker_id, live_id=live_id)
+
+    def holds(self, live_id: str) -> bool:
+        """Whether this worker holds an unexpired lease on the session (never without SHARD_URL)"""
+        return self.enabled and self.owned.get(live_id, 0) > time.time()
+
+    async def locate(self, live_id: str, forwarded: bool = False) -> Optional[str]:
+        """
+        None when this worker owns the session (taking the lease if needed),
+        otherwise the URL of the worker to forward to.
+        """
+        if not self.enabled:
+            return None
+        now = time.time()
+        if self.owned.get(live_id, 0) > now:
+            return None
+        cached = self.remote.get(live_id)
+        if cached is not None and cached[1] > now and not forwarded:
+            return cached[0]
+
+        if forwarded or self.ring.owner(live_id) == self.worker_id:
+            worker_id, url, expires_at = await asyncio.to_thread(self._acquire, live_id)
+            if worker_id == self.worker_id:
+                self.owned[live_id] = expires_at
+                self.remote.pop(live_id, None)
+                log.event("shard.acquired", worker_id=self.worker_id, live_id=live_id)
+                return None
+            if forwarded:
+                # The previous owner has not released it yet: let the client retry
+                raise HTTPException(status_code=503, detail="Session is moving to another worker", headers={"Retry-After": "1"})
+        else:
+            holder = await asyncio.to_thread(self._holder, live_id)
+            if holder is not None:
+                worker_id, url, expires_at = holder
+            else:
+                worker_id = self.ring.owner(live_id)
+                url, expires_at = self.members[worker_id], now + SHARD_HEARTBEAT_SECONDS
+
+        self.remote[live_id] = (url, min(expires_at, now + SHARD_HEARTBEAT_SECONDS))
+        return url
+
+    def live_id_for_code(self, session_code: str) -> Optional[str]:
+        cached = self.codes.get(session_code)
+        now = time.monotonic()
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        db = SessionLocal()
+        try:
+            row = db.query(LiveSession.live_id).filter(LiveSession.code == session_code).first()
+        finally:
+            db.close()
+        if row is None:
+            self.codes.pop(session_code, None)
+            return None
+        self.codes[session_code] = (row.live_id, now + SHARD_CODE_TTL)
+        return row.live_id
+
+    def code_for(self, live_id: str) -> Optional[str]:
+        return next((code for code, (owner, _) in self.codes.items() if owner == live_id), None)
+
+    def forget_code(self, session_code: str):
+        self.codes.pop(session_code, None)
+
+    # Forwarding
+
+    def _http(self):
+        if self._client is None:
+            import httpx
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(SHARD_FORWARD_TIMEOUT, connect=2.0), trust_env=False)
+        return self._client
+
+    async def route(self, request: Request, live_id: Optional[str] = None, session_code: Optional[str] = None, **body) -> Optional[StreamingResponse]:
+        """
+        The owner's response when another worker owns the session, None when it is
+        handled here. `body` replaces the raw request body (files=, data=) for
+        endpoints whose body has already been parsed from a stream.
+        """
+        if not self.enabled:
+            return None
+        if live_id is None:
+            live_id = self.live_id_for_code(session_code)
+            if live_id is None:
+                return None
+        url = await self.locate(live_id, forwarded=FORWARDED_HEADER in request.headers)
+        if url is None:
+            return None
+
+        headers = {k: v for k, v in request.headers.items() if k not in HOP_HEADERS}
+        headers[FORWARDED_HEADER] = self.worker_id
+        if body:
+            headers.pop("content-type", None)
+        else:
+            body = {"content": await request.body()}
+        client = self._http()
+        try:
+            upstream = await client.send(client.build_request(
+                request.method, url + request.url.path, params=request.query_params, headers=headers, **body
+            ), stream=True)
+        except Exception:
+            # The owner is unreachable; its lease expires and the session fails over
+            log.warning("shard.forward_failed", live_id=live_id, owner=url)
+            self.remote.pop(live_id, None)
+            raise HTTPException(status_code=503, detail="Session owner unavailable", headers={"Retry-After": "1"})
+        self.forwarded += 1
+        return StreamingResponse(
+            upstream.aiter_raw(),
+            status_code=upstream.status_code,
+            headers={k: v for k, v in upstream.headers.items() if k not in HOP_HEADERS},
+            background=BackgroundTask(upstream.aclose)
+        )
+
+    async def relay(self, websocket: WebSocket, live_id: Optional[str] = None, session_code: Optional[str] = None) -> bool:
+        """
+        Relay a WebSocket to the session's owner until either side closes.
+        False when the session is owned here and the caller should serve it.
+        """
+        if not self.enabled:
+            return False
+        if live_id is None:
+            live_id = self.live_id_for_code(session_code)
+            if live_id is None:
+                return False
+        forwarded = FORWARDED_HEADER in websocket.headers
+        try:
+            url = await self.locate(live_id, forwarded=forwarded)
+        except HTTPException:
+            await websocket.close(code=1013)
+            return True
+        if url is None:
+            return False
+
+        from websockets.asyncio.client import connect
+
+        target = "ws" + url[len("http"):] + websocket.url.path + (f"?{websocket.url.query}" if websocket.url.query else "")
+        try:
+            upstream = await connect(
+                target,
+                subprotocols=websocket.scope.get("subprotocols") or None,
+                additional_headers={FORWARDED_HEADER: self.worker_id},
+                compression=None,
+                ping_interval=None,
+                proxy=None
+            )
+        except Exception:
+            log.warning("shard.relay_failed", live_id=live_id, owner=url)
+            self.remote.pop(live_id, None)
+            await websocket.close(code=1013)
+            return True
+
+        self.relayed += 1
+        await websocket.accept(subprotocol=upstream.subprotocol)
+
+        async def to_owner():
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                await upstream.send(message["text"] if message.get("text") is not None else message["bytes"])
+
+        async def to_client():
+            async for frame in upstream:
+                if isinstance(frame, str):
+                    await websocket.send_text(frame)
+                else:
+                    await websocket.send_bytes(frame)
+
+        tasks = [asyncio.create_task(to_owner()), asyncio.create_task(to_client())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await upstream.close()
+            try:
+                await websocket.close(code=upstream.close_code or 1000)
+            except Exception:
+                pass
+        return True
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "worker_id": self.worker_id,
+            "url": self.url,
+            "members": sorted(self.members.values()),
+            "owned": sorted(self.owned),
+            "forwarded": self.forwarded,
+            "relayed": self.relayed
+        }
+
+
+shards = ShardRouter()
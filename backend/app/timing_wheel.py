@@ -0,0 +1,124 @@
+import asyncio
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from app.event_log import get_logger
+
+log = get_logger("app.timing_wheel")
+
+
+class Timer:
+    __slots__ = ('key', 'expires', 'payload', 'level', 'slot')
+
+    def __init__(self, key: Hashable, expires: int, payload: Any):
+        self.key = key
+        self.expires = expires
+        self.payload = payload
+        self.level = 0
+        self.slot = 0
+
+
+class TimingWheel:
+    """
+    Hierarchical timing wheel driven by a single asyncio task.
+    Timers are keyed: scheduling an existing key replaces it, and cancel is O(1).
+    Level L has `slots` buckets of slots**L ticks each; a bucket is cascaded to the
+    lower levels when the clock enters it, so every timer is touched at most
+    `levels` times regardless of how many are pending.
+    Expired payloads of one tick are handed to on_expire as a single batch.
+    """
+
+    def __init__(self, on_expire: Callable[[List[Any]], Any], tick: float = 0.1, slots: int = 256, levels: int = 3):
+        self.on_expire = on_expire
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.wheels: List[List[Dict[Hashable, Timer]]] = [[{} for _ in range(slots)] for _ in range(levels)]
+        self.timers: Dict[Hashable, Timer] = {}
+        self.current = 0
+        self._origin: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.timers)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.timers
+
+    def _now_ticks(self) -> int:
+        loop = asyncio.get_running_loop()
+        if self._origin is None:
+            self._origin = loop.time() - self.current * self.tick
+        return int((loop.time() - self._origin) / self.tick)
+
+    def _place(self, timer: Timer):
+        expires = max(timer.expires, self.current)
+        level = 0
+        while level < self.levels - 1 and expires // self.slots ** (level + 1) != self.current // self.slots ** (level + 1):
+            level += 1
+        timer.level = level
+        timer.slot = (expires // self.slots ** level) % self.slots
+        self.wheels[level][timer.slot][timer.key] = timer
+
+    def schedule(self, key: Hashable, delay: float, payload: Any = None):
+        """Fire payload after delay seconds, replacing any timer with the same key"""
+        self.cancel(key)
+        now = self._now_ticks()
+        if not self.timers:
+            # Nothing pending, so the clock can jump ahead instead of replaying idle ticks
+            self.current = max(self.current, now)
+        timer = Timer(key, now + max(1, int(round(delay / self.tick))), payload)
+        self.timers[key] = timer
+        self._place(timer)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def cancel(self, key: Hashable) -> Optional[Any]:
+        """Remove a pending timer, returning its payload"""
+        timer = self.timers.pop(key, None)
+        if timer is None:
+            return None
+        self.wheels[timer.level][timer.slot].pop(key, None)
+        return timer.payload
+
+    def remaining(self, key: Hashable) -> Optional[float]:
+        """Seconds left before the timer fires"""
+        timer = self.timers.get(key)
+        if timer is None:
+            return None
+        return max(0.0, (timer.expires - self._now_ticks()) * self.tick)
+
+    def advance(self, ticks: int = 1) -> List[Any]:
+        """Move the clock forward, returning the payloads that expired"""
+        expired = []
+        for _ in range(ticks):
+            self.current += 1
+            for level in range(1, self.levels):
+                if self.current % self.slots ** level:
+                    break
+                bucket = self.wheels[level][(self.current // self.slots ** level) % self.slots]
+                pending = list(bucket.values())
+                bucket.clear()
+                for timer in pending:
+                    self._place(timer)
+            bucket = self.wheels[0][self.current % self.slots]
+            due = list(bucket.values())
+            bucket.clear()
+            for timer in due:
+                if timer.expires > self.current:
+                    self._place(timer)
+                    continue
+                del self.timers[timer.key]
+                expired.append(timer.payload)
+        return expired
+
+    async def _run(self):
+        while self.timers:
+            await asyncio.sleep(self.tick)
+            expired = self.advance(self._now_ticks() - self.current)
+            if expired:
+                try:
+                    result = self.on_expire(expired)
+                    if asyncio.iscoroutine(result):
+                        await result
+                except Exception:
+                    log.error("timing_wheel.expire_failed", exc_info=True, expired=len(expired))
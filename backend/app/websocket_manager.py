@@ -1,78 +1,369 @@
-from fastapi import WebSocket
-from typing import Dict, List
-import json
+from fastapi import WebSocket, WebSocketDisconnect
+from typing import Deque, Dict, List, Optional, Set, Tuple
+from collections import deque
+import asyncio
+import heapq
+import os
+import time
 import uuid
 
+from app.ws_codecs import Codec, Frame, Preencoded, DEFAULT_CODEC, negotiate
+from app.metrics import metrics
+from app.event_log import get_logger
+
+REPLAY_BUFFER_SIZE = int(os.getenv("REPLAY_BUFFER_SIZE", "256"))
+REPLAY_DIRECT_SIZE = int(os.getenv("REPLAY_DIRECT_SIZE", "16"))
+log = get_logger("app.websocket")
+
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "20"))
+# Sockets that sent nothing (not even a pong) for this long are considered half-open
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "60"))
+
+async def send_frame(websocket: WebSocket, frame: Frame):
+    if isinstance(frame, bytes):
+        await websocket.send_bytes(frame)
+    else:
+        await websocket.send_text(frame)
+
+class ReplayBuffer:
+    """
+    Bounded rings of the last frames sent to the participants of a session: one
+    ring for frames sent to everyone and a small one per participant for frames
+    addressed to them alone, so a burst of direct frames to a large roster cannot
+    evict anybody else's. Frames carry a per-session sequence number; the epoch
+    changes whenever the buffer is recreated (e.g. server restart) so stale
+    sequence numbers are detected.
+    """
+    
+    def __init__(self, size: int = REPLAY_BUFFER_SIZE, direct_size: int = REPLAY_DIRECT_SIZE):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.seq = 0
+        self.direct_size = direct_size
+        self.frames: Deque[Tuple[int, Preencoded]] = deque(maxlen=size)
+        self.direct: Dict[str, Deque[Tuple[int, Preencoded]]] = {}
+        # Newest sequence number each ring has dropped: a client is covered if it has seen it
+        self.evicted = 0
+        self.direct_evicted: Dict[str, int] = {}
+    
+    def append(self, message: dict, participant_id: Optional[str] = None) -> Preencoded:
+        """Number a frame, for the whole session or a single participant; it is encoded once per codec"""
+        self.seq += 1
+        frame = Preencoded({**message, "seq": self.seq})
+        if participant_id is None:
+            if len(self.frames) == self.frames.maxlen:
+                self.evicted = self.frames[0][0]
+            self.frames.append((self.seq, frame))
+        else:
+            ring = self.direct.get(participant_id)
+            if ring is None:
+                ring = self.direct[participant_id] = deque(maxlen=self.direct_size)
+            if len(ring) == ring.maxlen:
+                self.direct_evicted[participant_id] = ring[0][0]
+            ring.append((self.seq, frame))
+        return frame
+    
+    def covers(self, last_seq: int, participant_id: str) -> bool:
+        """Whether every frame for the participant after last_seq is still buffered"""
+        return self.evicted <= last_seq <= self.seq and self.direct_evicted.get(participant_id, 0) <= last_seq
+    
+    def frames_after(self, last_seq: int, participant_id: str, direct_only: bool = False) -> List[Tuple[int, Preencoded]]:
+        """Buffered (seq, frame) pairs after last_seq visible to a participant, in order"""
+        direct = [(seq, frame) for seq, frame in self.direct.get(participant_id, ()) if seq > last_seq]
+        if direct_only:
+            return direct
+        shared = [(seq, frame) for seq, frame in self.frames if seq > last_seq]
+        return list(heapq.merge(shared, direct, key=lambda item: item[0]))
+    
+    def memory_bytes(self) -> int:
+        """Size of the encoded frames held for replay"""
+        rings = [self.frames, *self.direct.values()]
+        return sum(len(encoded) for ring in rings for _, frame in ring for encoded in frame.encoded.values())
+
+class Connection:
+    __slots__ = ('websocket', 'codec', 'session_code', 'participant_id', 'live_id', 'last_seen')
+    
+    def __init__(self, websocket: WebSocket, codec: Codec):
+        self.websocket = websocket
+        self.codec = codec
+        self.session_code: Optional[str] = None
+        self.participant_id: Optional[str] = None
+        self.live_id: Optional[str] = None  # set for teacher sockets
+        self.last_seen = time.monotonic()
+
 class ConnectionManager:
+    """
+    Registry of open sockets, indexed by socket, session code, participant and teacher
+    so that every add and remove is O(1). A heartbeat task pings idle sockets and
+    closes those that stay silent past WS_IDLE_TIMEOUT.
+    """
+    
     def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+        self.connections: Dict[WebSocket, Connection] = {}
+        self.session_sockets: Dict[str, Set[WebSocket]] = {}
         self.participant_connections: Dict[str, WebSocket] = {}
         self.teacher_connections: Dict[str, WebSocket] = {}
         self.session_code_to_live_id: Dict[str, str] = {}
+        self.participant_sessions: Dict[str, str] = {}
+        self.session_participants: Dict[str, Set[str]] = {}
+        self.replay_buffers: Dict[str, ReplayBuffer] = {}
+        self._heartbeat: Optional[asyncio.Task] = None
+    
+    def register_session(self, session_code: str, live_id: str):
+        self.session_code_to_live_id[session_code] = str(live_id)
+    
+    def get_replay_buffer(self, session_code: str) -> ReplayBuffer:
+        buffer = self.replay_buffers.get(session_code)
+        if buffer is None:
+            buffer = self.replay_buffers[session_code] = ReplayBuffer()
+        return buffer
+    
+    def _track_participant(self, participant_id: str, session_code: str):
+        previous = self.participant_sessions.get(participant_id)
+        if previous != session_code:
+            if previous is not None:
+                self.session_participants.get(previous, set()).discard(participant_id)
+            self.participant_sessions[participant_id] = session_code
+            self.session_participants.setdefault(session_code, set()).add(participant_id)
+    
+    async def accept(self, websocket: WebSocket) -> Connection:
+        """Accept a socket, negotiating the subprotocol that sets its frame encoding"""
+        requested = websocket.scope.get("subprotocols") or []
+        codec = negotiate(requested)
+        await websocket.accept(subprotocol=codec.subprotocol if codec.subprotocol in requested else None)
+        if self._heartbeat is None or self._heartbeat.done():
+            self._heartbeat = asyncio.get_running_loop().create_task(self._run_heartbeat())
+        return Connection(websocket, codec)
+    
+    async def receive(self, websocket: WebSocket):
+        """Wait for the next client frame, text or binary, and mark the socket alive"""
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        connection = self.connections.get(websocket)
+        if connection is not None:
+            connection.last_seen = time.monotonic()
+        return message.get("text") or message.get("bytes")
+    
+    async def send(self, websocket: WebSocket, message):
+        """Send a message or Preencoded frame in the socket's negotiated encoding"""
+        connection = self.connections.get(websocket)
+        codec = connection.codec if connection is not None else DEFAULT_CODEC
+        await send_frame(websocket, codec.encode(message))
     
-    async def connect_participant(self, websocket: WebSocket, session_code: str, participant_id: str):
-        await websocket.accept()
-        if session_code not in self.active_connections:
-            self.active_connections[session_code] = []
-        self.active_connections[session_code].append(websocket)
+    async def connect_participant(self, websocket: WebSocket, session_code: str, participant_id: str, last_seq: Optional[int] = None, epoch: Optional[str] = None):
+        """
+        Accept a participant socket and run the resume handshake.
+        A client resuming with the current epoch gets every frame it missed replayed;
+        a fresh client gets the frames already addressed to it (e.g. a round.start sent
+        before it connected). When the gap is no longer buffered it is told to reset
+        and reload its state over HTTP.
+        """
+        connection = await self.accept(websocket)
+        connection.session_code = session_code
+        connection.participant_id = participant_id
+        
+        buffer = self.get_replay_buffer(session_code)
+        direct_only = epoch is None
+        resumed = direct_only or (epoch == buffer.epoch and last_seq is not None and buffer.covers(last_seq, participant_id))
+        sent_seq = 0 if direct_only or not resumed else last_seq
+        replayed = 0
+        
+        # Replay until caught up; the socket is registered only after the last await so
+        # live frames can never overtake replayed ones
+        while resumed:
+            missed = buffer.frames_after(sent_seq, participant_id, direct_only)
+            if not missed:
+                break
+            for seq, frame in missed:
+                await send_frame(websocket, connection.codec.encode(frame))
+                sent_seq = seq
+                replayed += 1
+        
+        previous = self.participant_connections.get(participant_id)
+        if previous is not None and previous is not websocket:
+            self._unregister(previous)
+        self.connections[websocket] = connection
+        self.session_sockets.setdefault(session_code, set()).add(websocket)
         self.participant_connections[participant_id] = websocket
-        print(f"Participant {participant_id} connected to session {session_code}")
+        self._track_participant(participant_id, session_code)
+        log.event("ws.connected", participant_id=participant_id, session_code=session_code, codec=connection.codec.subprotocol, resumed=resumed, replayed=replayed)
+        
+        await self.send(websocket, {
+            "type": "resume.ok" if resumed else "resume.reset",
+            "epoch": buffer.epoch,
+            "seq": buffer.seq,
+            "replayed": replayed
+        })
     
     async def connect_teacher(self, websocket: WebSocket, live_id: str):
-        await websocket.accept()
+        connection = await self.accept(websocket)
+        connection.live_id = live_id
+        previous = self.teacher_connections.get(live_id)
+        if previous is not None and previous is not websocket:
+            self._unregister(previous)
+        self.connections[websocket] = connection
         self.teacher_connections[live_id] = websocket
-        print(f"Teacher connected to session {live_id}")
-    
-    def disconnect_participant(self, session_code: str, participant_id: str):
-        if participant_id in self.participant_connections:
-            websocket = self.participant_connections[participant_id]
-            if session_code in self.active_connections and websocket in self.active_connections[session_code]:
-                self.active_connections[session_code].remove(websocket)
-            del self.participant_connections[participant_id]
-            print(f"Participant {participant_id} disconnected from session {session_code}")
-    
-    def disconnect_teacher(self, live_id: str):
-        if live_id in self.teacher_connections:
-            del self.teacher_connections[live_id]
-            print(f"Teacher disconnected from session {live_id}")
-    
-    async def send_to_participant(self, participant_id: str, message: dict):
-        if participant_id in self.participant_connections:
-            websocket = self.participant_connections[participant_id]
+        log.event("ws.teacher_connected", live_id=live_id, codec=connection.codec.subprotocol)
+    
+    def _unregister(self, websocket: WebSocket) -> Optional[Connection]:
+        """Drop a socket from every index; a newer socket of the same client is left alone"""
+        connection = self.connections.pop(websocket, None)
+        if connection is None:
+            return None
+        if connection.session_code is not None:
+            sockets = self.session_sockets.get(connection.session_code)
+            if sockets is not None:
+                sockets.discard(websocket)
+                if not sockets:
+                    del self.session_sockets[connection.session_code]
+        if connection.participant_id is not None and self.participant_connections.get(connection.participant_id) is websocket:
+            del self.participant_connections[connection.participant_id]
+        if connection.live_id is not None and self.teacher_connections.get(connection.live_id) is websocket:
+            del self.teacher_connections[connection.live_id]
+        return connection
+    
+    def disconnect_participant(self, session_code: str, participant_id: str, websocket: WebSocket | None = None):
+        # A resumed client may already have a newer socket registered; only the
+        # socket that actually closed is removed
+        websocket = websocket or self.participant_connections.get(participant_id)
+        if websocket is not None and self._unregister(websocket) is not None:
+            log.event("ws.disconnected", participant_id=participant_id, session_code=session_code)
+    
+    def disconnect_teacher(self, live_id: str, websocket: WebSocket | None = None):
+        websocket = websocket or self.teacher_connections.get(live_id)
+        if websocket is not None and self._unregister(websocket) is not None:
+            log.event("ws.teacher_disconnected", live_id=live_id)
+    
+    async def end_session(self, session_code: str, close_code: int = 1000):
+        """
+        Release everything held for an ended session: participant sockets are closed,
+        and the replay buffer and participant routing are dropped. The teacher socket
+        stays open for the report.
+        """
+        sockets = list(self.session_sockets.get(session_code, ()))
+        for websocket in sockets:
+            self._unregister(websocket)
+            try:
+                await websocket.close(code=close_code)
+            except Exception:
+                pass
+        for participant_id in self.session_participants.pop(session_code, set()):
+            self.participant_sessions.pop(participant_id, None)
+        self.session_sockets.pop(session_code, None)
+        self.replay_buffers.pop(session_code, None)
+        self.session_code_to_live_id.pop(session_code, None)
+        log.event("ws.session_released", session_code=session_code, closed=len(sockets))
+    
+    async def handoff_session(self, session_code: str, live_id: str):
+        """
+        Close every socket of a session now owned by another worker, the teacher's
+        included, with 1012 so that clients reconnect and reach the new owner
+        """
+        teacher = self.teacher_connections.get(live_id)
+        if teacher is not None:
+            self._unregister(teacher)
             try:
-                await websocket.send_text(json.dumps(message))
-                print(f"Sent message to participant {participant_id}: {message['type']}")
+                await teacher.close(code=1012)
+            except Exception:
+                pass
+        await self.end_session(session_code, close_code=1012)
+    
+    async def send_to_participant(self, participant_id: str, message: dict, session_code: str | None = None):
+        session_code = session_code or self.participant_sessions.get(participant_id)
+        if session_code:
+            self._track_participant(participant_id, session_code)
+            frame = self.get_replay_buffer(session_code).append(message, participant_id)
+        else:
+            frame = message
+        
+        websocket = self.participant_connections.get(participant_id)
+        if websocket is not None:
+            try:
+                await self.send(websocket, frame)
+                log.event("ws.sent", participant_id=participant_id, type=message['type'])
             except Exception as e:
-                print(f"Failed to send message to participant {participant_id}: {e}")
-                del self.participant_connections[participant_id]
+                log.warning("ws.send_failed", participant_id=participant_id, type=message['type'], error=str(e))
+                self._unregister(websocket)
     
     async def send_to_teacher(self, live_id: str, message: dict):
-        if live_id in self.teacher_connections:
-            websocket = self.teacher_connections[live_id]
+        websocket = self.teacher_connections.get(live_id)
+        if websocket is not None:
             try:
-                await websocket.send_text(json.dumps(message))
-                print(f"Sent message to teacher {live_id}: {message['type']}")
+                await self.send(websocket, message)
+                log.event("ws.teacher_sent", live_id=live_id, type=message['type'])
             except Exception as e:
-                print(f"Failed to send message to teacher {live_id}: {e}")
-                del self.teacher_connections[live_id]
+                log.warning("ws.teacher_send_failed", live_id=live_id, type=message['type'], error=str(e))
+                self._unregister(websocket)
     
     async def broadcast_to_session(self, live_id: str, message: dict, session_code: str | None = None):
         await self.send_to_teacher(live_id, message)
         
-        if session_code and session_code in self.active_connections:
+        if session_code:
+            self.register_session(session_code, live_id)
+            frame = self.get_replay_buffer(session_code).append(message)
+        
+        if session_code and session_code in self.session_sockets:
+            start = time.perf_counter()
             disconnected = []
-            for connection in self.active_connections[session_code]:
+            for connection in list(self.session_sockets[session_code]):
                 try:
-                    await connection.send_text(json.dumps(message))
+                    await self.send(connection, frame)
                 except Exception as e:
-                    print(f"Failed to broadcast to participant: {e}")
+                    log.warning("ws.broadcast_failed", session_code=session_code, type=message['type'], error=str(e))
                     disconnected.append(connection)
             
             for connection in disconnected:
-                self.active_connections[session_code].remove(connection)
+                self._unregister(connection)
+            elapsed = time.perf_counter() - start
+            metrics.observe("ws_fanout_duration_seconds", elapsed, type=message['type'])
             
-            print(f"Broadcasted {message['type']} to {len(self.active_connections[session_code])} participants in session {session_code}")
+            log.event("ws.broadcast", session_code=session_code, type=message['type'],
+                      sockets=len(self.session_sockets.get(session_code, ())), failed=len(disconnected), duration_ms=round(elapsed * 1000, 3))
         else:
-            print(f"No session code provided or no participants in session {session_code}")
+            log.event("ws.broadcast", session_code=session_code, type=message['type'], sockets=0)
+    
+    async def _run_heartbeat(self):
+        """Ping every socket each WS_PING_INTERVAL and close the ones gone silent"""
+        ping = Preencoded({"type": "ping"})
+        while self.connections:
+            await asyncio.sleep(WS_PING_INTERVAL)
+            deadline = time.monotonic() - WS_IDLE_TIMEOUT
+            for websocket, connection in list(self.connections.items()):
+                if connection.last_seen < deadline:
+                    log.event("ws.idle_closed", participant_id=connection.participant_id, live_id=connection.live_id)
+                    self._unregister(websocket)
+                    try:
+                        await websocket.close(code=1001)
+                    except Exception:
+                        pass
+                    continue
+                try:
+                    await send_frame(websocket, connection.codec.encode(ping))
+                except Exception:
+                    self._unregister(websocket)
+    
+    def session_stats(self, session_code: str) -> Dict:
+        """Connections and memory held for one session"""
+        buffer = self.replay_buffers.get(session_code)
+        return {
+            "session_code": session_code,
+            "live_id": self.session_code_to_live_id.get(session_code),
+            "sockets": len(self.session_sockets.get(session_code, ())),
+            "participants": len(self.session_participants.get(session_code, ())),
+            "replay_frames": len(buffer.frames) + sum(len(ring) for ring in buffer.direct.values()) if buffer else 0,
+            "replay_bytes": buffer.memory_bytes() if buffer else 0
+        }
+    
+    def stats(self) -> Dict:
+        codes = set(self.session_sockets) | set(self.replay_buffers) | set(self.session_participants)
+        return {
+            "connections": len(self.connections),
+            "teachers": len(self.teacher_connections),
+            "sessions": [self.session_stats(code) for code in sorted(codes)]
+        }
 
 manager = ConnectionManager()
+metrics.gauge("ws_session_connections", "Open participant sockets per session", lambda: [
+    ({"session_code": code}, len(sockets)) for code, sockets in manager.session_sockets.items()
+])
+metrics.gauge("ws_teacher_connections", "Open teacher sockets", lambda: [({}, len(manager.teacher_connections))])
@@ -0,0 +1,105 @@
+import json
+import os
+from abc import ABC, abstractmethod
+from typing import Dict, List, Union
+
+try:
+    import msgpack
+except ImportError:  # optional: without it only the JSON subprotocol is offered
+    msgpack = None
+
+Frame = Union[str, bytes]
+
+
+class Preencoded:
+    """
+    A frame value encoded at most once per codec.
+    Wrapping a whole message caches the frame itself; wrapping a field (e.g. a
+    question payload) lets it be spliced verbatim into any message that carries it.
+    """
+    __slots__ = ('value', 'encoded')
+
+    def __init__(self, value):
+        self.value = value
+        self.encoded: Dict[str, Frame] = {}
+
+
+class Codec(ABC):
+    """Encoding of outgoing WebSocket frames, selected by subprotocol"""
+    subprotocol = ''
+    binary = False
+
+    @abstractmethod
+    def dumps(self, value) -> Frame:
+        """Encode a plain value"""
+
+    @abstractmethod
+    def splice(self, message: Dict) -> Frame:
+        """Encode a message whose top-level values may be Preencoded"""
+
+    def encode(self, value) -> Frame:
+        if isinstance(value, Preencoded):
+            frame = value.encoded.get(self.subprotocol)
+            if frame is None:
+                frame = value.encoded[self.subprotocol] = self.encode(value.value)
+            return frame
+        if isinstance(value, dict) and any(isinstance(v, Preencoded) for v in value.values()):
+            return self.splice(value)
+        return self.dumps(value)
+
+
+class JsonCodec(Codec):
+    """Text frames; the default when the client asks for no subprotocol"""
+    subprotocol = 'quiz.json'
+
+    def dumps(self, value) -> str:
+        return json.dumps(value, separators=(',', ':'))
+
+    def splice(self, message: Dict) -> str:
+        return '{' + ','.join(f'{self.dumps(key)}:{self.encode(value)}' for key, value in message.items()) + '}'
+
+
+class MsgPackCodec(Codec):
+    """Binary frames in MessagePack"""
+    subprotocol = 'quiz.msgpack'
+    binary = True
+
+    def dumps(self, value) -> bytes:
+        return msgpack.packb(value)
+
+    def splice(self, message: Dict) -> bytes:
+        size = len(message)
+        if size < 16:
+            header = bytes([0x80 | size])
+        else:
+            header = b'\xde' + size.to_bytes(2, 'big')
+        return header + b''.join(self.dumps(key) + self.encode(value) for key, value in message.items())
+
+
+json_codec = JsonCodec()
+DEFAULT_CODEC = json_codec
+
+CODECS: Dict[str, Codec] = {json_codec.subprotocol: json_codec}
+if msgpack is not None:
+    CODECS[MsgPackCodec.subprotocol] = MsgPackCodec()
+
+# Subprotocols the server is willing to negotiate, e.g. "quiz.json" to turn binary frames off
+for _name in set(CODECS) - set(os.getenv("WS_CODECS", ",".join(CODECS)).split(",")) - {DEFAULT_CODEC.subprotocol}:
+    del CODECS[_name]
+
+
+def negotiate(requested: List[str]) -> Codec:
+    """First subprotocol offered by the client that the server supports, JSON otherwise"""
+    for name in requested:
+        codec = CODECS.get(name)
+        if codec is not None:
+            return codec
+    return DEFAULT_CODEC
+
+
+def preencode(value) -> Preencoded:
+    """Wrap a value and encode it for every available codec right away"""
+    payload = Preencoded(value)
+    for codec in CODECS.values():
+        codec.encode(payload)
+    return payload
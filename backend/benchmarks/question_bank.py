@@ -0,0 +1,89 @@
+"""
+Bulk question-bank round trip against the app in this process: a synthetic bank
+is imported as JSONL into a shared bank, copied into a session, and both banks
+are exported again, with the time of each step and the peak memory.
+
+Exits with status 1 when the import exceeds its budget or an export does not
+return every question.
+
+    cd backend && python -m benchmarks.question_bank --questions 50000 --import-budget-s 10 [--json]
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=50000)
+    parser.add_argument("--topics", type=int, default=20)
+    parser.add_argument("--import-budget-s", type=float, default=10)
+    parser.add_argument("--database-url", help="database to use (default: a temporary SQLite file)")
+    parser.add_argument("--json", action="store_true", help="machine-readable output")
+    args = parser.parse_args()
+
+    # The app reads its configuration at import time
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{tempfile.mkdtemp(prefix='quiz-bank-')}/bank.db"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["AUTO_MIGRATE"] = "1"
+    from fastapi.testclient import TestClient
+
+    import app.main
+    from benchmarks.synthetic import synthetic_questions
+
+    body = "".join(json.dumps(q) + "\n" for q in synthetic_questions(args.questions, args.topics)).encode()
+    bank = f"bench-{os.getpid()}"
+    failures = []
+    timings = {}
+
+    def timed(name, fn):
+        start = time.perf_counter()
+        result = fn()
+        timings[name] = round(time.perf_counter() - start, 3)
+        return result
+
+    with TestClient(app.main.app) as client:
+        imported = timed("import_s", lambda: client.post(f"/api/banks/{bank}/questions", content=body).json())
+        reimported = timed("reimport_s", lambda: client.post(f"/api/banks/{bank}/questions", content=body).json())
+        live_id = client.post("/api/live/create", json={"title": "Bank benchmark"}).json()["live_id"]
+        copied = timed("copy_to_session_s", lambda: client.post(f"/api/live/{live_id}/questions/from-bank/{bank}").json())
+        shared_lines = timed("export_shared_s", lambda: sum(1 for _ in client.get(f"/api/banks/{bank}/questions").iter_lines()))
+        session_lines = timed("export_session_s", lambda: sum(1 for _ in client.get(f"/api/live/{live_id}/questions").iter_lines()))
+
+    if imported.get("imported") != args.questions:
+        failures.append(f"import stored {imported}")
+    if reimported.get("skipped") != args.questions:
+        failures.append(f"re-import did not skip every question: {reimported}")
+    if copied.get("imported") != args.questions:
+        failures.append(f"copy stored {copied}")
+    if shared_lines != args.questions or session_lines != args.questions:
+        failures.append(f"exports returned {shared_lines} and {session_lines} lines")
+    if timings["import_s"] > args.import_budget_s:
+        failures.append(f"import {timings['import_s']} s over budget {args.import_budget_s} s")
+
+    report = {
+        "questions": args.questions,
+        "body_mb": round(len(body) / 1e6, 1),
+        **timings,
+        "import_questions_per_s": round(args.questions / timings["import_s"]),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "failures": failures,
+    }
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        for key, value in report.items():
+            if key != "failures":
+                print(f"{key:<24}{value:>12}")
+        for failure in failures:
+            print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
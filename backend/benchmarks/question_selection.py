@@ -0,0 +1,147 @@
+"""
+Microbenchmarks for the per-click CPU path of QuestionService.
+
+Varies bank size, topic count and served-history length over both sources of
+questions: the session bank (SessionQuestion rows, SQLite) and the in-memory
+questions_db fallback. Each source is timed with the adaptive selection engine
+(theta given) and the legacy level/topic path, alongside generate_question_hash
+and _get_available_questions_for_topic.
+
+    cd backend && python -m benchmarks.question_selection
+    python -m benchmarks.question_selection --sizes 10,1000,50000 --topics 1,20 --history 0,500 --output selection.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from typing import Callable, Dict, List
+
+LEVEL = "base"
+THETA = -1.0
+
+
+def measure(fn: Callable[[], object], repeat: int, budget: float) -> Dict:
+    """Time fn up to `repeat` times or until `budget` seconds are spent"""
+    samples = []
+    deadline = time.perf_counter() + budget
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+        if time.perf_counter() > deadline:
+            break
+    samples.sort()
+    return {
+        "runs": len(samples),
+        "mean_us": round(sum(samples) / len(samples) * 1e6, 2),
+        "p50_us": round(samples[len(samples) // 2] * 1e6, 2),
+        "p95_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1e6, 2),
+    }
+
+
+def run_case(size: int, topics: int, history: int, args) -> List[Dict]:
+    from app.database import SessionLocal
+    from app.models import LiveSession
+    from app.question_service import QuestionService
+    from benchmarks.synthetic import seed_session_questions, synthetic_questions
+
+    questions = synthetic_questions(size, topics)
+    service = QuestionService()
+    service.questions_db = {}
+    for question in questions:
+        service.questions_db.setdefault(question["level"], {}).setdefault(question["topic"], []).append(question)
+    service._default_bank = None
+
+    level_questions = [q for q in questions if q["level"] == LEVEL]
+    served = [service.generate_question_hash(q) for q in level_questions[:history]]
+    topic = level_questions[0]["topic"] if level_questions else None
+    case = {"bank_size": size, "topics": topics, "served_history": len(served)}
+    results = []
+
+    def record(path: str, strategy: str, stats: Dict):
+        results.append({**case, "path": path, "strategy": strategy, **stats})
+
+    # Hashing and the legacy per-topic scan
+    record("hash", "generate_question_hash", measure(lambda: service.generate_question_hash(questions[0]), args.repeat, args.budget))
+    topic_questions = service.questions_db.get(LEVEL, {}).get(topic, [])
+    served_set = set(served)
+    record("hash", "available_for_topic", measure(lambda: service._get_available_questions_for_topic(topic_questions, served_set), args.repeat, args.budget))
+
+    # In-memory questions_db fallback
+    start = time.perf_counter()
+    service.get_default_bank()
+    record("questions_db", "bank_build", {"runs": 1, "mean_us": round((time.perf_counter() - start) * 1e6, 2)})
+    record("questions_db", service.selection_engine.name, measure(
+        lambda: service.get_next_question(LEVEL, topic, served, theta=THETA), args.repeat, args.budget))
+    record("questions_db", "legacy", measure(
+        lambda: service.get_next_question(LEVEL, topic, served), args.repeat, args.budget))
+
+    # Session bank backed by SessionQuestion rows
+    db = SessionLocal()
+    try:
+        live_session = LiveSession(code=uuid.uuid4().hex[:6], title="Benchmark", status="running")
+        db.add(live_session)
+        db.commit()
+        live_id = live_session.live_id
+        seed_session_questions(live_id, questions)
+
+        start = time.perf_counter()
+        service.get_session_bank(live_id, db)
+        record("session", "bank_build", {"runs": 1, "mean_us": round((time.perf_counter() - start) * 1e6, 2)})
+        record("session", service.selection_engine.name, measure(
+            lambda: service.get_next_question(LEVEL, topic, served, live_id=live_id, db_session=db, theta=THETA), args.repeat, args.budget))
+        record("session", "legacy", measure(
+            lambda: service.get_next_question(LEVEL, topic, served, live_id=live_id, db_session=db), args.repeat, args.budget))
+    finally:
+        db.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10,100,1000,10000,50000", help="bank sizes")
+    parser.add_argument("--topics", default="1,10,100", help="topic counts")
+    parser.add_argument("--history", default="0,50,500", help="served-history lengths")
+    parser.add_argument("--repeat", type=int, default=200, help="max runs per measurement")
+    parser.add_argument("--budget", type=float, default=1.0, help="max seconds per measurement")
+    parser.add_argument("--output", help="write JSON results to this file instead of a table")
+    parser.add_argument("--json", action="store_true", help="print JSON results")
+    args = parser.parse_args()
+
+    # The app reads its configuration at import time
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='quiz-bench-')}/bench.db"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    from app.database import create_tables
+    create_tables()
+
+    random.seed(0)
+    results = []
+    for size in map(int, args.sizes.split(",")):
+        for topics in map(int, args.topics.split(",")):
+            if topics > size:
+                continue
+            for history in map(int, args.history.split(",")):
+                if history >= size:
+                    continue
+                results.extend(run_case(size, topics, history, args))
+
+    report = {"level": LEVEL, "theta": THETA, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif not args.output:
+        print(f"{'size':>7}{'topics':>8}{'served':>8}  {'path':<14}{'strategy':<24}{'runs':>6}{'mean us':>12}{'p95 us':>12}")
+        for r in results:
+            print(f"{r['bank_size']:>7}{r['topics']:>8}{r['served_history']:>8}  {r['path']:<14}{r['strategy']:<24}"
+                  f"{r['runs']:>6}{r['mean_us']:>12}{r.get('p95_us', ''):>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Session affinity check with several local worker processes.
+
+Starts N uvicorn workers on consecutive ports sharing one database, each with its
+own SHARD_URL. Every session is driven through randomly chosen workers - teacher
+and student sockets, joins, start, next and answer - and both sockets must get
+the session's broadcasts. Then the workers are asked which sessions they own:
+each session must have exactly one owner. Finally the owner of one session is
+killed and the session must keep working through the survivors once its lease
+expires.
+
+    cd backend && python -m benchmarks.shard_cluster --workers 3 --sessions 6 [--json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+LEASE_SECONDS = 3
+HEARTBEAT_SECONDS = 0.5
+
+
+def spawn(port: int, env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        env={**env, "SHARD_URL": f"http://127.0.0.1:{port}"},
+    )
+
+
+class Cluster:
+    def __init__(self, urls: List[str], client):
+        self.urls = urls
+        self.alive = list(urls)
+        self.client = client
+
+    def any(self) -> str:
+        return random.choice(self.alive)
+
+    async def call(self, method: str, path: str, retries: int = 20, **kwargs):
+        """Request through a random live worker, retrying while a session moves (503)"""
+        for _ in range(retries):
+            response = await self.client.request(method, self.any() + path, **kwargs)
+            if response.status_code != 503:
+                return response
+            await asyncio.sleep(0.25)
+        return response
+
+    async def owners(self) -> Dict[str, List[str]]:
+        owners: Dict[str, List[str]] = {}
+        for url in self.alive:
+            stats = (await self.client.get(f"{url}/api/shards")).json()
+            for live_id in stats["owned"]:
+                owners.setdefault(live_id, []).append(url)
+        return owners
+
+
+async def next_frame(ws, wanted: str, timeout: float = 15) -> Dict:
+    deadline = time.monotonic() + timeout
+    while True:
+        message = json.loads(await asyncio.wait_for(ws.recv(), deadline - time.monotonic()))
+        if message.get("type") == "ping":
+            await ws.send(json.dumps({"type": "pong"}))
+        elif message.get("type") == wanted:
+            return message
+
+
+async def drive_session(cluster: Cluster, index: int, failures: List[str]) -> Dict:
+    import websockets
+
+    session = (await cluster.client.post(f"{cluster.urls[index % len(cluster.urls)]}/api/live/create", json={"title": f"Shard {index}"})).json()
+    live_id, code = session["live_id"], session["code"]
+    joined = (await cluster.call("POST", f"/api/live/{code}/join", json={"nome": "Studente", "cognome": str(index)})).json()
+    participant_id = joined["participant_id"]
+    await asyncio.sleep(0.5)
+
+    teacher_url, student_url = cluster.any(), cluster.any()
+    async with websockets.connect(teacher_url.replace("http", "ws", 1) + f"/ws/teacher/{live_id}") as teacher, \
+            websockets.connect(student_url.replace("http", "ws", 1) + f"/ws/participant/{code}/{participant_id}") as student:
+        await next_frame(student, "resume.ok")
+        start = await cluster.call("POST", f"/api/live/{live_id}/start")
+        if start.status_code != 200:
+            failures.append(f"session {index}: start returned {start.status_code}")
+        await next_frame(student, "live.start")
+        # The teacher socket may be relayed by another worker: the owner's broadcast has to reach it too
+        try:
+            await next_frame(teacher, "live.start")
+        except asyncio.TimeoutError:
+            failures.append(f"session {index}: teacher via {teacher_url} never got live.start")
+        await next_frame(student, "round.start")
+        for _ in range(3):
+            answer = await cluster.call("POST", "/api/session/answer", json={
+                "participant_id": participant_id, "session_code": code, "answer_index": 0, "elapsed_ms": 1500
+            })
+            if answer.status_code != 200:
+                failures.append(f"session {index}: answer returned {answer.status_code} {answer.text}")
+            question = await cluster.call("POST", f"/api/session/next?participant_id={participant_id}&session_code={code}")
+            if question.status_code != 200:
+                failures.append(f"session {index}: next returned {question.status_code} {question.text}")
+    return {"live_id": live_id, "code": code, "participant_id": participant_id, "teacher_via": teacher_url, "student_via": student_url}
+
+
+async def run(args, urls: List[str], processes: Dict[str, subprocess.Popen]) -> Dict:
+    import httpx
+
+    failures: List[str] = []
+    async with httpx.AsyncClient(timeout=30, trust_env=False) as client:
+        cluster = Cluster(urls, client)
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                members = [len((await client.get(f"{url}/api/shards")).json()["members"]) for url in urls]
+                if all(count == len(urls) for count in members):
+                    break
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError("workers did not form the ring")
+            await asyncio.sleep(0.2)
+
+        sessions = await asyncio.gather(*(drive_session(cluster, i, failures) for i in range(args.sessions)))
+        owners = await cluster.owners()
+        for session in sessions:
+            held_by = owners.get(session["live_id"], [])
+            if len(held_by) != 1:
+                failures.append(f"session {session['code']} owned by {held_by}")
+        spread = {url: sum(1 for held in owners.values() if url in held) for url in urls}
+        stats = {url: (await client.get(f"{url}/api/shards")).json() for url in urls}
+
+        # Failover: kill the owner of the first session without letting it release its leases
+        victim = sessions[0]
+        dead = owners[victim["live_id"]][0]
+        processes[dead].send_signal(signal.SIGKILL)
+        processes[dead].wait()
+        cluster.alive.remove(dead)
+        killed_at = time.monotonic()
+        question = await cluster.call("POST", f"/api/session/next?participant_id={victim['participant_id']}&session_code={victim['code']}", retries=int(4 * (LEASE_SECONDS + 5)))
+        failover_seconds = time.monotonic() - killed_at
+        # Any answer from the application (even "no more questions") means a survivor took the session over
+        if question.status_code >= 500:
+            failures.append(f"failover: next returned {question.status_code} {question.text}")
+        new_owner = (await cluster.owners()).get(victim["live_id"], [])
+        if len(new_owner) != 1 or dead in new_owner:
+            failures.append(f"failover: session owned by {new_owner} after killing {dead}")
+
+    return {
+        "workers": len(urls),
+        "sessions": len(sessions),
+        "owned_per_worker": spread,
+        "forwarded": {url: stats[url]["forwarded"] for url in urls},
+        "relayed": {url: stats[url]["relayed"] for url in urls},
+        "failover": {"killed": dead, "new_owner": new_owner, "seconds": round(failover_seconds, 2)},
+        "failures": failures,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--sessions", type=int, default=6)
+    parser.add_argument("--port", type=int, default=8101, help="port of the first worker")
+    parser.add_argument("--database-url", help="shared database (default: a temporary SQLite file)")
+    parser.add_argument("--json", action="store_true", help="machine-readable output")
+    args = parser.parse_args()
+
+    database_url = args.database_url or f"sqlite:///{tempfile.mkdtemp(prefix='quiz-shards-')}/shards.db"
+    env = {
+        **os.environ,
+        "DATABASE_URL": database_url,
+        "AUTO_MIGRATE": "0",
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+        "ROUND_SECONDS": "60",
+        "SHARD_LEASE_SECONDS": str(LEASE_SECONDS),
+        "SHARD_HEARTBEAT_SECONDS": str(HEARTBEAT_SECONDS),
+    }
+    subprocess.run([sys.executable, "-m", "app.migrate"], env=env, check=True, stdout=subprocess.DEVNULL)
+
+    random.seed(0)
+    urls = [f"http://127.0.0.1:{args.port + i}" for i in range(args.workers)]
+    processes = {url: spawn(args.port + i, env) for i, url in enumerate(urls)}
+    try:
+        report = asyncio.run(run(args, urls, processes))
+    finally:
+        for process in processes.values():
+            if process.poll() is None:
+                process.terminate()
+                process.wait()
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print(f"{report['workers']} workers, {report['sessions']} sessions")
+        for url in urls:
+            print(f"  {url}  owns {report['owned_per_worker'][url]}  forwarded {report['forwarded'][url]}  relayed {report['relayed'][url]}")
+        failover = report["failover"]
+        print(f"failover: killed {failover['killed']}, new owner {failover['new_owner']} after {failover['seconds']}s")
+        for failure in report["failures"]:
+            print(f"FAIL: {failure}")
+    sys.exit(1 if report["failures"] else 0)
+
+
+if __name__ == "__main__":
+    main()
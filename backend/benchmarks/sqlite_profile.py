@@ -0,0 +1,177 @@
+"""
+Answer-submission throughput on SQLite: tuned profile vs basic defaults.
+
+Each worker process (think `uvicorn --workers N`) runs threads that repeat the
+write transaction of POST /api/session/answer - read the progress row, insert a
+LiveAnswer, update the progress row, commit - interleaved with report-style reads.
+Reports transactions/s, commit latency percentiles and "database is locked" errors
+for each SQLITE_PROFILE.
+
+    cd backend && python -m benchmarks.sqlite_profile --workers 4 --threads 4 --seconds 10 [--json]
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, List
+
+PROFILES = ("basic", "tuned")
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def configure(url: str, profile: str):
+    os.environ["DATABASE_URL"] = url
+    os.environ["SQLITE_PROFILE"] = profile
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+
+def seed(url: str, profile: str, participants: int) -> Dict:
+    configure(url, profile)
+    from app.adaptive_engine import INITIAL_THETA_SCORE
+    from app.database import SessionLocal, create_tables
+    from app.models import LiveParticipant, LiveSession, Participant, ParticipantProgress
+
+    create_tables()
+    db = SessionLocal()
+    try:
+        live_session = LiveSession(code=uuid.uuid4().hex[:6], title="SQLite benchmark", status="running")
+        db.add(live_session)
+        db.commit()
+        live_id = live_session.live_id
+        ids = [str(uuid.uuid4()) for _ in range(participants)]
+        db.add_all([Participant(participant_id=pid, nome="n", cognome="c") for pid in ids])
+        db.flush()
+        db.add_all([LiveParticipant(live_id=live_id, participant_id=pid) for pid in ids])
+        db.add_all([
+            ParticipantProgress(participant_id=pid, live_id=live_id, current_level='base', theta=INITIAL_THETA_SCORE,
+                                topic=None, correct_streak=0, total_served=0)
+            for pid in ids
+        ])
+        db.commit()
+        return {"live_id": live_id, "participants": ids}
+    finally:
+        db.close()
+
+
+def worker(url: str, profile: str, live_id: str, participants: List[str], threads: int, seconds: float, results):
+    configure(url, profile)
+    from sqlalchemy.exc import OperationalError
+
+    from app.database import SessionLocal
+    from app.models import LiveAnswer, ParticipantProgress
+    from app.reports import build_report
+
+    latencies: List[float] = []
+    counts = {"commits": 0, "reads": 0, "locked": 0, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def run():
+        rng = random.Random()
+        local, local_counts = [], {"commits": 0, "reads": 0, "locked": 0, "errors": 0}
+        while time.monotonic() < deadline:
+            db = SessionLocal()
+            try:
+                if rng.random() < 0.05:
+                    build_report(db, live_id)
+                    local_counts["reads"] += 1
+                    continue
+                participant_id = rng.choice(participants)
+                start = time.perf_counter()
+                progress = db.query(ParticipantProgress).filter(
+                    ParticipantProgress.participant_id == participant_id,
+                    ParticipantProgress.live_id == live_id
+                ).first()
+                correct = rng.random() < 0.6
+                db.add(LiveAnswer(live_id=live_id, participant_id=participant_id, question_json={"q": "benchmark"},
+                                  answer_index=rng.randrange(4), correct=correct, elapsed_ms=rng.randint(1000, 20000)))
+                progress.correct_streak = progress.correct_streak + 1 if correct else 0
+                db.commit()
+                local.append(time.perf_counter() - start)
+                local_counts["commits"] += 1
+            except OperationalError as e:
+                db.rollback()
+                local_counts["locked" if "locked" in str(e) else "errors"] += 1
+            finally:
+                db.close()
+        with lock:
+            latencies.extend(local)
+            for key, value in local_counts.items():
+                counts[key] += value
+
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    results.put({"latencies": latencies, **counts})
+
+
+def run_profile(profile: str, args) -> Dict:
+    url = f"sqlite:///{tempfile.mkdtemp(prefix=f'quiz-sqlite-{profile}-')}/bench.db"
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        seeded = pool.apply(seed, (url, profile, args.participants))
+
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=worker, args=(url, profile, seeded["live_id"], seeded["participants"], args.threads, args.seconds, results))
+        for _ in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    parts = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    latencies = [value for part in parts for value in part["latencies"]]
+    totals = {key: sum(part[key] for part in parts) for key in ("commits", "reads", "locked", "errors")}
+    return {
+        **totals,
+        "commits_per_second": round(totals["commits"] / args.seconds, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4, help="processes, like uvicorn workers")
+    parser.add_argument("--threads", type=int, default=4, help="concurrent transactions per process")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--participants", type=int, default=500)
+    parser.add_argument("--profiles", default=",".join(PROFILES))
+    parser.add_argument("--json", action="store_true", help="machine-readable output")
+    args = parser.parse_args()
+
+    report = {
+        "config": {"workers": args.workers, "threads": args.threads, "seconds": args.seconds},
+        "profiles": {profile: run_profile(profile, args) for profile in args.profiles.split(",")},
+    }
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return
+
+    print(f"{args.workers} workers x {args.threads} threads, {args.seconds}s")
+    print(f"{'profile':<10}{'commits/s':>11}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'locked':>8}{'errors':>8}{'reads':>8}")
+    for profile, r in report["profiles"].items():
+        print(f"{profile:<10}{r['commits_per_second']:>11}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{r['locked']:>8}{r['errors']:>8}{r['reads']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Cold-start budget for a worker: time to import app.main and to run its lifespan
+startup, each measured in a fresh interpreter as an autoscaled instance would.
+
+Exits with status 1 when the median import or startup time exceeds its budget, or
+when importing the app pulls in a module that should only load on first use
+(openai, PyPDF2), so it can run as a CI check.
+
+    cd backend && python -m benchmarks.startup --runs 5 --import-budget-ms 1500 --startup-budget-ms 300 [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List
+
+LAZY_MODULES = ("openai", "PyPDF2")
+
+CHILD = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+
+async def startup():
+    async with app.main.app.router.lifespan_context(app.main.app):
+        return time.perf_counter()
+
+started = asyncio.run(startup())
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "startup_ms": (started - imported) * 1000,
+    "eager": [name for name in %r if name in sys.modules],
+}))
+"""
+
+
+def run_child(env: Dict[str, str], importtime: bool = False) -> subprocess.CompletedProcess:
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", CHILD % (LAZY_MODULES,)]
+    return subprocess.run(command, env=env, capture_output=True, text=True, check=True)
+
+
+def slowest_imports(stderr: str, top: int) -> List[Dict]:
+    """Modules imported by the child and by app.main itself, by cumulative -X importtime"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:
+            rows.append({"module": name.strip(), "cumulative_ms": round(int(cumulative) / 1000, 1)})
+    rows.sort(key=lambda row: row["cumulative_ms"], reverse=True)
+    return rows[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget-ms", type=float, default=1500)
+    parser.add_argument("--startup-budget-ms", type=float, default=300)
+    parser.add_argument("--migrate", action="store_true", help="create the schema during startup (AUTO_MIGRATE=1)")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    parser.add_argument("--json", action="store_true", help="machine-readable output")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="quiz-startup-")
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{workdir}/startup.db",
+        "AUTO_MIGRATE": "1" if args.migrate else "0",
+        "LOG_LEVEL": "ERROR",
+    }
+    # Warm the bytecode cache so every run measures the same thing
+    run_child(env)
+    samples = [json.loads(run_child(env).stdout) for _ in range(args.runs)]
+    profile = run_child(env, importtime=True)
+
+    import_ms = statistics.median(s["import_ms"] for s in samples)
+    startup_ms = statistics.median(s["startup_ms"] for s in samples)
+    eager = sorted({name for s in samples for name in s["eager"]})
+    failures = []
+    if import_ms > args.import_budget_ms:
+        failures.append(f"import {import_ms:.0f} ms over budget {args.import_budget_ms:.0f} ms")
+    if startup_ms > args.startup_budget_ms:
+        failures.append(f"startup {startup_ms:.0f} ms over budget {args.startup_budget_ms:.0f} ms")
+    if eager:
+        failures.append(f"imported eagerly: {', '.join(eager)}")
+
+    report = {
+        "runs": args.runs,
+        "import_ms": round(import_ms, 1),
+        "startup_ms": round(startup_ms, 1),
+        "budgets_ms": {"import": args.import_budget_ms, "startup": args.startup_budget_ms},
+        "eager_imports": eager,
+        "slowest_imports": slowest_imports(profile.stderr, args.top),
+        "failures": failures,
+    }
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        print(f"import app.main  {report['import_ms']:>8} ms  (budget {args.import_budget_ms:.0f})")
+        print(f"lifespan startup {report['startup_ms']:>8} ms  (budget {args.startup_budget_ms:.0f})")
+        print("slowest imports:")
+        for entry in report["slowest_imports"]:
+            print(f"  {entry['module']:<28}{entry['cumulative_ms']:>8} ms")
+        for failure in failures:
+            print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
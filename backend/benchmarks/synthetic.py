@@ -0,0 +1,49 @@
+"""Synthetic question banks shared by the benchmarks"""
+from typing import Dict, List
+
+from app.adaptive_engine import LEVELS
+
+
+def synthetic_questions(count: int, topics: int = 5) -> List[Dict]:
+    """`count` well-formed questions spread evenly over levels, difficulties and topics"""
+    return [
+        {
+            "topic": f"Argomento {i % topics}",
+            "level": LEVELS[i % len(LEVELS)],
+            "difficulty": 1 + i % 3,
+            "question": f"Domanda sintetica numero {i}?",
+            "options": [f"A. Opzione {i}-1", f"B. Opzione {i}-2", f"C. Opzione {i}-3", f"D. Opzione {i}-4"],
+            "answer_index": i % 4,
+            "explain_brief": "Spiegazione breve.",
+            "explain_detailed": "Spiegazione dettagliata della risposta corretta.",
+            "source_refs": ["Banca sintetica"],
+        }
+        for i in range(count)
+    ]
+
+
+def seed_session_questions(live_id: str, questions: List[Dict]):
+    """Insert questions as the session bank of live_id in one executemany"""
+    from sqlalchemy import insert
+
+    from app.database import SessionLocal
+    from app.models import SessionQuestion
+    from app.question_service import question_service
+
+    rows = [
+        {
+            "live_id": live_id,
+            "question_data": question,
+            "question_hash": question_service.generate_question_hash(question),
+            "level": question["level"],
+            "topic": question["topic"],
+        }
+        for question in questions
+    ]
+    db = SessionLocal()
+    try:
+        db.execute(insert(SessionQuestion), rows)
+        db.commit()
+    finally:
+        db.close()
+    question_service.invalidate_session_bank(live_id)
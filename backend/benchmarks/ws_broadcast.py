@@ -0,0 +1,132 @@
+"""
+Bytes on the wire and CPU per broadcast for each WebSocket codec.
+
+Connects N in-memory sockets to one session and sends the frames a live quiz
+produces: the lobby roster, live.start, one round.start per participant and a
+round.timeout. The deflated size approximates permessage-deflate without context
+takeover, the setting uvicorn negotiates by default.
+
+    cd backend && python -m benchmarks.ws_broadcast --sockets 500 [--json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+import uuid
+import zlib
+
+from app.question_service import question_service
+from app.websocket_manager import ConnectionManager
+from app.ws_codecs import CODECS
+
+
+class CountingSocket:
+    """Stands in for a Starlette WebSocket, counting what would go on the wire"""
+
+    def __init__(self, subprotocol: str):
+        self.scope = {"subprotocols": [subprotocol]}
+        self.sent = []
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, text: str):
+        self.sent.append(text.encode())
+
+    async def send_bytes(self, data: bytes):
+        self.sent.append(data)
+
+
+def deflated_size(data: bytes) -> int:
+    compressor = zlib.compressobj(wbits=-15)
+    # permessage-deflate strips the trailing 00 00 ff ff of the sync flush
+    return len(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+
+
+def scenario(participants, questions):
+    roster = [{"participant_id": pid, "nome": f"Nome{i}", "cognome": f"Cognome{i}"} for i, pid in enumerate(participants)]
+    timeout = {
+        "correct": False,
+        "next_action": "explanation_required",
+        "explanation": "Tempo scaduto. Leggi la spiegazione dettagliata prima di continuare.",
+        "explain_detailed": questions[0][1].get('explain_detailed'),
+        "total_served": 3,
+        "current_level": "base",
+        "theta": 38
+    }
+    return [
+        ("lobby.update", None, {"type": "lobby.update", "participants": roster}),
+        ("live.start", None, {"type": "live.start", "message": "Session started"}),
+        ("round.start", "each", lambda i: {
+            "type": "round.start",
+            "question": question_service.get_payload(*questions[i % len(questions)]),
+            "timer": 30,
+            "question_number": 1
+        }),
+        ("round.timeout", "each", lambda i: {"type": "round.timeout", "result": timeout}),
+    ]
+
+
+async def run_codec(codec, sockets: int, questions):
+    manager = ConnectionManager()
+    session_code = "000000"
+    participants = [str(uuid.uuid4()) for _ in range(sockets)]
+    conns = []
+    for pid in participants:
+        ws = CountingSocket(codec.subprotocol)
+        await manager.connect_participant(ws, session_code, pid)
+        conns.append(ws)
+
+    results = {}
+    for name, target, message in scenario(participants, questions):
+        for ws in conns:
+            ws.sent.clear()
+        start_cpu, start_wall = time.process_time(), time.perf_counter()
+        if target is None:
+            await manager.broadcast_to_session("live", message, session_code=session_code)
+        else:
+            for i, pid in enumerate(participants):
+                await manager.send_to_participant(pid, message(i), session_code=session_code)
+        cpu, wall = time.process_time() - start_cpu, time.perf_counter() - start_wall
+        frames = [data for ws in conns for data in ws.sent]
+        results[name] = {
+            "frames": len(frames),
+            "bytes": sum(len(data) for data in frames),
+            "deflated_bytes": sum(deflated_size(data) for data in frames),
+            "cpu_ms": round(cpu * 1000, 3),
+            "wall_ms": round(wall * 1000, 3),
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sockets", type=int, default=500)
+    parser.add_argument("--json", action="store_true", help="machine-readable output")
+    args = parser.parse_args()
+
+    bank = question_service.get_default_bank()
+    questions = list(zip(bank.hashes, bank.questions))
+
+    report = {"sockets": args.sockets, "codecs": {}}
+    # Counting the frames is the point here, not the connection log lines
+    logging.getLogger("app").setLevel(logging.WARNING)
+    for name, codec in CODECS.items():
+        report["codecs"][name] = asyncio.run(run_codec(codec, args.sockets, questions))
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return
+
+    print(f"{args.sockets} sockets")
+    print(f"{'codec':<14}{'message':<15}{'frames':>8}{'bytes':>12}{'deflated':>12}{'cpu ms':>10}")
+    for name, results in report["codecs"].items():
+        for message, r in results.items():
+            print(f"{name:<14}{message:<15}{r['frames']:>8}{r['bytes']:>12}{r['deflated_bytes']:>12}{r['cpu_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+import os
+import tempfile
+
+import pytest
+
+# app.database builds its engines on import, so the test database is chosen first
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='quiz-tests-'), 'quiz_app.db')}"
+
+
+@pytest.fixture
+def db():
+    from app.database import SessionLocal, create_tables
+
+    create_tables()
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
@@ -0,0 +1,100 @@
+import random
+
+import numpy as np
+import pytest
+
+from app.adaptive_engine import (
+    INITIAL_THETA_SCORE, PRIOR_MEAN, THETA_SCORE_SCALE, AbilityEstimator, ItemBank, MaxInformationEngine,
+    SelectionEngine, level_for_theta, score_to_theta, theta_to_score
+)
+
+
+def make_bank(size: int, topics=("Generale",)) -> ItemBank:
+    questions = [
+        {
+            "question": f"q{i}", "options": ["a", "b", "c", "d"], "answer_index": 0,
+            "level": "medio", "topic": topics[i % len(topics)], "irt_b": -3.0 + 6.0 * i / size
+        }
+        for i in range(size)
+    ]
+    return ItemBank(questions, [f"h{i}" for i in range(size)])
+
+
+def test_initial_score_is_the_prior_mean():
+    assert INITIAL_THETA_SCORE == theta_to_score(PRIOR_MEAN)
+    # Scores are whole numbers, so the prior mean comes back to within half a point
+    assert abs(score_to_theta(INITIAL_THETA_SCORE) - PRIOR_MEAN) <= 0.5 / THETA_SCORE_SCALE + 1e-9
+    assert level_for_theta(score_to_theta(INITIAL_THETA_SCORE)) == 'base'
+    assert theta_to_score(-10.0) == 0 and theta_to_score(10.0) == 100
+    for score in range(0, 101, 5):
+        assert theta_to_score(score_to_theta(score)) == score
+
+
+def test_no_responses_give_the_prior_mean():
+    assert AbilityEstimator().estimate([], []) == pytest.approx(PRIOR_MEAN, abs=0.01)
+
+
+def simulate(true_theta: float, seed: int, items: int = 50) -> float:
+    """Final estimate of a simulated examinee answering the most informative items"""
+    rng = np.random.default_rng(seed)
+    estimator = AbilityEstimator()
+    bank = make_bank(400)
+    engine = MaxInformationEngine(top_k=1)
+    theta, served, params, responses = PRIOR_MEAN, set(), [], []
+    for _ in range(items):
+        index = engine.select(bank, theta, served)
+        served.add(bank.hashes[index])
+        params.append((bank.a[index], bank.b[index], bank.c[index]))
+        responses.append(bool(rng.random() < bank.probability(true_theta, [index])[0]))
+        theta = estimator.estimate(params, responses)
+    return theta
+
+
+@pytest.mark.parametrize("true_theta", [-2.5, 0.5, 1.5])
+def test_estimate_moves_toward_the_simulated_ability(true_theta):
+    estimates = [simulate(true_theta, seed) for seed in range(8)]
+    # The prior pulls the estimate back a little, so it ends within a third of where it started
+    assert np.mean([abs(theta - true_theta) for theta in estimates]) < abs(PRIOR_MEAN - true_theta) / 3
+
+
+def test_items_are_never_served_twice():
+    random.seed(1)
+    bank = make_bank(1200)
+    engine = MaxInformationEngine()
+    served = set()
+    for _ in range(len(bank)):
+        index = engine.select(bank, 0.3, served)
+        assert bank.hashes[index] not in served
+        served.add(bank.hashes[index])
+    assert engine.select(bank, 0.3, served) is None
+
+
+def test_topic_is_respected_until_it_runs_out():
+    random.seed(2)
+    bank = make_bank(600, topics=("A", "B", "C"))
+    engine = MaxInformationEngine()
+    served = set()
+    for _ in range(200):
+        index = engine.select(bank, 0.0, served, topic="B")
+        assert bank.questions[index]["topic"] == "B"
+        served.add(bank.hashes[index])
+    # No B left: any other topic is used
+    index = engine.select(bank, 0.0, served, topic="B")
+    assert bank.questions[index]["topic"] != "B"
+
+
+def test_falls_back_to_the_whole_bank_when_the_window_is_used_up():
+    random.seed(3)
+    bank = make_bank(40)
+    engine = MaxInformationEngine(top_k=3, window=4)
+    # Serve everything near theta 0 so the window around it has fewer than top_k items left
+    position = int(np.searchsorted(bank.sorted_peak, 0.0))
+    near = bank.peak_order[max(0, position - 4):position + 4]
+    served = {bank.hashes[i] for i in near}
+    index = engine.select(bank, 0.0, served)
+    assert index is not None and bank.hashes[index] not in served
+
+
+def test_selection_engine_is_abstract():
+    with pytest.raises(TypeError):
+        SelectionEngine()
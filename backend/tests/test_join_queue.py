@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from app import join_queue as join_queue_module
+from app.join_queue import JoinQueue
+from app.models import LiveParticipant, LiveSession, Participant, ParticipantProgress
+
+
+@pytest.fixture
+def batches():
+    """(live_id, participant_ids) of every on_batch call"""
+    return []
+
+
+@pytest.fixture
+def queue(monkeypatch, batches):
+    monkeypatch.setattr(join_queue_module, "JOIN_BATCH_SIZE", 3)
+    monkeypatch.setattr(join_queue_module, "JOIN_BATCH_INTERVAL", 0)
+    queue = JoinQueue()
+
+    async def on_batch(db, live_id, joins):
+        batches.append((live_id, [join.participant_id for join in joins]))
+    queue.on_batch = on_batch
+    return queue
+
+
+def live_session(db, code: str) -> str:
+    session = LiveSession(code=code, title=code)
+    db.add(session)
+    db.commit()
+    return session.live_id
+
+
+def test_joins_are_inserted_in_batches(db, queue, batches):
+    first, second = live_session(db, "910001"), live_session(db, "910002")
+
+    async def scenario():
+        joins = [
+            queue.enqueue(live_id, code, f"nome{i}", "cognome")
+            for i, (live_id, code) in enumerate([(first, "910001"), (second, "910002")] * 3 + [(first, "910001")])
+        ]
+        positions = [queue.position(join) for join in joins]
+        status = queue.status(joins[-1].participant_id)
+        await queue._task
+        return joins, positions, status
+
+    joins, positions, status = asyncio.run(scenario())
+    assert positions == list(range(1, 8))
+    assert status == {"status": "queued", "position": 7, "queue_depth": 7}
+
+    # 7 joins in batches of 3, one on_batch call per session in each batch
+    assert queue.batches == 3
+    ids = [join.participant_id for join in joins]
+    assert batches == [
+        (first, [ids[0], ids[2]]), (second, [ids[1]]),
+        (second, [ids[3], ids[5]]), (first, [ids[4]]),
+        (first, [ids[6]])
+    ]
+    assert all(queue.status(pid) is None for pid in ids)
+    assert queue.depth() == 0 and queue.stats()["sessions"] == {}
+    assert db.query(Participant).filter(Participant.participant_id.in_(ids)).count() == 7
+    assert db.query(LiveParticipant).filter(LiveParticipant.live_id == first).count() == 4
+    assert db.query(ParticipantProgress).filter(ParticipantProgress.live_id == second).count() == 3
+
+
+def test_a_failing_join_does_not_sink_its_batch(db, queue, batches):
+    live_id = live_session(db, "910003")
+
+    async def scenario():
+        joins = [queue.enqueue(live_id, "910003", f"nome{i}", "cognome") for i in range(3)]
+        # The second participant_id is taken before the batch runs
+        db.add(Participant(participant_id=joins[1].participant_id, nome="altro", cognome="altro"))
+        db.commit()
+        await queue._task
+        return joins
+
+    joins = asyncio.run(scenario())
+    assert batches == [(live_id, [joins[0].participant_id, joins[2].participant_id])]
+    joined = {row.participant_id for row in db.query(LiveParticipant).filter(LiveParticipant.live_id == live_id)}
+    assert joined == {joins[0].participant_id, joins[2].participant_id}
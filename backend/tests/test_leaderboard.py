@@ -0,0 +1,106 @@
+import asyncio
+import bisect
+import random
+
+import pytest
+
+from app import leaderboard as leaderboard_module
+from app.leaderboard import IndexableSkipList, Leaderboard, Leaderboards
+
+
+def test_skip_list_matches_a_sorted_list():
+    rng = random.Random(7)
+    ranking = IndexableSkipList()
+    expected = []
+    for _ in range(3000):
+        if expected and rng.random() < 0.4:
+            key = rng.choice(expected)
+            ranking.remove(key)
+            expected.remove(key)
+        else:
+            key = (rng.randint(0, 50), rng.random())
+            ranking.insert(key)
+            bisect.insort(expected, key)
+        assert len(ranking) == len(expected)
+
+    assert list(ranking.iter_from(0)) == expected
+    for position, key in enumerate(expected):
+        assert ranking.rank(key) == position
+    for start in (0, 1, len(expected) // 2, len(expected) - 1, len(expected)):
+        assert list(ranking.iter_from(start)) == expected[start:]
+    missing = (25, 2.0)
+    assert ranking.rank(missing) == bisect.bisect_left(expected, missing)
+
+
+def test_skip_list_remove_missing_key():
+    ranking = IndexableSkipList()
+    ranking.insert(1)
+    with pytest.raises(KeyError):
+        ranking.remove(2)
+    assert len(ranking) == 1
+
+
+def test_changes_carry_only_shifted_ranks():
+    board = Leaderboard.build([("a", 30, 3, 100), ("b", 25, 2, 100), ("c", 20, 1, 100), ("d", 10, 0, 100)])
+    # A rebuilt board is sent in full on its first push
+    assert [(entry["participant_id"], entry["rank"]) for entry in board.changes()] == [("a", 1), ("b", 2), ("c", 3), ("d", 4)]
+    assert board.changes() == []
+    assert [entry["participant_id"] for entry in board.top(4)] == ["a", "b", "c", "d"]
+
+    # c overtakes b: a and d keep their rank and are not sent again
+    board.set("c", 28, 2, 150)
+    changes = board.changes()
+    assert [(entry["participant_id"], entry["rank"]) for entry in changes] == [("c", 2), ("b", 3)]
+    assert board.changes() == []
+
+
+def test_newcomer_shifts_everyone_below():
+    board = Leaderboard.build([("a", 30, 3, 100), ("b", 20, 1, 100)])
+    board.changes()
+    board.record("c", 25, True, 500)
+    assert [(entry["participant_id"], entry["rank"]) for entry in board.changes()] == [("c", 2), ("b", 3)]
+    assert board.rank_of("b") == {"participant_id": "b", "rank": 3, "score": 20, "correct": 1, "elapsed_ms": 100}
+    assert board.rank_of("unknown") is None
+
+
+def test_changes_match_a_full_recomputation():
+    rng = random.Random(3)
+    board = Leaderboard()
+    published = {}
+    for _ in range(500):
+        participant_id = f"p{rng.randrange(40)}"
+        board.record(participant_id, rng.randint(0, 40), rng.random() < 0.5, rng.randint(100, 5000))
+        if rng.random() < 0.3:
+            for entry in board.changes():
+                published[entry["participant_id"]] = entry["rank"]
+            assert published == {entry["participant_id"]: entry["rank"] for entry in board.top(len(board.standings))}
+
+
+STANDINGS = [("a", 30, 3, 100), ("b", 20, 1, 100)]
+
+
+def record_first_answer(monkeypatch, held: bool) -> Leaderboards:
+    monkeypatch.setattr(leaderboard_module.shards, "holds", lambda live_id: held)
+    boards = Leaderboards()
+    monkeypatch.setattr(boards, "query", lambda db, live_id: Leaderboard.build(STANDINGS, "123456"))
+
+    async def scenario():
+        boards.record(None, "live", "a", 30, True, 100)
+        boards._task.cancel()
+    asyncio.run(scenario())
+    return boards
+
+
+def test_first_answer_with_a_lease_is_pushed(monkeypatch):
+    boards = record_first_answer(monkeypatch, held=True)
+    assert boards.dirty == {"live"}
+    assert [entry["participant_id"] for entry in boards.sessions["live"].changes()] == ["a", "b"]
+
+
+def test_board_is_not_kept_without_a_lease(monkeypatch):
+    boards = record_first_answer(monkeypatch, held=False)
+    assert boards.dirty == {"live"} and boards.sessions == {}
+    assert [entry["participant_id"] for entry in boards.reread("live").changes()] == ["a", "b"]
+    # The ranks sent are remembered across reads, so unchanged standings send nothing
+    assert boards.reread("live").changes() == []
+    assert boards.sessions == {}
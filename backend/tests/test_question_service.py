@@ -0,0 +1,40 @@
+import asyncio
+
+from app.adaptive_engine import ItemBank
+from app.question_service import QuestionService
+
+QUESTION = {"question": "Domanda", "options": ["a", "b"], "answer_index": 0, "level": "base", "topic": "Generale"}
+
+
+def test_session_bank_is_built_once_off_the_loop(monkeypatch):
+    service = QuestionService()
+    builds = []
+
+    def build(live_id):
+        builds.append(live_id)
+        return ItemBank([QUESTION], ["h"])
+    monkeypatch.setattr(service, "_build_session_bank", build)
+
+    async def scenario():
+        return await asyncio.gather(*(service.load_session_bank("live") for _ in range(5)))
+
+    banks = asyncio.run(scenario())
+    assert builds == ["live"]
+    assert all(bank is banks[0] for bank in banks)
+    assert service.get_session_bank("live", None) is banks[0]
+
+
+def test_session_bank_changed_while_building_is_rebuilt(monkeypatch):
+    service = QuestionService()
+    builds = []
+
+    def build(live_id):
+        builds.append(live_id)
+        if len(builds) == 1:
+            # An import commits while the first build reads the rows
+            service.invalidate_session_bank(live_id)
+        return ItemBank([QUESTION] * len(builds), [f"h{i}" for i in range(len(builds))])
+    monkeypatch.setattr(service, "_build_session_bank", build)
+
+    bank = asyncio.run(service.load_session_bank("live"))
+    assert len(builds) == 2 and len(bank) == 2
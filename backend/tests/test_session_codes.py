@@ -0,0 +1,24 @@
+from app.session_codes import CODE_SPACE, CodePermutation, SessionCodes
+
+
+def test_permutation_is_a_bijection():
+    permutation = CodePermutation(bytes.fromhex("00112233445566778899aabbccddeeff"))
+    codes = [permutation(n) for n in range(CODE_SPACE)]
+    assert all(0 <= code < CODE_SPACE for code in codes)
+    assert len(set(codes)) == CODE_SPACE
+
+
+def test_permutation_depends_on_the_key():
+    first = CodePermutation(b"first key")
+    second = CodePermutation(b"second key")
+    assert [first(n) for n in range(100)] != [second(n) for n in range(100)]
+    assert [first(n) for n in range(100)] == [CodePermutation(b"first key")(n) for n in range(100)]
+
+
+def test_allocate_formats_six_digits_and_wraps():
+    codes = SessionCodes(block=4)
+    codes.permutation = CodePermutation(b"key")
+    codes.next, codes.end = CODE_SPACE - 2, CODE_SPACE + 2
+    allocated = [codes.allocate() for _ in range(4)]
+    assert all(len(code) == 6 and code.isdigit() for code in allocated)
+    assert allocated[2:] == [f"{codes.permutation(0):06d}", f"{codes.permutation(1):06d}"]
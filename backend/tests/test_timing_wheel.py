@@ -0,0 +1,73 @@
+import asyncio
+import random
+
+from app.timing_wheel import TimingWheel
+
+# Long ticks, so the wheel's own task never moves the clock while a test drives it
+TICK = 1000.0
+
+
+def run_wheel(scenario, slots: int = 4, levels: int = 3):
+    async def main():
+        wheel = TimingWheel(lambda expired: None, tick=TICK, slots=slots, levels=levels)
+        try:
+            return scenario(wheel)
+        finally:
+            wheel._task.cancel()
+    return asyncio.run(main())
+
+
+def fire_times(wheel: TimingWheel, ticks: int):
+    fired = {}
+    for _ in range(ticks):
+        for payload in wheel.advance():
+            assert payload not in fired
+            fired[payload] = wheel.current
+    return fired
+
+
+def test_timers_cascade_down_and_fire_on_their_tick():
+    def scenario(wheel):
+        for key, ticks in (("near", 2), ("mid", 6), ("far", 40)):
+            wheel.schedule(key, ticks * TICK, key)
+        levels = {key: timer.level for key, timer in wheel.timers.items()}
+        return levels, fire_times(wheel, 64), len(wheel)
+
+    levels, fired, pending = run_wheel(scenario)
+    assert levels == {"near": 0, "mid": 1, "far": 2}
+    assert fired == {"near": 2, "mid": 6, "far": 40}
+    assert pending == 0
+
+
+def test_random_delays_fire_exactly_once_on_time():
+    rng = random.Random(11)
+    delays = {f"t{i}": rng.randint(1, 63) for i in range(500)}
+
+    def scenario(wheel):
+        for key, ticks in delays.items():
+            wheel.schedule(key, ticks * TICK, key)
+        return fire_times(wheel, 64)
+
+    assert run_wheel(scenario) == delays
+
+
+def test_timers_beyond_the_top_level_wait_for_their_tick():
+    def scenario(wheel):
+        wheel.schedule("beyond", 20 * TICK, "beyond")
+        return fire_times(wheel, 24)
+
+    # 2 levels of 4 slots span 16 ticks
+    assert run_wheel(scenario, slots=4, levels=2) == {"beyond": 20}
+
+
+def test_reschedule_and_cancel():
+    def scenario(wheel):
+        wheel.schedule("a", 3 * TICK, "first")
+        wheel.schedule("a", 9 * TICK, "second")
+        wheel.schedule("b", 5 * TICK, "b")
+        assert wheel.cancel("b") == "b"
+        assert wheel.cancel("b") is None
+        assert "a" in wheel and "b" not in wheel
+        return fire_times(wheel, 16)
+
+    assert run_wheel(scenario) == {"second": 9}
@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from app.ws_codecs import Codec, JsonCodec, MsgPackCodec, Preencoded, msgpack
+
+QUESTION = {"question": "Quanto fa 2+2?", "options": ["3", "4", "5"], "answer_index": 1, "level": "base", "topic": "è"}
+
+
+def message(fields: int):
+    """A question message with `fields` top-level keys, the payload among them"""
+    value = {"type": "question", "question": Preencoded(QUESTION), "seq": 7}
+    for i in range(fields - len(value)):
+        value[f"extra_{i}"] = [i, None, {"nested": True}]
+    return value
+
+
+def plain(value):
+    return {key: field.value if isinstance(field, Preencoded) else field for key, field in value.items()}
+
+
+@pytest.mark.parametrize("fields", [3, 15, 16, 40])
+def test_json_splice_matches_dumps(fields):
+    codec = JsonCodec()
+    value = message(fields)
+    frame = codec.encode(value)
+    assert json.loads(frame) == plain(value)
+    assert frame == codec.dumps(plain(value))
+
+
+def test_preencoded_is_encoded_once_per_codec():
+    codec = JsonCodec()
+    payload = Preencoded(QUESTION)
+    first = codec.encode({"type": "question", "question": payload})
+    payload.value = {"changed": True}
+    assert codec.encode({"type": "question", "question": payload}) == first
+    assert list(payload.encoded) == [codec.subprotocol]
+
+
+@pytest.mark.skipif(msgpack is None, reason="msgpack is not installed")
+@pytest.mark.parametrize("fields", [3, 15, 16, 40])
+def test_msgpack_splice_unpacks_to_the_message(fields):
+    codec = MsgPackCodec()
+    value = message(fields)
+    frame = codec.encode(value)
+    assert msgpack.unpackb(frame) == plain(value)
+    assert frame == codec.dumps(plain(value))
+    assert frame[0] == (0xde if fields >= 16 else 0x80 | fields)
+
+
+def test_codec_is_abstract():
+    with pytest.raises(TypeError):
+        Codec()
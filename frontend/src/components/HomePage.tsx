@@ -9,6 +9,18 @@ import { PDFUpload } from './PDFUpload'
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000'
 
+// Joins are queued: the participant exists only once the server reports it admitted
+async function waitUntilAdmitted(code: string, participantId: string): Promise<boolean> {
+  for (let attempt = 0; attempt < 100; attempt++) {
+    const response = await fetch(`${API_URL}/api/live/${code}/join/${participantId}`)
+    if (!response.ok) return false
+    const status = await response.json()
+    if (status.status === 'admitted') return true
+    await new Promise(resolve => setTimeout(resolve, 300))
+  }
+  return false
+}
+
 export default function HomePage() {
   const navigate = useNavigate()
   const [sessionCode, setSessionCode] = useState('')
@@ -39,7 +51,11 @@ export default function HomePage() {
 
       if (response.ok) {
         const participant = await response.json()
-        navigate(`/student/${sessionCode}?participantId=${participant.participant_id}`)
+        if (await waitUntilAdmitted(sessionCode, participant.participant_id)) {
+          navigate(`/student/${sessionCode}?participantId=${participant.participant_id}`)
+        } else {
+          alert('Errore durante l\'accesso alla sessione')
+        }
       } else {
         const error = await response.json()
         alert(error.detail || 'Errore durante l\'accesso alla sessione')
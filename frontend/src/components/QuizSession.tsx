@@ -1,10 +1,11 @@
-import { useState, useEffect, useCallback } from 'react'
+import { useState, useEffect, useCallback, useRef } from 'react'
 import { useParams } from 'react-router-dom'
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card'
 import { Button } from '@/components/ui/button'
 import { Badge } from '@/components/ui/badge'
 import { Progress } from '@/components/ui/progress'
 import { Clock, CheckCircle, XCircle, BookOpen } from 'lucide-react'
+import { acceptFrame, answerPing, participantSocketUrl, reconnectDelay } from '@/lib/live-socket'
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000'
 
@@ -15,7 +16,7 @@ interface Question {
   question: string
   options: string[]
   explain_brief: string
-  explain_detailed: string
+  explain_detailed?: string
   source_refs: string[]
 }
 
@@ -23,6 +24,7 @@ interface AnswerResponse {
   correct: boolean
   next_action: string
   explanation?: string
+  explain_detailed?: string
   total_served: number
   current_level: string
   theta: number
@@ -38,6 +40,7 @@ export default function QuizSession() {
   const [timeLeft, setTimeLeft] = useState(30)
   const [loading, setLoading] = useState(false)
   const [finished, setFinished] = useState(false)
+  const hasQuestionRef = useRef(false)
 
   const getNextQuestion = useCallback(async () => {
     if (!code || !participantId) {
@@ -57,6 +60,7 @@ export default function QuizSession() {
       if (response.ok) {
         const question = await response.json()
         console.log('Received question:', question)
+        hasQuestionRef.current = true
         setCurrentQuestion(question)
         setTimeLeft(30)
         setSelectedAnswer(null)
@@ -104,6 +108,10 @@ export default function QuizSession() {
         } else if (result.next_action === 'finished') {
           setFinished(true)
         }
+      } else if (response.status === 409) {
+        // The round timed out or was already answered: retrying cannot succeed
+        console.log('Answer rejected, question no longer open:', await response.text())
+        getNextQuestion()
       } else {
         console.error('Answer submission failed:', response.status, await response.text())
         if (retryCount < 2) {
@@ -122,7 +130,7 @@ export default function QuizSession() {
     } finally {
       setLoading(false)
     }
-  }, [code, participantId, selectedAnswer, timeLeft])
+  }, [code, participantId, selectedAnswer, timeLeft, getNextQuestion])
 
   useEffect(() => {
     if (!code || !participantId) return
@@ -135,8 +143,7 @@ export default function QuizSession() {
     const connect = () => {
       if (!isComponentMounted) return
 
-      const WS_URL = import.meta.env.VITE_WS_URL || 'ws://localhost:8000'
-      const wsUrl = `${WS_URL}/ws/participant/${code}/${participantId}`
+      const wsUrl = participantSocketUrl(code, participantId)
       
       try {
         ws = new WebSocket(wsUrl)
@@ -152,16 +159,38 @@ export default function QuizSession() {
           
           try {
             const data = JSON.parse(event.data)
+            if (answerPing(event.target as WebSocket, data)) return
             console.log(`Quiz received message:`, data.type)
+            if (!acceptFrame(code, participantId, data)) return
             
             switch (data.type) {
+              case 'resume.ok':
+                // Missed frames have been replayed; only fetch over HTTP if none carried a question
+                if (!hasQuestionRef.current) {
+                  getNextQuestion()
+                }
+                break
+              case 'resume.reset':
+                // Frames were lost: the question on screen may be stale, reload the open one
+                getNextQuestion()
+                break
               case 'round.start':
+                hasQuestionRef.current = true
                 setCurrentQuestion(data.question)
                 setTimeLeft(data.timer || 30)
                 setSelectedAnswer(null)
                 setShowResult(false)
                 setShowExplanation(false)
                 break
+              case 'round.timeout':
+                setLastResult(data.result)
+                setShowResult(true)
+                if (data.result.next_action === 'explanation_required') {
+                  setShowExplanation(true)
+                } else if (data.result.next_action === 'finished') {
+                  setFinished(true)
+                }
+                break
               case 'live.end':
                 setFinished(true)
                 break
@@ -177,7 +206,7 @@ export default function QuizSession() {
           console.log(`Quiz WebSocket closed for participant ${participantId}:`, event.code, event.reason)
           
           if (event.code !== 1000 && reconnectAttempts < 5) {
-            const delay = Math.min(1000 * Math.pow(2, reconnectAttempts), 10000)
+            const delay = reconnectDelay(reconnectAttempts)
             console.log(`Quiz attempting to reconnect in ${delay}ms (attempt ${reconnectAttempts + 1}/5)`)
             
             reconnectTimeout = setTimeout(() => {
@@ -196,7 +225,7 @@ export default function QuizSession() {
       } catch (error) {
         console.error('Error creating Quiz WebSocket:', error)
         if (isComponentMounted && reconnectAttempts < 5) {
-          const delay = Math.min(1000 * Math.pow(2, reconnectAttempts), 10000)
+          const delay = reconnectDelay(reconnectAttempts)
           reconnectTimeout = setTimeout(() => {
             if (isComponentMounted) {
               reconnectAttempts++
@@ -208,7 +237,6 @@ export default function QuizSession() {
     }
 
     connect()
-    getNextQuestion()
 
     return () => {
       isComponentMounted = false
@@ -319,7 +347,7 @@ export default function QuizSession() {
               <div>
                 <h3 className="font-semibold mb-2">Spiegazione Dettagliata:</h3>
                 <p className="text-gray-700 leading-relaxed">
-                  {currentQuestion.explain_detailed}
+                  {lastResult?.explain_detailed ?? currentQuestion.explain_detailed}
                 </p>
               </div>
 
@@ -3,6 +3,7 @@ import { useParams, useSearchParams, useNavigate } from 'react-router-dom'
 import { Card, CardContent, CardHeader, CardTitle } from '@/components/ui/card'
 import { Badge } from '@/components/ui/badge'
 import { Users, Clock, Wifi } from 'lucide-react'
+import { acceptFrame, answerPing, participantSocketUrl, reconnectDelay } from '@/lib/live-socket'
 
 interface Participant {
   participant_id: string
@@ -28,12 +29,12 @@ export default function StudentLobby() {
     let ws: WebSocket | null = null
     let reconnectTimeout: NodeJS.Timeout | null = null
     let isComponentMounted = true
+    let handedOff = false
 
     const connect = () => {
       if (!isComponentMounted) return
 
-      const WS_URL = import.meta.env.VITE_WS_URL || 'ws://localhost:8000'
-      const wsUrl = `${WS_URL}/ws/participant/${code}/${participantId}`
+      const wsUrl = participantSocketUrl(code, participantId)
       
       try {
         ws = new WebSocket(wsUrl)
@@ -46,11 +47,14 @@ export default function StudentLobby() {
         }
 
         ws.onmessage = (event) => {
-          if (!isComponentMounted) return
+          if (!isComponentMounted || handedOff) return
           
           try {
             const data = JSON.parse(event.data)
+            if (answerPing(event.target as WebSocket, data)) return
             console.log(`Student received message:`, data.type)
+            // round.start is left unacknowledged so the quiz socket gets it replayed
+            if (!acceptFrame(code, participantId, data, data.type !== 'round.start')) return
             
             switch (data.type) {
               case 'lobby.update':
@@ -61,6 +65,7 @@ export default function StudentLobby() {
                 setCountdown(data.countdown)
                 break
               case 'round.start':
+                handedOff = true
                 navigate(`/quiz/${code}/${participantId}`)
                 break
             }
@@ -76,7 +81,7 @@ export default function StudentLobby() {
           console.log(`Student WebSocket closed for session ${code}:`, event.code, event.reason)
           
           if (event.code !== 1000 && reconnectAttempts < 5) {
-            const delay = Math.min(1000 * Math.pow(2, reconnectAttempts), 10000) // Exponential backoff, max 10s
+            const delay = reconnectDelay(reconnectAttempts)
             console.log(`Attempting to reconnect in ${delay}ms (attempt ${reconnectAttempts + 1}/5)`)
             
             reconnectTimeout = setTimeout(() => {
@@ -95,7 +100,7 @@ export default function StudentLobby() {
       } catch (error) {
         console.error('Error creating WebSocket:', error)
         if (isComponentMounted && reconnectAttempts < 5) {
-          const delay = Math.min(1000 * Math.pow(2, reconnectAttempts), 10000)
+          const delay = reconnectDelay(reconnectAttempts)
           reconnectTimeout = setTimeout(() => {
             if (isComponentMounted) {
               setReconnectAttempts(prev => prev + 1)
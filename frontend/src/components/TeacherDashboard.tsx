@@ -5,6 +5,7 @@ import { Button } from '@/components/ui/button'
 import { Badge } from '@/components/ui/badge'
 import { Progress } from '@/components/ui/progress'
 import { Users, Play, Pause, Square, Lock, BarChart3 } from 'lucide-react'
+import { answerPing } from '@/lib/live-socket'
 
 const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000'
 
@@ -77,6 +78,7 @@ export default function TeacherDashboard() {
 
     ws.onmessage = (event) => {
       const data = JSON.parse(event.data)
+      if (answerPing(ws, data)) return
       
       switch (data.type) {
         case 'lobby.update':
@@ -0,0 +1,54 @@
+const WS_URL = import.meta.env.VITE_WS_URL || 'ws://localhost:8000'
+
+interface ResumeState {
+  epoch: string
+  seq: number
+}
+
+const storageKey = (code: string, participantId: string) => `quiz-live:resume:${code}:${participantId}`
+
+export function loadResumeState(code: string, participantId: string): ResumeState | null {
+  const raw = sessionStorage.getItem(storageKey(code, participantId))
+  return raw ? JSON.parse(raw) : null
+}
+
+function saveResumeState(code: string, participantId: string, state: ResumeState) {
+  sessionStorage.setItem(storageKey(code, participantId), JSON.stringify(state))
+}
+
+// Socket URL carrying the resume handshake, so the server replays what was missed
+export function participantSocketUrl(code: string, participantId: string): string {
+  const base = `${WS_URL}/ws/participant/${code}/${participantId}`
+  const state = loadResumeState(code, participantId)
+  return state ? `${base}?epoch=${state.epoch}&last_seq=${state.seq}` : base
+}
+
+// Records the sequence number of a frame; returns false for frames already seen.
+// With record=false the frame is left unacknowledged and is replayed to the next socket.
+export function acceptFrame(code: string, participantId: string, data: { type: string; seq?: number; epoch?: string }, record = true): boolean {
+  const state = loadResumeState(code, participantId)
+
+  if (data.type === 'resume.ok' || data.type === 'resume.reset') {
+    const sameEpoch = state !== null && state.epoch === data.epoch
+    const seq = data.type === 'resume.ok' && sameEpoch ? Math.max(state.seq, data.seq ?? 0) : data.seq ?? 0
+    saveResumeState(code, participantId, { epoch: data.epoch as string, seq })
+    return true
+  }
+
+  if (data.seq === undefined) return true
+  if (state && data.seq <= state.seq) return false
+  if (state && record) saveResumeState(code, participantId, { ...state, seq: data.seq })
+  return true
+}
+
+// The server pings every socket and closes the ones that stay silent, so pings are answered
+export function answerPing(ws: WebSocket, data: { type: string }): boolean {
+  if (data.type !== 'ping') return false
+  ws.send(JSON.stringify({ type: 'pong' }))
+  return true
+}
+
+// Exponential backoff with full jitter, so a whole classroom does not reconnect in lockstep
+export function reconnectDelay(attempt: number): number {
+  return Math.random() * Math.min(1000 * Math.pow(2, attempt), 10000)
+}